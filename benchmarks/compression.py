@@ -0,0 +1,62 @@
+"""
+Compares the output compression algorithms on a large step output: the size
+of the output in the step, the time to compress it once when it's published
+and the time to decode it, which is paid again in every later request of
+the run.
+
+    python -m benchmarks.compression
+"""
+
+import json
+from functools import partial
+from typing import Any, List, Optional
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.history import _OutputFormat, _decode_output
+from benchmarks.utils import DEFAULT_OUTPUT, measure, print_table
+
+# about 500 KB as JSON
+OUTPUT = [dict(DEFAULT_OUTPUT, id=f"item_{index}") for index in range(300)]
+
+
+def main() -> None:
+    codec = StdlibJsonCodec()
+    out = json.dumps(OUTPUT)
+    rows: List[List[Any]] = []
+
+    for algorithm in (None, "zlib", "lzma", "zstd"):
+        compressed_out: str = out
+        output_compression: Optional[str] = None
+        compress_ms = 0.0
+        if algorithm is not None:
+            try:
+                compression = OutputCompression(threshold=0, algorithm=algorithm)
+            except ImportError as error:
+                print(f"skipping {algorithm}: {error}")
+                continue
+            compressed_out, output_compression = compression._compress_output(
+                "step", out
+            )
+            compress_ms = compression.stats.seconds * 1000
+
+        output_format = _OutputFormat(encoding="json", compression=output_compression)
+        decode_ms = measure(
+            partial(_decode_output, compressed_out, output_format, "step", codec)
+        )
+        rows.append(
+            [
+                algorithm or "none",
+                len(json.dumps(compressed_out)),
+                f"{len(out) / len(compressed_out):.1f}x",
+                f"{compress_ms:.1f}",
+                f"{decode_ms:.1f}",
+            ]
+        )
+
+    print_table(
+        ["compression", "bytes in step", "ratio", "compress ms", "decode ms"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures the size of the headers published with every step when the
+workflow is triggered by a browser through an API gateway, with and without
+a `HeaderFilter`.
+
+    python -m benchmarks.headers
+"""
+
+from typing import Any, List, Optional
+from upstash_workflow.types import DefaultStep, HeaderFilter, Step
+from upstash_workflow.workflow_requests import _get_headers, _recreate_user_headers
+from benchmarks.utils import print_table
+
+INCOMING_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Accept-Language": "en-US,en;q=0.9,de;q=0.8",
+    "Authorization": "Bearer " + "a" * 600,
+    "Cookie": "; ".join(f"cookie_{index}={'c' * 40}" for index in range(20)),
+    "Content-Type": "application/json",
+    "Origin": "https://app.example.com",
+    "Referer": "https://app.example.com/dashboard/projects/123/settings",
+    "Sec-Ch-Ua": '"Chromium";v="130", "Google Chrome";v="130", "Not?A_Brand";v="99"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"macOS"',
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
+    "Via": "1.1 gateway.example.com",
+    "X-Amzn-Trace-Id": "Root=1-67891233-abcdef012345678912345678",
+    "X-Request-Id": "7f1c2b3a-1d2e-4f5a-8b9c-0d1e2f3a4b5c",
+    "X-Tenant-Id": "tenant-123",
+}
+
+FILTERS = {
+    "none": None,
+    "deny": HeaderFilter(deny=["cookie", "sec-*", "accept*", "user-agent", "via"]),
+    "allow": HeaderFilter(allow=["authorization", "content-type", "x-tenant-id"]),
+}
+
+
+def _header_bytes(header_filter: Optional[HeaderFilter]) -> int:
+    step: DefaultStep = Step(
+        step_id=1, step_name="step", step_type="Run", out=None, concurrent=1
+    )
+    headers = _get_headers(
+        "false",
+        "wfr_0123456789",
+        "https://app.example.com/api/workflow",
+        _recreate_user_headers(INCOMING_HEADERS, header_filter),
+        step,
+        workflow_failure_url="https://app.example.com/api/workflow",
+    ).headers
+    return sum(len(header) + len(value) for header, value in headers.items())
+
+
+def main() -> None:
+    rows: List[List[Any]] = []
+    for name, header_filter in FILTERS.items():
+        forwarded = _recreate_user_headers(INCOMING_HEADERS, header_filter)
+        rows.append([name, len(forwarded), _header_bytes(header_filter)])
+
+    print_table(["filter", "forwarded headers", "header bytes per step"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares the memory held by a fully decoded step history, stored in the
+columnar `_StepHistory` and as a list of `Step` dataclasses.
+
+Both are measured with `tracemalloc` after every step is decoded, once with
+small outputs where the per-step overhead dominates, and once with the
+default benchmark output.
+
+    python -m benchmarks.history_memory
+"""
+
+import gc
+import tracemalloc
+from typing import Any, Callable, List
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.workflow_parser import _parse_payload
+from benchmarks.utils import DEFAULT_OUTPUT, get_history_payload, print_table
+
+
+def _columnar(payload: str) -> Any:
+    _, history = _parse_payload(payload, StdlibJsonCodec())
+    for index in range(len(history)):
+        history.step_out(index)
+    return history
+
+
+def _dataclasses(payload: str) -> Any:
+    _, history = _parse_payload(payload, StdlibJsonCodec())
+    return [history[index] for index in range(len(history))]
+
+
+def _measure(build: Callable[[str], Any], payload: str) -> float:
+    """
+    Returns the memory in MB held by the result of `build`.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build(payload)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / 1e6
+
+
+def main() -> None:
+    rows: List[List[Any]] = []
+    for output_name, output in (("small", 1), ("default", DEFAULT_OUTPUT)):
+        for step_count in (1000, 10000):
+            payload = get_history_payload(step_count, output=output)
+            dataclasses = _measure(_dataclasses, payload)
+            columnar = _measure(_columnar, payload)
+            rows.append(
+                [
+                    output_name,
+                    step_count,
+                    f"{dataclasses:.2f}",
+                    f"{columnar:.2f}",
+                    f"{dataclasses / columnar:.2f}x",
+                ]
+            )
+
+    print_table(
+        ["output", "steps", "list of Step MB", "columnar MB", "reduction"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
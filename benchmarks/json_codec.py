@@ -0,0 +1,68 @@
+"""
+Compares the per-request cost of the available JSON codecs on large histories.
+
+A request is modelled as: parsing the history, decoding every step while
+replaying, encoding the output of the new step and encoding the response.
+
+    python -m benchmarks.json_codec
+"""
+
+from functools import partial
+from typing import List, Any
+from upstash_workflow.codec import (
+    JsonCodec,
+    StdlibJsonCodec,
+    OrjsonCodec,
+    MsgspecCodec,
+)
+from upstash_workflow.workflow_parser import _parse_payload
+from upstash_workflow.workflow_types import _Response
+from benchmarks.utils import DEFAULT_OUTPUT, get_history_payload, measure, print_table
+
+
+def _get_codecs() -> List[JsonCodec]:
+    codecs: List[JsonCodec] = [StdlibJsonCodec()]
+    for codec_class in (OrjsonCodec, MsgspecCodec):
+        try:
+            codecs.append(codec_class())
+        except ImportError as error:
+            print(f"skipping {codec_class.__name__}: {error}")
+    return codecs
+
+
+def _run_request(payload: str, codec: JsonCodec) -> None:
+    _, steps = _parse_payload(payload, codec)
+    # indexing the history decodes the steps and their outputs
+    list(steps)
+    codec.dumps(DEFAULT_OUTPUT)
+    _Response({"workflowRunId": "wfr_id"}, json_codec=codec)
+
+
+def main() -> None:
+    codecs = _get_codecs()
+    rows: List[List[Any]] = []
+    for step_count in (100, 1000, 2000):
+        payload = get_history_payload(step_count)
+        baseline = None
+        for codec in codecs:
+            elapsed = measure(partial(_run_request, payload, codec))
+            baseline = baseline or elapsed
+            rows.append(
+                [
+                    step_count,
+                    f"{len(payload) / 1e6:.1f}",
+                    type(codec).__name__,
+                    f"{elapsed:.1f}",
+                    f"{baseline - elapsed:.1f}",
+                    f"{baseline / elapsed:.2f}x",
+                ]
+            )
+
+    print_table(
+        ["steps", "MB", "codec", "ms/request", "saved ms", "speedup"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Measures how long parsing a large step history blocks the event loop, with
+parsing on the event loop and with `ParseOffload` using a thread pool and a
+process pool.
+
+While a request is parsed, a ticker task sleeps for 1ms in a loop and records
+how late it wakes up. The largest delay is the longest event loop stall that
+another request handled by the same worker would have experienced.
+
+    python -m benchmarks.parse_offload
+"""
+
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, List, Optional
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.workflow_types import _AsyncRequest
+from upstash_workflow.asyncio.offload import ParseOffload
+from upstash_workflow.asyncio.workflow_parser import _parse_request_stream
+from benchmarks.utils import get_history_payload, print_table
+
+TICK = 0.001
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkedRequest(_AsyncRequest):
+    async def stream(self) -> AsyncIterator[bytes]:
+        for start in range(0, len(self._body), CHUNK_SIZE):
+            yield self._body[start : start + CHUNK_SIZE]
+
+
+async def _ticker(stalls: List[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        stalls.append(time.perf_counter() - start - TICK)
+
+
+async def _handle(body: bytes, parse_offload: Optional[ParseOffload]) -> None:
+    codec = StdlibJsonCodec()
+    if parse_offload is None:
+        _, response = await _parse_request_stream(
+            _ChunkedRequest(_body=body), codec, keep_body=False
+        )
+        assert response is not None
+        list(response.steps)
+    else:
+        await parse_offload._parse_request(body, None, None, codec)
+
+
+async def _measure(body: bytes, parse_offload: Optional[ParseOffload]) -> List[Any]:
+    # warm up the executor so that starting workers isn't measured
+    await _handle(body, parse_offload)
+
+    stalls: List[float] = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(stalls, stop))
+    await asyncio.sleep(TICK * 5)
+
+    start = time.perf_counter()
+    await _handle(body, parse_offload)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    return [f"{elapsed * 1000:.1f}", f"{max(stalls) * 1000:.1f}"]
+
+
+async def _run() -> None:
+    rows: List[List[Any]] = []
+    executors: List[Optional[Executor]] = [
+        None,
+        ThreadPoolExecutor(max_workers=1),
+        ProcessPoolExecutor(max_workers=1),
+    ]
+    for step_count in (500, 2000):
+        body = get_history_payload(step_count).encode()
+        for executor in executors:
+            parse_offload = (
+                None if executor is None else ParseOffload(0, executor=executor)
+            )
+            name = "event loop" if executor is None else type(executor).__name__
+            rows.append(
+                [step_count, f"{len(body) / 1e6:.1f}", name]
+                + await _measure(body, parse_offload)
+            )
+
+    for executor in executors:
+        if executor is not None:
+            executor.shutdown()
+
+    print_table(["steps", "MB", "parsed in", "ms/request", "max stall ms"], rows)
+
+
+def main() -> None:
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Compares the step output serializers with JSON: the size of the output in the
+published step and the time to serialize and deserialize it.
+
+The size is measured after the output is embedded in the JSON step body,
+where a JSON output is escaped once more. Dataclass and pydantic outputs are
+compared with JSON encoding their fields, which returns a dict on replay,
+bytes and arrays with JSON encoding them as lists.
+
+    python -m benchmarks.serializers
+"""
+
+import json
+import os
+from functools import partial
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Tuple
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.serializers import (
+    SerializerRegistry,
+    StepSerializer,
+    JsonSerializer,
+    MsgpackSerializer,
+    BytesSerializer,
+    NumpySerializer,
+    DataclassSerializer,
+    PydanticSerializer,
+)
+from benchmarks.utils import DEFAULT_OUTPUT, measure, print_table
+
+
+@dataclass
+class Nested:
+    ok: bool
+    count: int
+    missing: Any
+
+
+@dataclass
+class Output:
+    id: str
+    text: str
+    scores: List[float]
+    tags: List[str]
+    nested: Nested
+
+
+def _get_outputs() -> List[Tuple[str, Any, List[StepSerializer]]]:
+    json_serializer = JsonSerializer()
+    fields: Dict[str, Any] = DEFAULT_OUTPUT
+    outputs: List[Tuple[str, Any, List[StepSerializer]]] = []
+
+    plain_serializers: List[StepSerializer] = [json_serializer]
+    try:
+        plain_serializers.append(MsgpackSerializer())
+    except ImportError as error:
+        print(f"skipping MsgpackSerializer: {error}")
+    outputs.append(("dict", DEFAULT_OUTPUT, plain_serializers))
+
+    dataclass_output = Output(**{**fields, "nested": Nested(**fields["nested"])})
+    SerializerRegistry(types=[Output])
+    outputs.append(("dataclass", dataclass_output, [DataclassSerializer()]))
+
+    try:
+        from pydantic import BaseModel
+
+        class PydanticNested(BaseModel):
+            ok: bool
+            count: int
+            missing: Any
+
+        class PydanticOutput(BaseModel):
+            id: str
+            text: str
+            scores: List[float]
+            tags: List[str]
+            nested: PydanticNested
+
+        SerializerRegistry(types=[PydanticOutput])
+        outputs.append(("pydantic", PydanticOutput(**fields), [PydanticSerializer()]))
+    except ImportError as error:
+        print(f"skipping PydanticSerializer: {error}")
+
+    outputs.append(("bytes", os.urandom(16 * 1024), [BytesSerializer()]))
+
+    try:
+        import numpy
+
+        array = numpy.random.default_rng(0).random((64, 32))
+        outputs.append(("ndarray", array, [NumpySerializer()]))
+    except ImportError as error:
+        print(f"skipping NumpySerializer: {error}")
+
+    return outputs
+
+
+def _measure(serializer: StepSerializer, value: Any) -> List[Any]:
+    codec = StdlibJsonCodec()
+    out, out_type = serializer.serialize(value, codec)
+    deserialize = partial(serializer.deserialize, out, out_type, codec)
+
+    return [
+        type(serializer).__name__,
+        len(json.dumps(out)),
+        f"{measure(lambda: serializer.serialize(value, codec), number=1000) * 1000:.1f}",
+        f"{measure(deserialize, number=1000) * 1000:.1f}",
+    ]
+
+
+def _as_json(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return list(value)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value.model_dump() if hasattr(value, "model_dump") else asdict(value)
+
+
+def main() -> None:
+    rows: List[List[Any]] = []
+    for name, value, serializers in _get_outputs():
+        if name != "dict":
+            # baseline: the fields as JSON, which are a dict on replay
+            rows.append([name, *_measure(JsonSerializer(), _as_json(value))])
+        for serializer in serializers:
+            rows.append([name, *_measure(serializer, value)])
+
+    print_table(
+        ["output", "serializer", "bytes in step", "serialize us", "deserialize us"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import json
+import time
+import base64
+from typing import Any, Callable, List, Optional
+
+DEFAULT_OUTPUT = {
+    "id": "item_0123456789",
+    "text": "lorem ipsum dolor sit amet " * 40,
+    "scores": [index * 0.5 for index in range(64)],
+    "tags": ["alpha", "beta", "gamma"],
+    "nested": {"ok": True, "count": 42, "missing": None},
+}
+
+
+def _encode(value: str) -> str:
+    return base64.b64encode(value.encode()).decode()
+
+
+def get_history_payload(
+    step_count: int, output: Any = None, initial_payload: str = '{"input": "value"}'
+) -> str:
+    """
+    Creates a request body in the format QStash sends to a workflow endpoint,
+    with `step_count` Run steps returning `output`.
+    """
+    output = DEFAULT_OUTPUT if output is None else output
+    messages = [
+        {"messageId": "msg_0", "body": _encode(initial_payload), "callType": "step"}
+    ]
+    for step_id in range(1, step_count + 1):
+        step = {
+            "stepId": step_id,
+            "stepName": f"step-{step_id}",
+            "stepType": "Run",
+            "out": json.dumps(output),
+            "concurrent": 1,
+        }
+        messages.append(
+            {
+                "messageId": f"msg_{step_id}",
+                "body": _encode(json.dumps(step)),
+                "callType": "step",
+            }
+        )
+    return json.dumps(messages)
+
+
+def measure(function: Callable[[], Any], repeat: int = 5, number: int = 1) -> float:
+    """
+    Returns the best time in milliseconds of `repeat` measurements, each
+    running the function `number` times.
+    """
+    best: Optional[float] = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return (best or 0.0) * 1000
+
+
+def print_table(header: List[str], rows: List[List[Any]]) -> None:
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
@@ -1,7 +1,16 @@
+import asyncio
+import json
 import pytest
+from typing import List
 from qstash import AsyncQStash
-from upstash_workflow import AsyncWorkflowContext
-from upstash_workflow.error import WorkflowAbort
+from upstash_workflow import AsyncWorkflowContext, RunAheadPolicy
+from upstash_workflow.error import WorkflowAbort, WorkflowError
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.types import Step, DefaultStep
+from upstash_workflow.workflow_parser import _parse_payload
+from tests.test_context import _continue_as_new_request, _run_ahead_step
+from tests.test_workflow_parser import _get_payload
+from tests.asyncio.test_resume import _QStash
 from tests.utils import (
     RequestFields,
     ResponseFields,
@@ -103,3 +112,213 @@ async def test_workflow_headers(qstash_client: AsyncQStash) -> None:
             ],
         ),
     )
+
+
+@pytest.mark.asyncio
+async def test_continue_as_new(qstash_client: AsyncQStash) -> None:
+    context = AsyncWorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={"my-header": "my-value"},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload={"cursor": 1},
+        failure_url=None,
+    )
+
+    async def execute() -> None:
+        with pytest.raises(WorkflowAbort) as excinfo:
+            await context.continue_as_new({"cursor": 2})
+        assert excinfo.value.finish_workflow
+
+    await mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(
+            status=200, body='{"messageId": "msgId"}', raw=True
+        ),
+        receives_request=_continue_as_new_request({"cursor": 2}),
+    )
+
+
+def _parallel_context(
+    qstash_client: AsyncQStash, steps: List[DefaultStep]
+) -> AsyncWorkflowContext[str]:
+    initial_step: DefaultStep = Step(
+        step_id=0, step_name="init", step_type="Initial", out="payload", concurrent=1
+    )
+    return AsyncWorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[initial_step, *steps],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+    )
+
+
+def _plan_steps(count: int) -> List[DefaultStep]:
+    return [
+        Step(
+            step_id=0,
+            step_name=f"step{index}",
+            step_type="Run",
+            concurrent=count,
+            target_step=index,
+        )
+        for index in range(1, count + 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_parallel_steps_return_results_in_order(
+    qstash_client: AsyncQStash,
+) -> None:
+    # results may be received in any order
+    result_steps: List[DefaultStep] = [
+        Step(
+            step_id=index,
+            step_name=f"step{index}",
+            step_type="Run",
+            out=f"result{index}",
+            concurrent=2,
+        )
+        for index in (2, 1)
+    ]
+    context = _parallel_context(qstash_client, [*_plan_steps(2), *result_steps])
+
+    results = await asyncio.gather(
+        context.run("step1", lambda: "not-executed"),
+        context.run("step2", lambda: "not-executed"),
+    )
+
+    assert results == ["result1", "result2"]
+
+
+@pytest.mark.asyncio
+async def test_parallel_steps_discard_unfinished_results(
+    qstash_client: AsyncQStash,
+) -> None:
+    result_step: DefaultStep = Step(
+        step_id=1, step_name="step1", step_type="Run", out="result1", concurrent=2
+    )
+    context = _parallel_context(qstash_client, [*_plan_steps(2), result_step])
+
+    with pytest.raises(WorkflowAbort, match="'discarded parallel'"):
+        await asyncio.gather(
+            context.run("step1", lambda: "not-executed"),
+            context.run("step2", lambda: "not-executed"),
+        )
+
+
+@pytest.mark.asyncio
+async def test_parallel_steps_are_planned_in_a_single_batch() -> None:
+    qstash_client = _QStash()
+    context = _parallel_context(qstash_client, [])  # type: ignore[arg-type]
+    executed: List[str] = []
+
+    with pytest.raises(WorkflowAbort, match="'step1'"):
+        await asyncio.gather(
+            context.run("step1", lambda: executed.append("step1")),
+            context.run("step2", lambda: executed.append("step2")),
+        )
+
+    assert executed == []
+    assert len(qstash_client.message.batches) == 1
+    bodies = [
+        json.loads(message["body"]) for message in qstash_client.message.batches[0]
+    ]
+    assert [
+        (body["stepId"], body["stepName"], body["targetStep"], body["concurrent"])
+        for body in bodies
+    ] == [(0, "step1", 1, 2), (0, "step2", 2, 2)]
+
+
+@pytest.mark.asyncio
+async def test_parallel_step_targeted_by_plan_step_is_executed() -> None:
+    qstash_client = _QStash()
+    # the request is called for the plan step of step2
+    context = _parallel_context(qstash_client, _plan_steps(2))  # type: ignore[arg-type]
+    executed: List[str] = []
+
+    def step_function(step_name: str) -> str:
+        executed.append(step_name)
+        return f"result-{step_name}"
+
+    with pytest.raises(WorkflowAbort, match="'step2'"):
+        await asyncio.gather(
+            context.run("step1", lambda: step_function("step1")),
+            context.run("step2", lambda: step_function("step2")),
+        )
+
+    assert executed == ["step2"]
+    assert len(qstash_client.message.batches) == 1
+    [message] = qstash_client.message.batches[0]
+    body = json.loads(message["body"])
+    assert (body["stepId"], body["stepName"], body["concurrent"]) == (2, "step2", 2)
+    assert json.loads(body["out"]) == "result-step2"
+
+
+@pytest.mark.asyncio
+async def test_parallel_step_count_mismatch(qstash_client: AsyncQStash) -> None:
+    context = _parallel_context(qstash_client, _plan_steps(3))
+
+    with pytest.raises(WorkflowError, match="Expected 2, got 3"):
+        await asyncio.gather(
+            context.run("step1", lambda: "not-executed"),
+            context.run("step2", lambda: "not-executed"),
+        )
+
+
+@pytest.mark.asyncio
+async def test_run_ahead_keeps_results_until_budget(
+    qstash_client: AsyncQStash,
+) -> None:
+    context = AsyncWorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        run_ahead=RunAheadPolicy(max_steps=3),
+    )
+
+    async def execute() -> None:
+        # outputs are returned as they are replayed
+        assert await context.run("step1", lambda: (1, 2)) == [1, 2]
+        assert await context.run("step2", lambda: "result2") == "result2"
+
+    await mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(status=200, body="msgId"),
+        receives_request=False,
+    )
+    assert [step.step_name for step in context._executor._run_ahead_steps] == [
+        "step1",
+        "step2",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_ahead_batch_received_out_of_order() -> None:
+    qstash_client = _QStash()
+    _, steps = _parse_payload(
+        _get_payload("payload", [_run_ahead_step(2, run_ahead=False)]),
+        StdlibJsonCodec(),
+    )
+    context = AsyncWorkflowContext(
+        qstash_client=qstash_client,  # type: ignore[arg-type]
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=steps,
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        run_ahead=RunAheadPolicy(),
+    )
+
+    with pytest.raises(WorkflowAbort, match="'run-ahead'"):
+        await context.run("step1", lambda: "not-executed")
+    assert qstash_client.message.batches == []
@@ -0,0 +1,78 @@
+import contextvars
+import os
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from qstash import AsyncQStash
+from upstash_workflow import AsyncWorkflowContext, RunAheadPolicy
+from upstash_workflow.asyncio.pools import SyncStepOffload, _run_in_executor
+from upstash_workflow.error import WorkflowError
+from tests.utils import MOCK_QSTASH_SERVER_URL, WORKFLOW_ENDPOINT
+
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id")
+
+
+def _get_pid(offset: int) -> int:
+    return os.getpid() + offset
+
+
+@pytest.mark.asyncio
+async def test_steps_run_in_process_pool() -> None:
+    pid = await _run_in_executor("step", partial(_get_pid, 0), "process")()
+
+    assert pid != os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_steps_run_in_custom_executor() -> None:
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pid = await _run_in_executor("step", partial(_get_pid, 1), executor)()
+
+    assert pid == os.getpid() + 1
+
+
+def test_async_steps_cannot_run_in_executor() -> None:
+    async def step_function() -> None:
+        pass
+
+    with pytest.raises(WorkflowError, match="its function is async"):
+        _run_in_executor("step", step_function, "process")
+
+
+@pytest.mark.asyncio
+async def test_sync_steps_run_off_the_event_loop() -> None:
+    sync_step_offload = SyncStepOffload(max_workers=2)
+    context = AsyncWorkflowContext(
+        qstash_client=AsyncQStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL),
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        # keeps the results without publishing them
+        run_ahead=RunAheadPolicy(),
+        sync_step_offload=sync_step_offload,
+    )
+    _request_id.set("request-id")
+
+    async def fetch() -> str:
+        return "fetched"
+
+    def step_function() -> str:
+        return f"{_request_id.get()} {threading.current_thread().name}"
+
+    result = await context.run("step1", step_function)
+    assert result.startswith("request-id upstash-workflow-step")
+    # awaitables returned by the function are awaited on the event loop
+    assert await context.run("step2", lambda: fetch()) == "fetched"
+
+    async def async_step_function() -> bool:
+        return threading.current_thread() is threading.main_thread()
+
+    assert await context.run("step3", async_step_function)
+    assert sync_step_offload.stats.offloaded_steps == 2
+    assert sync_step_offload.stats.active_steps == 0
+    assert sync_step_offload.stats.max_active_steps == 1
+    assert 0 < sync_step_offload.utilization < 1
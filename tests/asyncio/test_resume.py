@@ -0,0 +1,82 @@
+import pytest
+from typing import Any, List
+from upstash_workflow import AsyncWorkflowContext, WorkflowAbort
+from upstash_workflow.asyncio.resume import WarmResumeCache
+from upstash_workflow.types import Step, DefaultStep
+from tests.utils import WORKFLOW_ENDPOINT
+
+
+class _Message:
+    def __init__(self) -> None:
+        self.batches: List[List[Any]] = []
+
+    async def batch(self, messages: List[Any]) -> List[Any]:
+        self.batches.append(messages)
+        return []
+
+
+class _QStash:
+    def __init__(self) -> None:
+        self.message = _Message()
+
+
+def _context(qstash_client: _QStash, outputs: List[str]) -> AsyncWorkflowContext[str]:
+    steps: List[DefaultStep] = [
+        Step(step_id=0, step_name="init", step_type="Initial", out="", concurrent=1),
+        *[
+            Step(
+                step_id=index,
+                step_name=f"step{index}",
+                step_type="Run",
+                out=output,
+                concurrent=1,
+            )
+            for index, output in enumerate(outputs, 1)
+        ],
+    ]
+    return AsyncWorkflowContext(
+        qstash_client=qstash_client,  # type: ignore[arg-type]
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=steps,
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="",
+        failure_url=None,
+    )
+
+
+@pytest.mark.asyncio
+async def test_warm_resume() -> None:
+    qstash_client = _QStash()
+    cache = WarmResumeCache()
+    started: List[int] = []
+    results: List[str] = []
+
+    async def route_function(context: AsyncWorkflowContext[str]) -> None:
+        started.append(1)
+        for index in (1, 2, 3):
+            results.append(await context.run(f"step{index}", lambda: "executed"))
+
+    with pytest.raises(WorkflowAbort, match="'step1'"):
+        await cache._run(_context(qstash_client, []), route_function)
+    assert len(cache) == 1
+
+    # resumed with the output in the history of the request
+    with pytest.raises(WorkflowAbort, match="'step2'"):
+        await cache._run(_context(qstash_client, ["output1"]), route_function)
+    assert started == [1]
+    assert results == ["output1"]
+
+    # a request of another history replays the route function
+    with pytest.raises(WorkflowAbort, match="'step2'"):
+        await cache._run(_context(qstash_client, ["output1"]), route_function)
+    assert len(started) == 2
+
+    await cache._run(
+        _context(qstash_client, ["output1", "output2", "output3"]), route_function
+    )
+    assert len(cache) == 0
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 3
+    assert cache.stats.evictions == 2
+    assert len(qstash_client.message.batches) == 3
@@ -0,0 +1,283 @@
+import json
+import threading
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional
+from upstash_workflow import AsyncWorkflowContext
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.constants import (
+    WORKFLOW_ID_HEADER,
+    WORKFLOW_PROTOCOL_VERSION,
+    WORKFLOW_PROTOCOL_VERSION_HEADER,
+)
+from upstash_workflow.error import WorkflowError
+from upstash_workflow.workflow_types import _AsyncRequest, _Response
+from upstash_workflow.asyncio.workflow_parser import (
+    _fetch_request_steps,
+    _parse_request_stream,
+)
+from upstash_workflow.asyncio.offload import ParseOffload
+from upstash_workflow.asyncio.serve.serve import serve
+from upstash_workflow.stores import BlobOffload, BlobStore
+from qstash import AsyncQStash, Receiver
+from tests.test_workflow_parser import _get_payload, _get_steps
+from tests.utils import (
+    RequestFields,
+    ResponseFields,
+    MOCK_QSTASH_SERVER_URL,
+    WORKFLOW_ENDPOINT,
+)
+from tests.asyncio.utils import mock_qstash_server
+
+
+class _ChunkedRequest(_AsyncRequest):
+    chunk_size: int = 5
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        for start in range(0, len(self._body), self.chunk_size):
+            yield self._body[start : start + self.chunk_size]
+
+
+@pytest.mark.asyncio
+async def test_parse_request_stream() -> None:
+    body = _get_payload(
+        '{"key": "value"}',
+        [
+            {
+                "stepId": step_id,
+                "stepName": f"step{step_id}",
+                "stepType": "Run",
+                "out": json.dumps({"result": step_id}),
+                "concurrent": 1,
+            }
+            for step_id in range(1, 4)
+        ],
+    ).encode()
+
+    request_payload, response = await _parse_request_stream(
+        _ChunkedRequest(_body=body), StdlibJsonCodec(), keep_body=True
+    )
+
+    assert request_payload == body
+    assert response is not None
+    assert response.raw_initial_payload == '{"key": "value"}'
+    # steps are only decoded when they are accessed
+    assert not response.steps._is_decoded(1)  # type: ignore[attr-defined]
+    assert [step.step_id for step in response.steps] == [0, 1, 2, 3]
+    assert response.steps[3].out == {"result": 3}
+
+    request_payload, _ = await _parse_request_stream(
+        _ChunkedRequest(_body=body), StdlibJsonCodec(), keep_body=False
+    )
+    assert request_payload == b""
+
+
+@pytest.mark.asyncio
+async def test_parse_request_stream_empty_body() -> None:
+    # steps are fetched from QStash after the request is verified
+    assert await _parse_request_stream(
+        _ChunkedRequest(_body=b""), StdlibJsonCodec(), keep_body=True
+    ) == (b"", None)
+
+    with pytest.raises(WorkflowError):
+        await _fetch_request_steps(None, "wfr-id", None, StdlibJsonCodec())
+
+
+class _RecordingStore(BlobStore):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.keys: List[str] = []
+        self.threads: List[threading.Thread] = []
+
+    def put(self, key: str, value: str) -> None:
+        pass
+
+    def get(self, key: str) -> Optional[str]:
+        self.keys.append(key)
+        self.threads.append(threading.current_thread())
+        return json.dumps("output")
+
+
+def _get_blob_payload(store: BlobStore) -> bytes:
+    return _get_payload(
+        "initial",
+        [
+            {
+                "stepId": step_id,
+                "stepName": f"step{step_id}",
+                "stepType": "Run",
+                "out": f"k{step_id}",
+                "outEncoding": "json",
+                "outBlob": store.name,
+                "concurrent": 1,
+            }
+            for step_id in (1, 2)
+        ],
+    ).encode()
+
+
+@pytest.mark.asyncio
+async def test_steps_are_not_decoded_before_verification() -> None:
+    store = _RecordingStore("unverified")
+    BlobOffload(store)
+    body = _get_blob_payload(store)
+
+    async def route_function(context: object) -> None:
+        pass
+
+    handler = serve(
+        route_function,
+        qstash_client=AsyncQStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL),
+        receiver=Receiver(
+            current_signing_key="current-signing-key-0123456789abcdef",
+            next_signing_key="next-signing-key-0123456789abcdefghi",
+        ),
+        url=WORKFLOW_ENDPOINT,
+    )["handler"]
+    response: _Response = await handler(
+        _ChunkedRequest(
+            _body=body,
+            headers={
+                WORKFLOW_PROTOCOL_VERSION_HEADER: WORKFLOW_PROTOCOL_VERSION,
+                WORKFLOW_ID_HEADER: "wfr-id",
+                "upstash-signature": "invalid",
+            },
+        )
+    )
+
+    assert "Failed to verify" in response.body
+    assert store.keys == []
+
+
+@pytest.mark.asyncio
+async def test_blob_outputs_are_read_off_the_event_loop_when_read() -> None:
+    store = _RecordingStore("off-loop")
+    BlobOffload(store)
+    body = _get_blob_payload(store)
+
+    _, response = await _parse_request_stream(
+        _ChunkedRequest(_body=body), StdlibJsonCodec(), keep_body=False
+    )
+    offloaded_response = await ParseOffload()._parse_request(
+        body, None, None, StdlibJsonCodec()
+    )
+    assert store.keys == []
+    assert offloaded_response.steps._has_blob(1)  # type: ignore[attr-defined]
+    assert response is not None
+
+    context = AsyncWorkflowContext(
+        qstash_client=AsyncQStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL),
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=response.steps,
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="initial",
+        failure_url=None,
+    )
+    assert await context.run("step1", lambda: "not-executed") == "output"
+
+    # only the output which is read is fetched
+    assert store.keys == ["k1"]
+    assert store.threads[0] is not threading.current_thread()
+
+
+@pytest.mark.asyncio
+async def test_parse_offload() -> None:
+    body = _get_payload(
+        "initial",
+        [
+            {
+                "stepId": 1,
+                "stepName": "step1",
+                "stepType": "Run",
+                "out": json.dumps({"result": 1}),
+                "concurrent": 1,
+            }
+        ],
+    ).encode()
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        parse_offload = ParseOffload(threshold=len(body), executor=executor)
+
+        assert not parse_offload._should_offload(
+            _AsyncRequest(headers={"content-length": str(len(body) - 1)})
+        )
+        assert not parse_offload._should_offload(_AsyncRequest(headers={}))
+        assert not parse_offload._should_offload(
+            _AsyncRequest(headers={"content-length": "not-a-number"})
+        )
+        assert parse_offload._should_offload(
+            _AsyncRequest(headers={"content-length": str(len(body))})
+        )
+
+        response = await parse_offload._parse_request(
+            body, None, None, StdlibJsonCodec()
+        )
+
+    assert response.raw_initial_payload == "initial"
+    assert response.steps._is_decoded(1)  # type: ignore[attr-defined]
+    assert response.steps[1].out == {"result": 1}
+
+    assert parse_offload.stats.inline_requests == 3
+    assert parse_offload.stats.inline_bytes == len(body) - 1
+    assert parse_offload.stats.offloaded_requests == 1
+    assert parse_offload.stats.offloaded_bytes == len(body)
+    assert parse_offload.stats.offloaded_seconds > 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_request_steps() -> None:
+    qstash_client = AsyncQStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL)
+    responses = []
+
+    async def execute() -> None:
+        responses.append(
+            await _fetch_request_steps(
+                qstash_client, "wfr-id", "msg-1", StdlibJsonCodec()
+            )
+        )
+
+    await mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(
+            body=_get_payload("initial", _get_steps(3)), status=200, raw=True
+        ),
+        receives_request=RequestFields(
+            method="GET",
+            url=f"{MOCK_QSTASH_SERVER_URL}/v2/workflows/runs/wfr-id",
+            token="mock-token",
+        ),
+    )
+
+    response = responses[0]
+    assert [step.step_id for step in response.steps] == [0, 1]
+    assert response.steps[1].out == {"result": 1}
+
+
+@pytest.mark.asyncio
+async def test_steps_are_not_fetched_before_verification() -> None:
+    async def route_function(context: object) -> None:
+        pass
+
+    handler = serve(
+        route_function,
+        # no QStash server is running, so a fetch would fail differently
+        qstash_client=AsyncQStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL),
+        receiver=Receiver(
+            current_signing_key="current-signing-key-0123456789abcdef",
+            next_signing_key="next-signing-key-0123456789abcdefghi",
+        ),
+        url=WORKFLOW_ENDPOINT,
+    )["handler"]
+    response: _Response = await handler(
+        _ChunkedRequest(
+            _body=b"",
+            headers={
+                WORKFLOW_PROTOCOL_VERSION_HEADER: WORKFLOW_PROTOCOL_VERSION,
+                WORKFLOW_ID_HEADER: "wfr-id",
+                "upstash-signature": "invalid",
+            },
+        )
+    )
+
+    assert "Failed to verify" in response.body
@@ -51,6 +51,13 @@ async def mock_qstash_server(
                 text=f"assertion in mock QStash failed: {str(error)}", status=400
             )
 
+        if response_fields.raw:
+            return web.Response(
+                text=response_fields.body,
+                status=response_fields.status,
+                content_type="application/json",
+            )
+
         return web.json_response(
             data=[{"messageId": response_fields.body, "deduplicated": False}],
             status=response_fields.status,
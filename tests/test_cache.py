@@ -0,0 +1,85 @@
+import json
+import time
+from typing import Any, Dict, List
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.workflow_parser import _parse_payload
+from tests.test_workflow_parser import _get_payload
+
+
+def _get_steps(step_count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "stepId": step_id,
+            "stepName": f"step{step_id}",
+            "stepType": "Run",
+            "out": json.dumps({"result": step_id}),
+            "concurrent": 1,
+        }
+        for step_id in range(1, step_count + 1)
+    ]
+
+
+def test_history_cache_reuses_decoded_steps() -> None:
+    cache = HistoryCache()
+    codec = StdlibJsonCodec()
+    parsed_payloads = []
+
+    def initial_payload_parser(raw: str) -> Any:
+        parsed_payloads.append(raw)
+        return json.loads(raw)
+
+    assert cache._get("wfr-id") is None
+    raw_initial_payload, steps = _parse_payload(
+        _get_payload('{"key": "value"}', _get_steps(2)), codec, {}
+    )
+    initial_payload = cache._get_initial_payload(
+        None, raw_initial_payload, initial_payload_parser
+    )
+    first_output = steps.step_out(1)
+    cache._put("wfr-id", raw_initial_payload, initial_payload, steps)
+
+    cached_run = cache._get("wfr-id")
+    assert cached_run is not None
+    assert list(cached_run.steps) == ["msg-1"]
+
+    _, steps = _parse_payload(
+        _get_payload('{"key": "value"}', _get_steps(3)), codec, cached_run.steps
+    )
+    assert steps.step_out(1) is first_output
+    assert steps[3].out == {"result": 3}
+    assert (
+        cache._get_initial_payload(
+            cached_run, raw_initial_payload, initial_payload_parser
+        )
+        is initial_payload
+    )
+    assert parsed_payloads == ['{"key": "value"}']
+
+    cache._put("wfr-id", raw_initial_payload, initial_payload, steps)
+    cached_run = cache._get("wfr-id")
+    assert cached_run is not None
+    assert sorted(cached_run.steps) == ["msg-1", "msg-3"]
+
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    cache._remove("wfr-id")
+    assert len(cache) == 0
+
+
+def test_history_cache_eviction() -> None:
+    cache = HistoryCache(max_size=2, ttl=0.05)
+    for workflow_run_id in ("wfr-1", "wfr-2"):
+        cache._put(workflow_run_id, "", None, [])
+
+    assert cache._get("wfr-1") is not None
+    cache._put("wfr-3", "", None, [])
+
+    assert cache._get("wfr-2") is None
+    assert cache._get("wfr-1") is not None
+    assert cache.evictions == 1
+
+    time.sleep(0.06)
+    assert cache._get("wfr-3") is None
+    assert cache.evictions == 2
+    assert len(cache) == 1
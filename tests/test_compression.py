@@ -0,0 +1,59 @@
+import json
+import os
+import base64
+import pytest
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.workflow_parser import _parse_payload
+from tests.test_workflow_parser import _get_payload
+
+OUTPUT = {"items": [{"id": index, "name": f"item-{index}"} for index in range(1000)]}
+
+
+def _get_step(out: str, output_compression: object) -> dict:
+    return {
+        "stepId": 1,
+        "stepName": "step1",
+        "stepType": "Run",
+        "out": out,
+        "outEncoding": "json",
+        "outCompression": output_compression,
+        "concurrent": 1,
+    }
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "lzma", "zstd"])
+def test_compressed_outputs_are_decompressed(algorithm: str) -> None:
+    try:
+        compression = OutputCompression(threshold=1024, algorithm=algorithm)
+    except ImportError:
+        pytest.skip(f"{algorithm} is not installed")
+
+    out = json.dumps(OUTPUT)
+    compressed_out, output_compression = compression._compress_output("step1", out)
+
+    assert output_compression == algorithm
+    assert len(compressed_out) < len(out)
+    assert compression.stats.compressed_outputs == 1
+    assert compression.stats.recent[0].step_name == "step1"
+    assert compression.stats.recent[0].ratio > 1
+
+    _, steps = _parse_payload(
+        _get_payload("initial", [_get_step(compressed_out, output_compression)]),
+        StdlibJsonCodec(),
+    )
+    assert steps.step_out(1) == OUTPUT  # type: ignore[attr-defined]
+
+
+def test_small_and_incompressible_outputs_are_not_compressed() -> None:
+    compression = OutputCompression(threshold=1024)
+
+    assert compression._compress_output("small", '"value"') == ('"value"', None)
+
+    incompressible = json.dumps(base64.b64encode(os.urandom(2048)).decode())
+    assert compression._compress_output("random", incompressible) == (
+        incompressible,
+        None,
+    )
+    assert compression.stats.compressed_outputs == 0
+    assert compression.stats.skipped_outputs == 1
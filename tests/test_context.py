@@ -1,7 +1,23 @@
+import operator
 import pytest
+import threading
+import time
+from functools import partial
+from typing import Any, Dict, List
 from qstash import QStash
-from upstash_workflow import WorkflowContext
-from upstash_workflow.error import WorkflowAbort
+import json
+from upstash_workflow import (
+    WorkflowContext,
+    ContinueAsNewPolicy,
+    HeaderFilter,
+    RunAheadPolicy,
+)
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.types import Step, DefaultStep
+from upstash_workflow.serve.authorization import _DisabledWorkflowContext
+from upstash_workflow.error import WorkflowAbort, WorkflowError
+from upstash_workflow.workflow_requests import _recreate_user_headers
+from upstash_workflow.workflow_parser import _parse_payload, _parse_messages
 from tests.utils import (
     mock_qstash_server,
     RequestFields,
@@ -9,6 +25,7 @@ from tests.utils import (
     MOCK_QSTASH_SERVER_URL,
     WORKFLOW_ENDPOINT,
 )
+from tests.test_workflow_parser import _encode, _get_payload
 
 
 @pytest.fixture
@@ -102,3 +119,428 @@ def test_workflow_headers(qstash_client: QStash) -> None:
             ],
         ),
     )
+
+
+def _continue_as_new_request(payload: object) -> RequestFields:
+    return RequestFields(
+        method="POST",
+        url=f"{MOCK_QSTASH_SERVER_URL}/v2/publish/{WORKFLOW_ENDPOINT}",
+        token="mock-token",
+        body=payload,
+        headers={
+            "Upstash-Workflow-Init": "true",
+            "Upstash-Workflow-Url": WORKFLOW_ENDPOINT,
+            "Upstash-Deduplication-Id": "wfr-id-continue-as-new",
+            "Upstash-Forward-my-header": "my-value",
+        },
+    )
+
+
+def test_continue_as_new(qstash_client: QStash) -> None:
+    context = WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={"my-header": "my-value"},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload={"cursor": 1},
+        failure_url=None,
+    )
+
+    def execute() -> None:
+        with pytest.raises(WorkflowAbort) as excinfo:
+            context.continue_as_new({"cursor": 2})
+        assert excinfo.value.finish_workflow
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(
+            status=200, body='{"messageId": "msgId"}', raw=True
+        ),
+        receives_request=_continue_as_new_request({"cursor": 2}),
+    )
+
+
+def test_continue_as_new_policy(qstash_client: QStash) -> None:
+    context = WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={"my-header": "my-value"},
+        steps=[
+            Step(step_id=0, step_name="init", step_type="Initial", concurrent=1),
+            Step(step_id=1, step_name="step1", step_type="Run", concurrent=1, out=2),
+        ],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload={"cursor": 1},
+        failure_url=None,
+        continue_as_new_policy=ContinueAsNewPolicy(max_steps=1),
+    )
+
+    def execute() -> None:
+        # the first step is replayed
+        assert not context.should_continue_as_new
+        cursor = context.run("step1", lambda: 2)
+        assert context.should_continue_as_new
+        with pytest.raises(WorkflowAbort) as excinfo:
+            context.continue_as_new({"cursor": cursor})
+        assert excinfo.value.finish_workflow
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(
+            status=200, body='{"messageId": "msgId"}', raw=True
+        ),
+        receives_request=_continue_as_new_request({"cursor": 2}),
+    )
+
+
+class _Message:
+    def __init__(self) -> None:
+        self.batches: List[List[Any]] = []
+        self.payloads: List[Any] = []
+
+    def batch(self, messages: List[Any]) -> List[Any]:
+        self.batches.append(messages)
+        return []
+
+    def publish_json(self, body: Any, **kwargs: Any) -> None:
+        self.payloads.append(body)
+
+
+class _QStash:
+    def __init__(self) -> None:
+        self.message = _Message()
+
+
+def test_continue_as_new_policy_finishes_long_runs() -> None:
+    """
+    Drives a loop of 5 steps through QStash-like requests, continuing as new
+    every 2 steps.
+    """
+    qstash_client = _QStash()
+    policy = ContinueAsNewPolicy(max_steps=2)
+    totals: List[int] = []
+
+    def route_function(context: WorkflowContext[Dict[str, int]]) -> None:
+        index = context.request_payload["index"]
+        total = context.request_payload["total"]
+        while index < 5:
+            if context.should_continue_as_new:
+                context.continue_as_new({"index": index, "total": total})
+            total = context.run(f"add{index}", partial(operator.add, total, index))
+            index += 1
+        totals.append(total)
+
+    payload = {"index": 0, "total": 0}
+    requests = 0
+    while not totals:
+        requests += 1
+        assert requests <= 8, "the run doesn't finish"
+        messages = [{"body": _encode(json.dumps(payload)), "callType": "step"}] + [
+            {"body": _encode(batch[0]["body"]), "callType": "step"}
+            for batch in qstash_client.message.batches
+        ]
+        _, steps = _parse_messages(messages, StdlibJsonCodec())
+        context = WorkflowContext(
+            qstash_client=qstash_client,  # type: ignore[arg-type]
+            workflow_run_id="wfr-id",
+            headers={},
+            steps=steps,
+            url=WORKFLOW_ENDPOINT,
+            initial_payload=payload,
+            failure_url=None,
+            continue_as_new_policy=policy,
+        )
+        try:
+            route_function(context)
+        except WorkflowAbort as abort:
+            if abort.finish_workflow:
+                # the new run starts with the payload and an empty history
+                payload = qstash_client.message.payloads[-1]
+                qstash_client.message.batches.clear()
+
+    assert totals == [10]
+    assert qstash_client.message.payloads == [
+        {"index": 2, "total": 1},
+        {"index": 4, "total": 6},
+    ]
+
+
+def test_disabled_context_continue_as_new(qstash_client: QStash) -> None:
+    context = WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload=None,
+        failure_url=None,
+    )
+
+    def route(context: WorkflowContext[None]) -> None:
+        context.continue_as_new("payload")
+
+    def execute() -> None:
+        assert (
+            _DisabledWorkflowContext.try_authentication(route, context) == "step-found"
+        )
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(status=200, body="msgId"),
+        receives_request=False,
+    )
+
+
+def test_replays_step_results_in_any_order(qstash_client: QStash) -> None:
+    context = WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[
+            Step(step_id=0, step_name="init", step_type="Initial", concurrent=1),
+            Step(step_id=2, step_name="step2", step_type="Run", concurrent=1, out=4),
+            Step(step_id=1, step_name="step1", step_type="Run", concurrent=1, out=2),
+        ],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload=None,
+        failure_url=None,
+    )
+
+    def execute() -> None:
+        assert context.run("step1", lambda: 0) == 2
+        assert context.run("step2", lambda: 0) == 4
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(status=200, body="msgId"),
+        receives_request=False,
+    )
+
+
+def test_header_filter() -> None:
+    headers = {
+        "Authorization": "Bearer token",
+        "Cookie": "session=1",
+        "Sec-Fetch-Mode": "cors",
+        "Sec-Ch-Ua": "Chromium",
+        "X-Tenant-Id": "tenant",
+        "Upstash-Workflow-RunId": "wfr-id",
+    }
+
+    assert _recreate_user_headers(headers, HeaderFilter(deny=["cookie", "SEC-*"])) == {
+        "Authorization": "Bearer token",
+        "X-Tenant-Id": "tenant",
+    }
+    assert _recreate_user_headers(
+        headers, HeaderFilter(allow=["authorization", "x-*"], deny=["x-tenant-id"])
+    ) == {"Authorization": "Bearer token"}
+    assert len(_recreate_user_headers(headers)) == 5
+
+
+def _parallel_context(
+    qstash_client: QStash, steps: List[DefaultStep]
+) -> WorkflowContext[str]:
+    initial_step: DefaultStep = Step(
+        step_id=0, step_name="init", step_type="Initial", out="payload", concurrent=1
+    )
+    return WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[initial_step, *steps],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+    )
+
+
+def _result_steps(step_ids: List[int], concurrent: int) -> List[DefaultStep]:
+    return [
+        Step(
+            step_id=step_id,
+            step_name=f"step{step_id}",
+            step_type="Run",
+            out=f"result{step_id}",
+            concurrent=concurrent,
+        )
+        for step_id in step_ids
+    ]
+
+
+def test_run_parallel_returns_results_in_order(qstash_client: QStash) -> None:
+    context = _parallel_context(qstash_client, _result_steps([3, 1, 2], 3))
+
+    results = context.run_parallel(
+        [(f"step{step_id}", lambda: "not-executed") for step_id in (1, 2, 3)]
+    )
+
+    assert results == ["result1", "result2", "result3"]
+
+
+def test_run_parallel_discards_unfinished_results(qstash_client: QStash) -> None:
+    context = _parallel_context(qstash_client, _result_steps([1], 2))
+    steps = [("step1", lambda: "not-executed"), ("step2", lambda: "not-executed")]
+
+    with pytest.raises(WorkflowAbort, match="'discarded parallel'"):
+        context.run_parallel(steps)
+
+    context = _parallel_context(qstash_client, _result_steps([1], 3))
+    with pytest.raises(WorkflowError, match="Expected 2, got 3"):
+        context.run_parallel(steps)
+
+
+def test_run_parallel_runs_steps_in_thread_pool() -> None:
+    qstash_client = _QStash()
+    context = _parallel_context(qstash_client, [])  # type: ignore[arg-type]
+    lock = threading.Lock()
+    threads = set()
+    active = [0, 0]
+
+    def step_function(step_id: int) -> int:
+        with lock:
+            threads.add(threading.current_thread())
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return step_id * 10
+
+    with pytest.raises(WorkflowAbort, match="'step1'"):
+        context.run_parallel(
+            [
+                (f"step{step_id}", partial(step_function, step_id))
+                for step_id in (1, 2, 3)
+            ],
+            max_workers=2,
+        )
+
+    assert threading.current_thread() not in threads
+    assert len(threads) == 2
+    # at most max_workers steps run at once
+    assert active[1] == 2
+    assert len(qstash_client.message.batches) == 1
+    bodies = [
+        json.loads(message["body"]) for message in qstash_client.message.batches[0]
+    ]
+    assert [
+        (body["stepId"], body["concurrent"], json.loads(body["out"])) for body in bodies
+    ] == [(1, 3, 10), (2, 3, 20), (3, 3, 30)]
+
+
+def test_run_parallel_failing_step_publishes_nothing() -> None:
+    qstash_client = _QStash()
+    context = _parallel_context(qstash_client, [])  # type: ignore[arg-type]
+
+    def failing_step() -> None:
+        raise ValueError("step failed")
+
+    with pytest.raises(ValueError, match="step failed"):
+        context.run_parallel([("step1", lambda: "result1"), ("step2", failing_step)])
+
+    assert qstash_client.message.batches == []
+
+
+def test_run_ahead_keeps_results_until_budget(qstash_client: QStash) -> None:
+    context = WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        run_ahead=RunAheadPolicy(max_steps=3),
+    )
+
+    def execute() -> None:
+        # outputs are returned as they are replayed
+        assert context.run("step1", lambda: (1, 2)) == [1, 2]
+        assert context.run("step2", lambda: "result2") == "result2"
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(status=200, body="msgId"),
+        receives_request=False,
+    )
+    assert [step.step_name for step in context._executor._run_ahead_steps] == [
+        "step1",
+        "step2",
+    ]
+
+
+def test_run_ahead_trigger_ends_request(qstash_client: QStash) -> None:
+    step = {
+        "stepId": 1,
+        "stepName": "step1",
+        "stepType": "Run",
+        "out": json.dumps("result1"),
+        "concurrent": 1,
+        "runAhead": True,
+    }
+    _, steps = _parse_payload(_get_payload("payload", [step]), StdlibJsonCodec())
+    context = WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=steps,
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        run_ahead=RunAheadPolicy(),
+    )
+
+    assert context.run("step1", lambda: "not-executed") == "result1"
+    with pytest.raises(WorkflowAbort, match="'run-ahead'"):
+        context.run("step2", lambda: "not-executed")
+
+
+def _run_ahead_context(
+    qstash_client: QStash, steps: List[Dict[str, Any]]
+) -> WorkflowContext[str]:
+    _, history = _parse_payload(_get_payload("payload", steps), StdlibJsonCodec())
+    return WorkflowContext(
+        qstash_client=qstash_client,
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=history,
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        run_ahead=RunAheadPolicy(),
+    )
+
+
+def _run_ahead_step(step_id: int, run_ahead: bool) -> Dict[str, Any]:
+    return {
+        "stepId": step_id,
+        "stepName": f"step{step_id}",
+        "stepType": "Run",
+        "out": json.dumps(f"result{step_id}"),
+        "concurrent": 1,
+        "runAhead": run_ahead or None,
+    }
+
+
+def test_run_ahead_batch_received_out_of_order() -> None:
+    qstash_client = _QStash()
+
+    # the last step of the batch is received before the step executed ahead
+    context = _run_ahead_context(
+        qstash_client,  # type: ignore[arg-type]
+        [_run_ahead_step(2, run_ahead=False)],
+    )
+    with pytest.raises(WorkflowAbort, match="'run-ahead'"):
+        context.run("step1", lambda: "not-executed")
+
+    # the request which receives the whole batch continues
+    context = _run_ahead_context(
+        qstash_client,  # type: ignore[arg-type]
+        [_run_ahead_step(2, run_ahead=False), _run_ahead_step(1, run_ahead=True)],
+    )
+    assert context.run("step1", lambda: "not-executed") == "result1"
+    assert context.run("step2", lambda: "not-executed") == "result2"
+    assert context.run("step3", lambda: "result3") == "result3"
+
+    assert qstash_client.message.batches == []
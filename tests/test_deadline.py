@@ -0,0 +1,64 @@
+import pytest
+import time
+from typing import Any, List
+from upstash_workflow import WorkflowContext, WorkflowAbort, RunAheadPolicy
+from upstash_workflow.deadline import InvocationDeadline
+from tests.utils import WORKFLOW_ENDPOINT
+
+
+class _Message:
+    def __init__(self) -> None:
+        self.batches: List[List[Any]] = []
+
+    def batch(self, messages: List[Any]) -> List[Any]:
+        self.batches.append(messages)
+        return []
+
+
+class _QStash:
+    def __init__(self) -> None:
+        self.message = _Message()
+
+
+def test_step_durations_are_averaged() -> None:
+    deadline = InvocationDeadline(8, margin=1, smoothing=0.5)
+    assert deadline._estimate("step1") == 0
+
+    deadline._record("step1", 2)
+    deadline._record("step1", 4)
+    deadline._record("step2", 8)
+
+    assert deadline._estimate("step1") == 3
+    # steps not executed yet are estimated by the average of all steps
+    assert deadline._estimate("step3") == 5.5
+
+    started = time.monotonic()
+    assert not deadline._should_defer(["step1"], started)
+    assert deadline._should_defer(["step1", "step2"], started)
+    assert deadline.stats.deferred_steps == 2
+
+
+def test_steps_exceeding_the_deadline_are_deferred() -> None:
+    qstash_client = _QStash()
+    deadline = InvocationDeadline(10, margin=0)
+    deadline._record("step2", 20)
+    context = WorkflowContext(
+        qstash_client=qstash_client,  # type: ignore[arg-type]
+        workflow_run_id="wfr-id",
+        headers={},
+        steps=[],
+        url=WORKFLOW_ENDPOINT,
+        initial_payload="payload",
+        failure_url=None,
+        run_ahead=RunAheadPolicy(),
+        invocation_deadline=deadline,
+    )
+    executed: List[str] = []
+
+    context.run("step1", lambda: executed.append("step1"))
+    with pytest.raises(WorkflowAbort, match="'step1'"):
+        context.run("step2", lambda: executed.append("step2"))
+
+    assert executed == ["step1"]
+    assert [len(batch) for batch in qstash_client.message.batches] == [1]
+    assert deadline.stats.deferred_steps == 1
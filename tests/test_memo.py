@@ -0,0 +1,106 @@
+from typing import Dict, List, Optional
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.memo import (
+    StepMemoization,
+    MemoryStepCacheStore,
+    RedisStepCacheStore,
+)
+from upstash_workflow.serializers import SerializerRegistry
+from tests.test_serializers import Address
+
+
+class _Redis:
+    """
+    Stand-in for a Redis client, which stores values as bytes like redis-py.
+    """
+
+    def __init__(self) -> None:
+        self.values: Dict[str, bytes] = {}
+        self.expirations: Dict[str, Optional[int]] = {}
+
+    def set(self, key: str, value: str, px: Optional[int] = None) -> None:
+        self.values[key] = value.encode()
+        self.expirations[key] = px
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.values.get(key)
+
+
+class _FailingStore(MemoryStepCacheStore):
+    def get(self, key: str) -> Optional[str]:
+        raise ConnectionError("unavailable")
+
+
+def _run(memoization: StepMemoization, cache_key: str, calls: List[str]) -> object:
+    def step_function() -> Address:
+        calls.append(cache_key)
+        return Address(city=cache_key)
+
+    return memoization._memoize(
+        "geocode",
+        step_function,
+        cache_key,
+        None,
+        SerializerRegistry(types=[Address]),
+        StdlibJsonCodec(),
+    )()
+
+
+def test_memoized_steps_run_once() -> None:
+    redis = _Redis()
+    memoization = StepMemoization(RedisStepCacheStore(redis), ttl=60)
+    calls: List[str] = []
+
+    assert _run(memoization, "paris", calls) == Address(city="paris")
+    # another run reads the output from the store
+    assert _run(memoization, "paris", calls) == Address(city="paris")
+    assert _run(memoization, "rome", calls) == Address(city="rome")
+
+    assert calls == ["paris", "rome"]
+    assert (memoization.stats.hits, memoization.stats.misses) == (1, 2)
+    assert set(redis.expirations.values()) == {60000}
+    assert all(key.startswith("upstash-workflow:step:geocode:") for key in redis.values)
+
+
+def test_memory_store() -> None:
+    store = MemoryStepCacheStore(max_size=2)
+    store.set("a", "1", None)
+    store.set("b", "2", None)
+    store.get("a")
+    store.set("c", "3", None)
+
+    assert len(store) == 2
+    assert [store.get(key) for key in "abc"] == ["1", None, "3"]
+
+    store.set("d", "4", 0)
+    assert store.get("d") is None
+
+
+def test_store_errors_run_the_step() -> None:
+    memoization = StepMemoization(_FailingStore())
+    calls: List[str] = []
+
+    assert _run(memoization, "paris", calls) == Address(city="paris")
+    assert _run(memoization, "paris", calls) == Address(city="paris")
+
+    assert calls == ["paris", "paris"]
+    assert memoization.stats.errors == 2
+
+
+def test_undecodable_outputs_run_the_step() -> None:
+    store = MemoryStepCacheStore()
+    memoization = StepMemoization(store)
+    calls: List[str] = []
+    _run(memoization, "paris", calls)
+    [key] = store._values
+    store.set(key, "not-json", None)
+
+    assert _run(memoization, "paris", calls) == Address(city="paris")
+
+    # an output of a type which was removed
+    store.set(key, '["{}", "dataclass", "tests.test_memo:Removed"]', None)
+    assert _run(memoization, "paris", calls) == Address(city="paris")
+
+    assert calls == ["paris", "paris", "paris"]
+    assert memoization.stats.errors == 2
+    assert memoization.stats.misses == 3
@@ -0,0 +1,166 @@
+import numpy
+import pytest
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+from pydantic import BaseModel
+from upstash_workflow.codec import JsonCodec, StdlibJsonCodec
+from upstash_workflow.error import WorkflowError
+from upstash_workflow.serializers import (
+    SerializerRegistry,
+    MsgpackSerializer,
+    BytesSerializer,
+)
+from upstash_workflow.workflow_parser import _parse_payload
+from tests.test_workflow_parser import _get_payload
+
+
+@dataclass
+class Address:
+    city: str
+
+
+@dataclass
+class User:
+    name: str
+    address: Address
+    nickname: Optional[str] = None
+
+
+class Order(BaseModel):
+    order_id: int
+    items: List[str]
+
+
+class Product(BaseModel):
+    name: str
+
+
+@dataclass
+class Invoice:
+    amount: int
+    total: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.total = self.amount * 2
+
+
+def _replay(registry: SerializerRegistry, outputs: List[Any]) -> List[Any]:
+    """
+    Publishes the outputs as steps and reads them back from the history.
+    """
+    codec = StdlibJsonCodec()
+    steps = []
+    for index, output in enumerate(outputs):
+        serialized_output = registry._serialize(output, codec)
+        steps.append(
+            {
+                "stepId": index + 1,
+                "stepName": f"step{index + 1}",
+                "stepType": "Run",
+                "out": serialized_output.out,
+                "outEncoding": serialized_output.encoding,
+                "outType": serialized_output.out_type,
+                "concurrent": 1,
+            }
+        )
+
+    _, history = _parse_payload(_get_payload("initial", steps), codec)
+    return [history.step_out(index) for index in range(1, len(history))]
+
+
+def test_outputs_are_rebuilt_in_their_types() -> None:
+    user = User(name="name", address=Address(city="city"))
+    order = Order(order_id=1, items=["item"])
+
+    replayed = _replay(
+        SerializerRegistry(types=[User, Order]), [user, order, {"key": "value"}]
+    )
+
+    assert replayed == [user, order, {"key": "value"}]
+    assert isinstance(replayed[0].address, Address)
+
+
+def test_init_false_fields_are_not_passed_to_dataclasses() -> None:
+    assert _replay(SerializerRegistry(types=[Invoice]), [Invoice(amount=2)]) == [
+        Invoice(amount=2)
+    ]
+
+
+def test_output_types_must_be_registered() -> None:
+    @dataclass
+    class Unregistered:
+        value: int
+
+    with pytest.raises(WorkflowError, match="is not registered"):
+        SerializerRegistry()._serialize(Unregistered(value=1), StdlibJsonCodec())
+
+
+class _HexBytesSerializer(BytesSerializer):
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        return value.hex(), None
+
+
+def test_encodings_are_registered_to_one_serializer_class() -> None:
+    SerializerRegistry([BytesSerializer()])
+
+    with pytest.raises(WorkflowError, match="'bytes' of _HexBytesSerializer"):
+        SerializerRegistry([_HexBytesSerializer()])
+
+
+def test_msgpack_serializer_keeps_bytes() -> None:
+    registry = SerializerRegistry([MsgpackSerializer()])
+
+    assert registry._serialize(b"", StdlibJsonCodec()).encoding == "msgpack"
+    assert _replay(registry, [b"\x00\xff", {1: [1.5, None]}]) == [
+        b"\x00\xff",
+        {1: [1.5, None]},
+    ]
+
+
+def test_binary_outputs() -> None:
+    array = numpy.arange(12, dtype=">i4").reshape(3, 4)
+    transposed = numpy.linspace(0, 1, 6).reshape(2, 3).T
+
+    replayed = _replay(
+        SerializerRegistry(), [b"\x00\xff", bytearray(b"ab"), array, transposed]
+    )
+
+    assert replayed[:2] == [b"\x00\xff", b"ab"]
+    assert replayed[2].dtype == array.dtype
+    assert numpy.array_equal(replayed[2], array)
+    assert numpy.array_equal(replayed[3], transposed)
+    replayed[3][0, 0] = 1.0
+
+
+def test_object_arrays_are_not_serialized() -> None:
+    with pytest.raises(WorkflowError, match="can't be serialized"):
+        SerializerRegistry()._serialize(
+            numpy.array([{}], dtype=object), StdlibJsonCodec()
+        )
+
+
+@pytest.mark.parametrize(
+    "out_encoding, out_type",
+    [
+        ("dataclass", "tests.test_serializers:Missing"),
+        # importable, but not registered
+        ("pydantic", "tests.test_serializers:Product"),
+        ("pydantic", "upstash_workflow.codec:StdlibJsonCodec"),
+    ],
+)
+def test_unregistered_output_type(out_encoding: str, out_type: str) -> None:
+    codec = StdlibJsonCodec()
+    step = {
+        "stepId": 1,
+        "stepName": "step1",
+        "stepType": "Run",
+        "out": "{}",
+        "outEncoding": out_encoding,
+        "outType": out_type,
+        "concurrent": 1,
+    }
+
+    _, history = _parse_payload(_get_payload("initial", [step]), codec)
+
+    with pytest.raises(WorkflowError, match="is not registered"):
+        history.step_out(1)
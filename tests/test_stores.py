@@ -0,0 +1,107 @@
+import json
+import pytest
+from pathlib import Path
+from typing import Dict, Optional
+from upstash_workflow.codec import StdlibJsonCodec
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.error import WorkflowError
+from upstash_workflow.stores import BlobOffload, FileSystemBlobStore, RedisBlobStore
+from upstash_workflow.workflow_parser import _parse_payload
+from tests.test_workflow_parser import _get_payload
+
+OUTPUT = {"items": [{"id": index, "name": f"item-{index}"} for index in range(1000)]}
+
+
+class _Redis:
+    """
+    Stand-in for a Redis client, which stores values as bytes like redis-py.
+    """
+
+    def __init__(self) -> None:
+        self.values: Dict[str, bytes] = {}
+        self.expirations: Dict[str, Optional[int]] = {}
+
+    def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        self.values[key] = value.encode()
+        self.expirations[key] = ex
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.values.get(key)
+
+
+def _get_step(out: str, output_blob: Optional[str], **fields: object) -> dict:
+    return {
+        "stepId": 1,
+        "stepName": "step1",
+        "stepType": "Run",
+        "out": out,
+        "outEncoding": "json",
+        "outBlob": output_blob,
+        "concurrent": 1,
+        **fields,
+    }
+
+
+def test_file_system_store(tmp_path: Path) -> None:
+    offload = BlobOffload(FileSystemBlobStore(str(tmp_path)), threshold=1024)
+    compression = OutputCompression(threshold=1024)
+
+    out, output_compression = compression._compress_output("step1", json.dumps(OUTPUT))
+    key, output_blob = offload._offload_output("wfr-id", out)
+
+    assert output_blob == "fs"
+    assert key.startswith("wfr-id/")
+    assert (tmp_path / key).read_text() == out
+    assert offload.stats.offloaded_outputs == 1
+
+    _, steps = _parse_payload(
+        _get_payload(
+            "initial",
+            [_get_step(key, output_blob, outCompression=output_compression)],
+        ),
+        StdlibJsonCodec(),
+    )
+    assert steps.step_out(1) == OUTPUT  # type: ignore[attr-defined]
+
+
+def test_redis_store() -> None:
+    client = _Redis()
+    offload = BlobOffload(RedisBlobStore(client, ttl=3600), threshold=1024)
+
+    key, output_blob = offload._offload_output("wfr-id", json.dumps(OUTPUT))
+
+    assert output_blob == "redis"
+    assert client.expirations == {f"upstash-workflow:{key}": 3600}
+    assert offload._offload_output("wfr-id", '"small"') == ('"small"', None)
+
+    _, steps = _parse_payload(
+        _get_payload("initial", [_get_step(key, output_blob)]), StdlibJsonCodec()
+    )
+    assert steps.step_out(1) == OUTPUT  # type: ignore[attr-defined]
+
+
+def test_missing_blob_is_reported_when_read(tmp_path: Path) -> None:
+    BlobOffload(FileSystemBlobStore(str(tmp_path), name="missing-fs"))
+
+    _, steps = _parse_payload(
+        _get_payload("initial", [_get_step("wfr-id/missing", "missing-fs")]),
+        StdlibJsonCodec(),
+    )
+    assert steps.step_name(1) == "step1"  # type: ignore[attr-defined]
+
+    with pytest.raises(WorkflowError, match="was not found in blob store"):
+        steps.step_out(1)  # type: ignore[attr-defined]
+
+
+def test_store_names_are_unique(tmp_path: Path) -> None:
+    store = FileSystemBlobStore(str(tmp_path / "first"), name="unique-fs")
+    BlobOffload(store)
+    BlobOffload(store, threshold=1024)
+
+    with pytest.raises(WorkflowError, match="'unique-fs' is already used"):
+        BlobOffload(FileSystemBlobStore(str(tmp_path / "second"), name="unique-fs"))
+
+
+def test_invalid_key(tmp_path: Path) -> None:
+    with pytest.raises(WorkflowError, match="Invalid blob key"):
+        FileSystemBlobStore(str(tmp_path)).get("../outside")
@@ -0,0 +1,458 @@
+import json
+import pickle
+import time
+import base64
+import hashlib
+import jwt
+import pytest
+from qstash import QStash, Receiver
+from typing import Any, Dict, List, Type, cast
+from upstash_workflow.codec import (
+    JsonCodec,
+    StdlibJsonCodec,
+    OrjsonCodec,
+    MsgspecCodec,
+)
+from upstash_workflow.error import WorkflowError
+from upstash_workflow.history import (
+    _NOT_DECODED,
+    _MessageSplitter,
+    _StepFields,
+    _StepHistory,
+    _encode_step_body,
+)
+from upstash_workflow.types import _ParseRequestResponse
+from upstash_workflow.workflow_parser import _parse_payload, _parse_request
+from upstash_workflow.workflow_requests import _verify_request
+from tests.utils import (
+    mock_qstash_server,
+    RequestFields,
+    ResponseFields,
+    MOCK_QSTASH_SERVER_URL,
+    WORKFLOW_ENDPOINT,
+)
+
+
+def _encode(value: str) -> str:
+    return base64.b64encode(value.encode()).decode()
+
+
+def _get_payload(initial_payload: str, steps: List[Dict[str, Any]]) -> str:
+    return json.dumps(
+        [{"messageId": "msg-0", "body": _encode(initial_payload), "callType": "step"}]
+        + [
+            {
+                "messageId": f"msg-{index + 1}",
+                "body": _encode(json.dumps(step)),
+                "callType": "step",
+            }
+            for index, step in enumerate(steps)
+        ]
+    )
+
+
+def _get_steps(step_count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "stepId": step_id,
+            "stepName": f"step{step_id}",
+            "stepType": "Run",
+            "out": json.dumps({"result": step_id}),
+            "concurrent": 1,
+        }
+        for step_id in range(1, step_count + 1)
+    ]
+
+
+def test_parse_payload_decodes_steps_lazily() -> None:
+    payload = _get_payload('{"key": "value"}', _get_steps(3))
+
+    raw_initial_payload, steps = _parse_payload(payload, StdlibJsonCodec())
+
+    assert raw_initial_payload == '{"key": "value"}'
+    assert len(steps) == 4
+    assert steps[0].step_type == "Initial"
+    assert steps[0].out == raw_initial_payload
+
+    assert not any(steps._is_decoded(index) for index in range(1, 4))  # type: ignore[attr-defined]
+
+    step = steps[2]
+    assert step.step_id == 2
+    assert step.step_name == "step2"
+    assert step.out == {"result": 2}
+
+    assert [steps._is_decoded(index) for index in range(1, 4)] == [  # type: ignore[attr-defined]
+        False,
+        True,
+        False,
+    ]
+    assert steps.step_out(2) is step.out  # type: ignore[attr-defined]
+
+
+def test_parse_payload_keeps_non_json_output() -> None:
+    payload = _get_payload(
+        "initial",
+        [
+            {
+                "stepId": 1,
+                "stepName": "step1",
+                "stepType": "Run",
+                "out": "not-json",
+                "concurrent": 1,
+            }
+        ],
+    )
+
+    raw_initial_payload, steps = _parse_payload(payload, StdlibJsonCodec())
+
+    assert raw_initial_payload == "initial"
+    assert [step.out for step in steps] == ["initial", "not-json"]
+
+
+def test_parse_payload_decodes_tagged_output() -> None:
+    payload = _get_payload(
+        "initial",
+        [
+            {
+                "stepId": 1,
+                "stepName": "step1",
+                "stepType": "Run",
+                "out": json.dumps("not-json"),
+                "outEncoding": "json",
+                "concurrent": 1,
+            },
+            {
+                "stepId": 2,
+                "stepName": "step2",
+                "stepType": "Run",
+                "out": "value",
+                "outEncoding": "unknown",
+                "concurrent": 1,
+            },
+        ],
+    )
+
+    _, steps = _parse_payload(payload, StdlibJsonCodec())
+
+    assert steps[1].out == "not-json"
+    with pytest.raises(WorkflowError, match="Unsupported output encoding 'unknown'"):
+        steps[2]
+
+
+def test_step_body_is_readable_by_sdks_without_output_encodings() -> None:
+    codec = StdlibJsonCodec()
+    steps = [
+        {
+            "stepId": step_id,
+            "stepName": f"step{step_id}",
+            "stepType": "Run",
+            "out": codec.dumps(out),
+            "outEncoding": "json",
+            "outType": None,
+            "outCompression": None,
+            "outBlob": None,
+            "runAhead": None,
+            "concurrent": 1,
+        }
+        for step_id, out in [(1, {"key": ['"quoted"', 1]}), (2, "text")]
+    ]
+    bodies = [_encode_step_body(dict(step), codec) for step in steps]
+
+    # outputs are JSON strings, which older SDKs decode with `json.loads`
+    assert json.loads(json.loads(bodies[0])["out"]) == {"key": ['"quoted"', 1]}
+    assert set(json.loads(bodies[0])) == {
+        "stepId",
+        "stepName",
+        "stepType",
+        "out",
+        "outEncoding",
+        "concurrent",
+    }
+
+    payload = json.dumps(
+        [{"messageId": "msg-0", "body": _encode("initial"), "callType": "step"}]
+        + [{"body": _encode(body), "callType": "step"} for body in bodies]
+    )
+    _, history = _parse_payload(payload, codec)
+
+    assert [step.out for step in history[1:]] == [{"key": ['"quoted"', 1]}, "text"]
+
+
+@pytest.mark.parametrize("codec_class", [StdlibJsonCodec, OrjsonCodec, MsgspecCodec])
+def test_json_codecs(codec_class: Type[JsonCodec]) -> None:
+    try:
+        codec = codec_class()
+    except ImportError:
+        pytest.skip(f"{codec_class.__name__} dependency is not installed")
+
+    value = {"key": ["value", 1, 2.5, None, True], "nested": {"a": "ü"}}
+    assert codec.loads(codec.dumps(value)) == value
+    assert codec.loads(codec.dumps(value).encode()) == value
+
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads("not-json")
+
+    assert pickle.loads(pickle.dumps(codec)).loads(codec.dumps(value)) == value
+
+    payload = _get_payload(
+        "initial",
+        [
+            {
+                "stepId": 1,
+                "stepName": "step1",
+                "stepType": "Run",
+                "out": codec.dumps(value),
+                "concurrent": 1,
+            }
+        ],
+    )
+    _, steps = _parse_payload(payload, codec)
+    assert steps[1].out == value
+
+
+def test_verify_request_with_bytes_body() -> None:
+    body = _get_payload("initial", []).encode()
+    body_hash = base64.urlsafe_b64encode(hashlib.sha256(body).digest()).decode()
+    signature = jwt.encode(
+        {
+            "iss": "Upstash",
+            "sub": WORKFLOW_ENDPOINT,
+            "exp": int(time.time()) + 300,
+            "nbf": int(time.time()) - 300,
+            "body": body_hash,
+        },
+        "current-signing-key-0123456789abcdef",
+        algorithm="HS256",
+    )
+    receiver = Receiver(
+        current_signing_key="current-signing-key-0123456789abcdef",
+        next_signing_key="next-signing-key-0123456789abcdefghi",
+    )
+
+    _verify_request(body, signature, receiver)
+
+    with pytest.raises(WorkflowError):
+        _verify_request(body + b" ", signature, receiver)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1 << 20])
+def test_message_splitter(chunk_size: int) -> None:
+    messages = [
+        {"messageId": "msg-0", "body": _encode("initial"), "callType": "step"},
+        {"messageId": 'with "quotes" \\ [and] {brackets}', "nested": [{"a": []}]},
+        {"messageId": "msg-2", "body": '\\\\"', "callType": "step"},
+    ]
+    body = json.dumps(messages, indent=1).encode()
+
+    splitter = _MessageSplitter(StdlibJsonCodec())
+    received = []
+    for start in range(0, len(body), chunk_size):
+        received.extend(splitter.feed(body[start : start + chunk_size]))
+    splitter.close()
+
+    assert received == messages
+
+
+def test_message_splitter_incomplete_body() -> None:
+    splitter = _MessageSplitter(StdlibJsonCodec())
+    assert splitter.feed(_get_payload("initial", [{"stepId": 1}])[:-10].encode()) == [
+        {"messageId": "msg-0", "body": _encode("initial"), "callType": "step"}
+    ]
+
+    with pytest.raises(json.JSONDecodeError):
+        splitter.close()
+
+
+def test_parse_request_fetches_steps_if_body_is_empty() -> None:
+    qstash_client = QStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL)
+    responses: List[_ParseRequestResponse] = []
+
+    def execute() -> None:
+        responses.append(
+            _parse_request(
+                b"",
+                False,
+                StdlibJsonCodec(),
+                qstash_client=qstash_client,
+                workflow_run_id="wfr-id",
+                message_id="msg-2",
+            )
+        )
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(
+            body=_get_payload("initial", _get_steps(3)), status=200, raw=True
+        ),
+        receives_request=RequestFields(
+            method="GET",
+            url=f"{MOCK_QSTASH_SERVER_URL}/v2/workflows/runs/wfr-id",
+            token="mock-token",
+        ),
+    )
+
+    response = responses[0]
+    assert not response.workflow_run_ended
+    assert response.raw_initial_payload == "initial"
+    assert [step.step_id for step in response.steps] == [0, 1, 2]
+
+
+def test_parse_request_run_ended_before_steps_are_fetched() -> None:
+    qstash_client = QStash("mock-token", base_url=MOCK_QSTASH_SERVER_URL)
+    responses: List[_ParseRequestResponse] = []
+
+    def execute() -> None:
+        responses.append(
+            _parse_request(
+                b"",
+                False,
+                StdlibJsonCodec(),
+                qstash_client=qstash_client,
+                workflow_run_id="wfr-id",
+            )
+        )
+
+    mock_qstash_server(
+        execute=execute,
+        response_fields=ResponseFields(body="not found", status=404, raw=True),
+        receives_request=RequestFields(
+            method="GET",
+            url=f"{MOCK_QSTASH_SERVER_URL}/v2/workflows/runs/wfr-id",
+            token="mock-token",
+        ),
+    )
+
+    assert responses[0].workflow_run_ended
+
+
+def test_parse_request_without_client_requires_body() -> None:
+    with pytest.raises(WorkflowError, match="Only first call can have an empty body"):
+        _parse_request(b"", False, StdlibJsonCodec())
+
+
+def test_step_history_finds_steps_in_any_order() -> None:
+    payload = _get_payload(
+        "initial",
+        [
+            {
+                "stepId": 2,
+                "stepName": "step2",
+                "stepType": "Run",
+                "out": json.dumps("result2"),
+                "concurrent": 2,
+            },
+            {
+                "stepId": 0,
+                "stepName": "step1",
+                "stepType": "Run",
+                "concurrent": 2,
+                "targetStep": 1,
+            },
+            {
+                "stepId": 1,
+                "stepName": "step1",
+                "stepType": "Run",
+                "out": json.dumps("result1"),
+                "concurrent": 2,
+            },
+        ],
+    )
+
+    _, steps = _parse_payload(payload, StdlibJsonCodec())
+
+    assert steps._find(1) == 3  # type: ignore[attr-defined]
+    assert steps._find(2) == 1  # type: ignore[attr-defined]
+    assert steps._find(0, target_step=1) == 2  # type: ignore[attr-defined]
+    assert steps._find(3) is None  # type: ignore[attr-defined]
+
+    # outputs are decoded only when they are read
+    assert not steps._is_decoded(1)  # type: ignore[attr-defined]
+    assert not steps._is_decoded(3)  # type: ignore[attr-defined]
+    assert steps.step_out(3) == "result1"  # type: ignore[attr-defined]
+    assert steps[2].target_step == 1
+
+
+def test_step_history_indexes_steps_up_to_the_step_found() -> None:
+    _, steps = _parse_payload(_get_payload("initial", _get_steps(4)), StdlibJsonCodec())
+
+    assert steps._find(2) == 2  # type: ignore[attr-defined]
+    assert steps._indexed == 3  # type: ignore[attr-defined]
+    assert steps._step_ids[3] == _NOT_DECODED  # type: ignore[attr-defined]
+
+    assert steps._find(1) == 1  # type: ignore[attr-defined]
+    assert steps._find(5) is None  # type: ignore[attr-defined]
+    assert steps._indexed == 5  # type: ignore[attr-defined]
+
+
+def test_step_history_accessors() -> None:
+    step = {
+        "stepId": 0,
+        "stepName": "step1",
+        "stepType": "Run",
+        "concurrent": 2,
+        "targetStep": 1,
+        "runAhead": True,
+    }
+    payload = _get_payload("initial", [*_get_steps(2), step])
+    _, steps = _parse_payload(payload, StdlibJsonCodec())
+    history = cast(_StepHistory, steps)
+
+    bodies = [message["body"] for message in json.loads(payload)[1:]]
+    assert history.history_size == len("initial") + sum(map(len, bodies))
+    assert history.step_name(3) == "step1"
+    assert history.step_type(3) == "Run"
+    assert history.step_id(3) == 0
+    assert history.target_step(3) == 1
+    assert history.concurrent(3) == 2
+    assert history.run_ahead(3)
+    assert not history.run_ahead(2)
+
+    # bodies are released once the step is decoded
+    assert history._bodies[3] is None
+    assert history._bodies[1] is not None
+    assert history.step_out(-2) == {"result": 2}
+    assert history[-1].target_step == 1
+
+
+def test_step_history_interns_strings() -> None:
+    steps = [{**step, "stepName": "same-name"} for step in _get_steps(3)]
+    _, parsed_steps = _parse_payload(_get_payload("initial", steps), StdlibJsonCodec())
+    history = cast(_StepHistory, parsed_steps)
+
+    names = [history.step_name(index) for index in range(1, 4)]
+    assert names == ["same-name"] * 3
+    assert len(set(history._step_names[1:])) == 1
+    # names, types and the empty output encoding of untagged outputs
+    assert history._strings == ["init", "Initial", "same-name", "Run", ""]
+
+
+def test_step_history_reuses_steps_by_message_id() -> None:
+    payload = json.loads(_get_payload("initial", _get_steps(2)))
+    # the body of a known step is never decoded
+    payload[1]["body"] = "not-base64"
+    known_steps = {
+        "msg-1": _StepFields(
+            step_id=1, step_name="step1", step_type="Run", out="known", concurrent=1
+        )
+    }
+
+    _, steps = _parse_payload(json.dumps(payload), StdlibJsonCodec(), known_steps)
+    history = cast(_StepHistory, steps)
+
+    assert history._find(1) == 1
+    assert history.step_out(1) == "known"
+    assert history.step_out(2) == {"result": 2}
+    assert history._decoded_steps() == {
+        "msg-1": known_steps["msg-1"],
+        "msg-2": _StepFields(
+            step_id=2,
+            step_name="step2",
+            step_type="Run",
+            out={"result": 2},
+            concurrent=1,
+        ),
+    }
+
+    # message ids are only kept with known steps
+    _, steps = _parse_payload(json.dumps(payload[:1]), StdlibJsonCodec())
+    assert cast(_StepHistory, steps)._message_ids == [None]
@@ -10,9 +10,11 @@ MOCK_QSTASH_SERVER_URL = f"http://localhost:{MOCK_QSTASH_SERVER_PORT}"
 
 
 class ResponseFields:
-    def __init__(self, body: Any, status: int):
+    def __init__(self, body: Any, status: int, raw: bool = False):
         self.body = body
         self.status = status
+        # if raw, body is sent as it is instead of as a message id
+        self.raw = raw
 
 
 class RequestFields:
@@ -108,8 +110,12 @@ def mock_qstash_server(
                 )
                 return
 
-            response_data = json.dumps(
-                [{"messageId": response_fields.body, "deduplicated": False}]
+            response_data = (
+                response_fields.body
+                if response_fields.raw
+                else json.dumps(
+                    [{"messageId": response_fields.body, "deduplicated": False}]
+                )
             )
 
             self.send_response(response_fields.status)
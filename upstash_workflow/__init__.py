@@ -6,7 +6,12 @@ from upstash_workflow.asyncio.context.context import (
     WorkflowContext as AsyncWorkflowContext,
 )
 from upstash_workflow.asyncio.serve.serve import serve as async_serve
-from upstash_workflow.types import CallResponse
+from upstash_workflow.types import (
+    CallResponse,
+    ContinueAsNewPolicy,
+    HeaderFilter,
+    RunAheadPolicy,
+)
 from upstash_workflow.error import WorkflowError, WorkflowAbort
 
 __all__ = [
@@ -15,6 +20,9 @@ __all__ = [
     "AsyncWorkflowContext",
     "async_serve",
     "CallResponse",
+    "ContinueAsNewPolicy",
+    "HeaderFilter",
+    "RunAheadPolicy",
     "WorkflowError",
     "WorkflowAbort",
 ]
@@ -1,38 +1,108 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, List, Union, Literal, cast, Any, TypeVar
-import json
-from qstash.message import BatchJsonRequest
-from upstash_workflow.constants import NO_CONCURRENCY
+import asyncio
+import time
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Optional,
+    Sequence,
+    Union,
+    Literal,
+    cast,
+    Any,
+    TypeVar,
+)
+from qstash.message import BatchRequest
+from upstash_workflow.constants import NO_CONCURRENCY, DEFAULT_CONTENT_TYPE
 from upstash_workflow.error import WorkflowError, WorkflowAbort
 from upstash_workflow.workflow_requests import _get_headers
 from upstash_workflow.types import DefaultStep, HTTPMethods
+from upstash_workflow.history import (
+    _StepHistory,
+    _OutputFormat,
+    _encode_step_body,
+    _decode_output,
+)
+from upstash_workflow.serializers import _SerializedOutput
 from upstash_workflow.asyncio.context.steps import _BaseLazyStep, _LazyCallStep
 
 if TYPE_CHECKING:
     from upstash_workflow import AsyncWorkflowContext
+    from upstash_workflow.asyncio.resume import _SuspendedRun
 
 TResult = TypeVar("TResult")
 
 
 class _AutoExecutor:
-    def __init__(self, context: AsyncWorkflowContext[Any], steps: List[DefaultStep]):
+    def __init__(
+        self, context: AsyncWorkflowContext[Any], steps: Sequence[DefaultStep]
+    ):
         self.context: AsyncWorkflowContext[Any] = context
-        self.steps: List[DefaultStep] = steps
-        self.non_plan_step_count: int = len(
-            [
-                step
-                for step in steps
-                if not (hasattr(step, "target_step") and step.target_step)
-            ]
+        self.steps: _StepHistory = (
+            steps
+            if isinstance(steps, _StepHistory)
+            else _StepHistory._from_steps(steps, context._json_codec)
         )
         self.step_count: int = 0
-        self.plan_step_count: int = 0
         self.executing_step: Union[str, Literal[False]] = False
         self._already_executed: bool = False
+        # steps added in the current iteration of the event loop and the
+        # future their results are set to, if more than one step is added
+        self._active_lazy_steps: Optional[List[_BaseLazyStep[Any]]] = None
+        self._active_results: Optional[asyncio.Future[List[Any]]] = None
+        # steps executed ahead, whose results are not published yet
+        self._run_ahead_steps: List[DefaultStep] = []
+        self._run_ahead_lazy_steps: List[_BaseLazyStep[Any]] = []
+        self._run_ahead_outputs: List[_SerializedOutput] = []
+        self._run_ahead_started: float = 0.0
+        # start of the request, for the invocation deadline
+        self._started: float = time.monotonic()
+        # set if the route function runs in a task of a `WarmResumeCache`
+        self._suspended_run: Optional[_SuspendedRun] = None
 
     async def add_step(self, step_info: _BaseLazyStep[TResult]) -> TResult:
+        """
+        Adds a step and returns its result.
+
+        Steps added in the same iteration of the event loop, like the steps
+        passed to `asyncio.gather`, are executed together as parallel steps.
+        The first of them yields once so that the others can be added, then
+        runs all of them and sets the results of the others.
+
+        :param step_info: lazy step to execute
+        :return: step result
+        """
         self.step_count += 1
-        return cast(TResult, await self.run_single(step_info))
+
+        if self._active_lazy_steps is not None:
+            index = len(self._active_lazy_steps)
+            self._active_lazy_steps.append(step_info)
+            if self._active_results is None:
+                self._active_results = asyncio.get_running_loop().create_future()
+            return cast(TResult, (await self._active_results)[index])
+
+        lazy_steps: List[_BaseLazyStep[Any]] = [step_info]
+        self._active_lazy_steps = lazy_steps
+        self._active_results = None
+        await asyncio.sleep(0)
+        results_future = self._active_results
+        self._active_lazy_steps = None
+        self._active_results = None
+
+        try:
+            results = await self.run_steps(lazy_steps)
+        except BaseException as error:
+            if results_future is not None:
+                results_future.set_exception(error)
+            raise
+        if results_future is not None:
+            results_future.set_result(results)
+        return cast(TResult, results[0])
+
+    async def run_steps(self, lazy_steps: List[_BaseLazyStep[Any]]) -> List[Any]:
+        if len(lazy_steps) == 1:
+            return [await self.run_single(lazy_steps[0])]
+        return await self.run_parallel(lazy_steps)
 
     async def run_single(self, lazy_step: _BaseLazyStep[TResult]) -> Any:
         """
@@ -44,34 +114,286 @@ class _AutoExecutor:
         :param lazy_step: lazy step to execute
         :return: step result
         """
-        if self.step_count < self.non_plan_step_count:
-            step = self.steps[self.step_count + self.plan_step_count]
-            _validate_step(lazy_step, step)
-            return step.out
+        index = self.steps._find(self.step_count)
+        if index is not None:
+            _validate_step(
+                lazy_step, self.steps.step_name(index), self.steps.step_type(index)
+            )
+            return await self._step_out(index)
+
+        self._check_run_ahead_trigger(self.step_count)
+        await self._check_deadline([lazy_step])
 
         if self._already_executed:
             raise WorkflowError(
-                "Running parallel steps is not yet available in workflow-py. Ensure that you are awaiting the steps sequentially."
+                "Only one new step can be executed in a request. Ensure that you are awaiting the steps sequentially, or running them in parallel with asyncio.gather."
             )
-        self._already_executed = True
 
+        if not self._run_ahead_steps:
+            self._run_ahead_started = time.monotonic()
+        step_started = time.monotonic()
         result_step = await lazy_step.get_result_step(NO_CONCURRENCY, self.step_count)
-        await self.submit_steps_to_qstash([result_step], [lazy_step])
-        return result_step.out
+        if (
+            self.context._invocation_deadline is not None
+            and lazy_step.step_type == "Run"
+        ):
+            self.context._invocation_deadline._record(
+                lazy_step.step_name, time.monotonic() - step_started
+            )
+        if self._should_run_ahead(lazy_step):
+            return self._add_run_ahead_step(result_step, lazy_step)
+
+        self._already_executed = True
+        await self.submit_steps_to_qstash([result_step], [lazy_step], suspend=True)
+
+        # resumed with the history of the request of the step. its result is
+        # the last step, so the rest of the history doesn't have to be indexed
+        self._already_executed = False
+        last_index = len(self.steps) - 1
+        if self.steps.step_id(last_index) != self.step_count:
+            last_index = cast(int, self.steps._find(self.step_count))
+        return await self._step_out(last_index)
+
+    def _should_run_ahead(self, lazy_step: _BaseLazyStep[Any]) -> bool:
+        """
+        Whether the request continues with the next step after executing the
+        step, instead of publishing the results.
+        """
+        policy = self.context._run_ahead
+        return (
+            policy is not None
+            and lazy_step.step_type == "Run"
+            and len(self._run_ahead_steps) + 1 < policy.max_steps
+            and time.monotonic() - self._run_ahead_started < policy.max_seconds
+        )
+
+    def _add_run_ahead_step(
+        self, result_step: DefaultStep, lazy_step: _BaseLazyStep[Any]
+    ) -> Any:
+        """
+        Keeps the result of a step executed ahead to be published with the
+        next steps.
+
+        :return: output of the step, as it's returned when it's replayed
+        """
+        json_codec = self.context._json_codec
+        serialized_output = self.context._serializers._serialize(
+            result_step.out, json_codec
+        )
+        self._run_ahead_steps.append(result_step)
+        self._run_ahead_lazy_steps.append(lazy_step)
+        self._run_ahead_outputs.append(serialized_output)
+        return _decode_output(
+            serialized_output.out,
+            _OutputFormat(serialized_output.encoding, serialized_output.out_type),
+            result_step.step_name,
+            json_codec,
+        )
+
+    async def _check_deadline(self, lazy_steps: List[_BaseLazyStep[Any]]) -> None:
+        """
+        Publishes the results of the steps executed ahead and ends the request
+        if the steps are estimated to exceed the invocation deadline. The steps
+        are executed in the next request.
+        """
+        deadline = self.context._invocation_deadline
+        if (
+            deadline is not None
+            and self._run_ahead_steps
+            and deadline._should_defer(
+                [lazy_step.step_name for lazy_step in lazy_steps], self._started
+            )
+        ):
+            await self.submit_steps_to_qstash([], [])
+
+    def _check_run_ahead_trigger(self, step_id: int) -> None:
+        """
+        Ends the request before a new step is executed if the history doesn't
+        hold every step published with the previous step yet:
+        - the previous step was executed ahead, and the step published after
+          it is not received yet
+        - a later step is received before the step. QStash can deliver the
+          steps published in a batch in any order.
+
+        Like the "last" state of parallel steps, the request whose history
+        holds every step of the batch continues with the next step.
+
+        :param step_id: id of the step to execute, or of the first of the
+            parallel steps
+        """
+        previous_index = self.steps._find(step_id - 1)
+        if (
+            previous_index is not None and self.steps.run_ahead(previous_index)
+        ) or self.steps._has_steps_after(self.step_count):
+            raise WorkflowAbort("run-ahead")
+
+    async def submit_run_ahead_steps(self) -> None:
+        """
+        Publishes the results of the steps executed ahead, if there are any.
+        Called after the route function returns.
+        """
+        if self._run_ahead_steps:
+            await self.submit_steps_to_qstash([], [])
+
+    async def run_parallel(self, parallel_steps: List[_BaseLazyStep[Any]]) -> List[Any]:
+        """
+        Executes steps in parallel. Each request runs at most one of them:
+        - "first": none of the steps are planned yet. Plan steps targeting
+          each step are published in a single batch, so QStash calls the
+          endpoint for all of them at once.
+        - "partial": the request is called for a plan step. The targeted
+          step is executed and its result is published.
+        - "discard": the request is called for the result of one of the
+          steps while others are not finished yet. Nothing is executed.
+        - "last": the results of all steps are available and returned.
+
+        :param parallel_steps: lazy steps to execute
+        :return: step results, in the order of the steps
+        """
+        initial_step_count = self.step_count - (len(parallel_steps) - 1)
+        parallel_call_state = self._get_parallel_call_state(
+            len(parallel_steps), initial_step_count
+        )
+
+        if parallel_call_state != "first":
+            planned_index = self.steps._find(0, initial_step_count)
+            planned_step_count = (
+                None if planned_index is None else self.steps.concurrent(planned_index)
+            )
+            if planned_step_count != len(parallel_steps):
+                raise WorkflowError(
+                    f"Incompatible number of parallel steps when call state was '{parallel_call_state}'. "
+                    f"Expected {len(parallel_steps)}, got {planned_step_count} from the request."
+                )
+
+        if parallel_call_state == "first":
+            self._check_run_ahead_trigger(initial_step_count)
+            plan_steps = [
+                parallel_step.get_plan_step(
+                    len(parallel_steps), initial_step_count + index
+                )
+                for index, parallel_step in enumerate(parallel_steps)
+            ]
+            await self.submit_steps_to_qstash(plan_steps, parallel_steps)
+        elif parallel_call_state == "partial":
+            plan_index = len(self.steps) - 1
+            target_step = self.steps.target_step(plan_index)
+            parallel_step = parallel_steps[target_step - initial_step_count]
+            _validate_step(
+                parallel_step,
+                self.steps.step_name(plan_index),
+                self.steps.step_type(plan_index),
+            )
+            result_step = await parallel_step.get_result_step(
+                len(parallel_steps), target_step
+            )
+            await self.submit_steps_to_qstash([result_step], [parallel_step])
+        elif parallel_call_state == "discard":
+            raise WorkflowAbort("discarded parallel")
+
+        results = []
+        for index, parallel_step in enumerate(parallel_steps):
+            result_index = cast(int, self.steps._find(initial_step_count + index))
+            _validate_step(
+                parallel_step,
+                self.steps.step_name(result_index),
+                self.steps.step_type(result_index),
+            )
+            results.append(await self._step_out(result_index))
+        return results
+
+    async def _step_out(self, index: int) -> Any:
+        """
+        Reads the output of a step in the history. Outputs in a blob store are
+        read and decoded in the default executor of the event loop, since
+        `BlobStore.get` blocks.
+        """
+        if self.steps._has_blob(index):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.steps.step_out, index
+            )
+        return self.steps.step_out(index)
+
+    def _get_parallel_call_state(
+        self, parallel_step_count: int, initial_step_count: int
+    ) -> Literal["first", "partial", "discard", "last"]:
+        """
+        Decides what the request does for the parallel steps, based on which of
+        their plan and result steps are in the history. See `run_parallel`.
+
+        :param parallel_step_count: number of parallel steps
+        :param initial_step_count: step id of the first parallel step
+        """
+        step_ids = range(initial_step_count, initial_step_count + parallel_step_count)
+        results = [self.steps._find(step_id) for step_id in step_ids]
+        if all(index is not None for index in results):
+            return "last"
+
+        if all(index is None for index in results) and all(
+            self.steps._find(0, step_id) is None for step_id in step_ids
+        ):
+            return "first"
+
+        last_index = len(self.steps) - 1
+        target_step = self.steps.target_step(last_index)
+        if (
+            self.steps.step_id(last_index) == 0
+            and target_step in step_ids
+            and results[target_step - initial_step_count] is None
+        ):
+            return "partial"
+
+        return "discard"
+
+    def _should_continue_as_new(self) -> bool:
+        """
+        Whether the continue-as-new policy is exceeded at the current position
+        of the route function. See the sync version for details.
+        """
+        policy = self.context._continue_as_new_policy
+        if policy is None:
+            return False
+
+        next_step = self.step_count + 1
+        if (
+            self.steps._find(next_step) is not None
+            or self.steps._find(0, next_step) is not None
+        ):
+            return False
+
+        return policy._is_exceeded(self.step_count, self.steps.history_size)
 
     async def submit_steps_to_qstash(
-        self, steps: List[DefaultStep], lazy_steps: List[_BaseLazyStep[Any]]
+        self,
+        steps: List[DefaultStep],
+        lazy_steps: List[_BaseLazyStep[Any]],
+        suspend: bool = False,
     ) -> None:
         """
-        sends the steps to QStash as batch
+        sends the steps to QStash as batch, after the results of the steps
+        executed ahead
 
         :param steps: steps to send
+        :param suspend: whether the route function can be suspended until the
+            request of the last step resumes it, instead of being aborted
         """
+        run_ahead_count = len(self._run_ahead_steps)
+        run_ahead_outputs = self._run_ahead_outputs
+        if run_ahead_count:
+            steps = self._run_ahead_steps + steps
+            lazy_steps = self._run_ahead_lazy_steps + lazy_steps
+            self._run_ahead_steps = []
+            self._run_ahead_lazy_steps = []
+            self._run_ahead_outputs = []
+
         if not steps:
             raise WorkflowError(
                 f"Unable to submit steps to QStash. Provided list is empty. Current step: {self.step_count}"
             )
 
+        # the first new step, or the last step executed ahead if there are none
+        abort_step = steps[min(run_ahead_count, len(steps) - 1)]
+
         batch_requests = []
         for index, single_step in enumerate(steps):
             lazy_step = lazy_steps[index]
@@ -91,67 +413,107 @@ class _AutoExecutor:
                 single_step.concurrent == NO_CONCURRENCY or single_step.step_id == 0
             )
 
-            single_step.out = json.dumps(single_step.out)
+            serialized_output = (
+                run_ahead_outputs[index]
+                if index < run_ahead_count
+                else self.context._serializers._serialize(
+                    single_step.out, self.context._json_codec
+                )
+            )
+            out, output_compression = (
+                (serialized_output.out, None)
+                if self.context._output_compression is None
+                else self.context._output_compression._compress_output(
+                    single_step.step_name, serialized_output.out
+                )
+            )
+            output_blob: Optional[str] = None
+            if self.context._blob_offload is not None:
+                out, output_blob = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    self.context._blob_offload._offload_output,
+                    self.context.workflow_run_id,
+                    out,
+                )
+            single_step.out = out
 
             batch_requests.append(
-                BatchJsonRequest(
+                BatchRequest(
                     headers=headers,
                     method=cast(HTTPMethods, single_step.call_method),
-                    body=single_step.call_body,
+                    body=self.context._json_codec.dumps(single_step.call_body),
+                    content_type=DEFAULT_CONTENT_TYPE,
                     url=single_step.call_url,
                 )
                 if single_step.call_url
                 else (
-                    BatchJsonRequest(
+                    BatchRequest(
                         headers=headers,
-                        body={
-                            "method": "POST",
-                            "stepId": single_step.step_id,
-                            "stepName": single_step.step_name,
-                            "stepType": single_step.step_type,
-                            "out": single_step.out,
-                            "sleepFor": single_step.sleep_for,
-                            "sleepUntil": single_step.sleep_until,
-                            "concurrent": single_step.concurrent,
-                            "targetStep": single_step.target_step,
-                            "callUrl": single_step.call_url,
-                            "callMethod": single_step.call_method,
-                            "callBody": single_step.call_body,
-                            "callHeaders": single_step.call_headers,
-                        },
+                        body=_encode_step_body(
+                            {
+                                "method": "POST",
+                                "stepId": single_step.step_id,
+                                "stepName": single_step.step_name,
+                                "stepType": single_step.step_type,
+                                "out": single_step.out,
+                                "outEncoding": serialized_output.encoding,
+                                "outType": serialized_output.out_type,
+                                "outCompression": output_compression,
+                                "outBlob": output_blob,
+                                "sleepFor": single_step.sleep_for,
+                                "sleepUntil": single_step.sleep_until,
+                                "concurrent": single_step.concurrent,
+                                "targetStep": single_step.target_step,
+                                "callUrl": single_step.call_url,
+                                "callMethod": single_step.call_method,
+                                "callBody": single_step.call_body,
+                                "callHeaders": single_step.call_headers,
+                                # requests triggered by the step end without
+                                # executing the next step, published with it
+                                "runAhead": True
+                                if index < min(run_ahead_count, len(steps) - 1)
+                                else None,
+                            },
+                            self.context._json_codec,
+                        ),
+                        content_type=DEFAULT_CONTENT_TYPE,
                         url=self.context.url,
-                        not_before=cast(  # TODO: Change not_before type in BatchJsonRequest
+                        not_before=cast(  # TODO: Change not_before type in BatchRequest
                             Any, single_step.sleep_until if will_wait else None
                         ),
                         delay=cast(Any, single_step.sleep_for if will_wait else None),
                     )
                 )
             )
-        await self.context.qstash_client.message.batch_json(batch_requests)
-        raise WorkflowAbort(steps[0].step_name, steps[0])
+        await self.context.qstash_client.message.batch(batch_requests)
+        if suspend and self._suspended_run is not None:
+            await self._suspended_run._suspend(abort_step, len(self.steps) + len(steps))
+            return
+        raise WorkflowAbort(abort_step.step_name, abort_step)
 
 
 def _validate_step(
-    lazy_step: _BaseLazyStep[Any], step_from_request: DefaultStep
+    lazy_step: _BaseLazyStep[Any], step_name: str, step_type: str
 ) -> None:
     """
-    Given a BaseLazyStep which is created during execution and a Step parsed
-    from the incoming request; compare the step names and types to make sure
-    that they are the same.
+    Given a BaseLazyStep which is created during execution and the name and
+    the type of the step parsed from the incoming request; compare the step
+    names and types to make sure that they are the same.
 
     Raises `WorkflowError` if there is a difference.
 
     :param lazy_step: lazy step created during execution
-    :param step_from_request: step parsed from incoming request
+    :param step_name: name of the step parsed from incoming request
+    :param step_type: type of the step parsed from incoming request
     """
-    if lazy_step.step_name != step_from_request.step_name:
+    if lazy_step.step_name != step_name:
         raise WorkflowError(
             f"Incompatible step name. Expected '{lazy_step.step_name}', "
-            f"got '{step_from_request.step_name}' from the request"
+            f"got '{step_name}' from the request"
         )
 
-    if lazy_step.step_type != step_from_request.step_type:
+    if lazy_step.step_type != step_type:
         raise WorkflowError(
             f"Incompatible step type. Expected '{lazy_step.step_type}', "
-            f"got '{step_from_request.step_type}' from the request"
+            f"got '{step_type}' from the request"
         )
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Union, cast
+from qstash import Receiver
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.history import _StepFields, _StepHistory
+from upstash_workflow.types import _ParseRequestResponse
+from upstash_workflow.workflow_parser import _parse_request
+from upstash_workflow.workflow_requests import _verify_request
+from upstash_workflow.workflow_types import _AsyncRequest
+
+
+@dataclass
+class ParseOffloadStats:
+    """
+    Counters of the requests handled by a `ParseOffload`.
+
+    `offloaded_seconds` is the time spent verifying and parsing requests in the
+    executor, which is the time the event loop would otherwise be blocked for.
+    `max_offloaded_seconds` is the longest of these stalls.
+    """
+
+    offloaded_requests: int = 0
+    offloaded_bytes: int = 0
+    offloaded_seconds: float = 0.0
+    max_offloaded_seconds: float = 0.0
+    inline_requests: int = 0
+    inline_bytes: int = 0
+
+
+class ParseOffload:
+    """
+    Moves the verification and parsing of large step histories off the event
+    loop in `async_serve`.
+
+    Requests whose `Content-Length` is at least `threshold` bytes are read
+    completely, then verified and decoded in `executor`. Smaller requests, and
+    requests without a `Content-Length`, are parsed on the event loop while the
+    body is received.
+
+    With a `ProcessPoolExecutor`, the receiver and the JSON codec are pickled
+    and sent to the worker with the body, and the decoded steps are sent back.
+
+    :param threshold: body size in bytes from which parsing is offloaded. 1 MiB by default.
+    :param executor: executor to parse in. The default executor of the event loop is used if not passed.
+    """
+
+    def __init__(
+        self, threshold: int = 1024 * 1024, executor: Optional[Executor] = None
+    ):
+        self.threshold = threshold
+        self.executor = executor
+        self.stats = ParseOffloadStats()
+
+    def _should_offload(self, request: _AsyncRequest) -> bool:
+        """
+        Decides whether the request is parsed in the executor. Requests which
+        are not offloaded are counted as inline requests. Requests with an
+        invalid `Content-Length` are parsed inline.
+        """
+        content_length = (
+            request.headers.get("content-length") if request.headers else None
+        )
+        try:
+            size = int(content_length) if content_length else None
+        except ValueError:
+            size = None
+
+        if size is not None and size >= self.threshold:
+            return True
+
+        self.stats.inline_requests += 1
+        self.stats.inline_bytes += size or 0
+        return False
+
+    async def _parse_request(
+        self,
+        request_payload: bytes,
+        signature: Optional[str],
+        receiver: Optional[Receiver],
+        json_codec: JsonCodec,
+        known_steps: Optional[Dict[str, _StepFields]] = None,
+    ) -> _ParseRequestResponse:
+        """
+        Verifies the request and decodes all of its steps in the executor.
+
+        :param request_payload: body of the request
+        :param signature: signature of the request
+        :param receiver: receiver to verify the request with
+        :param json_codec: codec to decode the request with
+        :param known_steps: steps decoded by earlier requests, keyed by message id
+        :return: raw initial payload and the decoded steps
+        """
+        loop = asyncio.get_running_loop()
+        parse_request_response, elapsed = await loop.run_in_executor(
+            self.executor,
+            _verify_and_parse_request,
+            request_payload,
+            signature,
+            receiver,
+            json_codec,
+            known_steps,
+        )
+
+        self.stats.offloaded_requests += 1
+        self.stats.offloaded_bytes += len(request_payload)
+        self.stats.offloaded_seconds += elapsed
+        self.stats.max_offloaded_seconds = max(
+            self.stats.max_offloaded_seconds, elapsed
+        )
+        return parse_request_response
+
+
+def _verify_and_parse_request(
+    request_payload: Union[str, bytes],
+    signature: Optional[str],
+    receiver: Optional[Receiver],
+    json_codec: JsonCodec,
+    known_steps: Optional[Dict[str, _StepFields]],
+) -> Tuple[_ParseRequestResponse, float]:
+    """
+    Verifies and parses a request which is not the first invocation. All steps
+    are decoded, since decoding them later would run on the event loop.
+    Outputs in a blob store are left as references, they are only read if
+    the route function reads them.
+
+    Defined at the module level so that it can run in a process pool.
+
+    :return: parsed request and the time it took in seconds
+    """
+    start = time.perf_counter()
+
+    _verify_request(request_payload, signature, receiver)
+    parse_request_response = _parse_request(
+        request_payload, False, json_codec, known_steps
+    )
+    # decode every step. the history is returned with the decoded steps
+    steps = cast(_StepHistory, parse_request_response.steps)
+    for index in range(len(steps)):
+        if not steps._has_blob(index):
+            steps.step_out(index)
+
+    return parse_request_response, time.perf_counter() - start
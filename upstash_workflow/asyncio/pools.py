@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from inspect import isawaitable, iscoroutinefunction
+from typing import Any, Awaitable, Callable, Literal, Optional, Union
+from upstash_workflow.error import WorkflowError
+
+StepExecutor = Union[Literal["process"], Executor]
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by the steps run with `executor="process"`,
+    creating it the first time. It has a worker per CPU.
+
+    Workers are spawned rather than forked, so that they don't inherit the
+    event loop and the threads of the web server.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def _run_in_executor(
+    step_name: str,
+    step_function: Callable[[], Any],
+    executor: StepExecutor,
+) -> Callable[[], Awaitable[Any]]:
+    """
+    Wraps a step function to be run in an executor instead of on the event
+    loop.
+
+    :param step_name: name of the step, for errors
+    :param step_function: synchronous step function
+    :param executor: "process" for the shared process pool, or an executor
+    """
+    if not isinstance(executor, Executor) and executor != "process":
+        raise WorkflowError(f"Unsupported step executor '{executor}'")
+    if iscoroutinefunction(step_function):
+        raise WorkflowError(
+            f"Step '{step_name}' can't run in an executor, since its function is async."
+        )
+
+    async def run_step_function() -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            executor if isinstance(executor, Executor) else _get_process_pool(),
+            step_function,
+        )
+
+    return run_step_function
+
+
+@dataclass
+class SyncStepOffloadStats:
+    """
+    Counters of the step functions run by a `SyncStepOffload`.
+
+    `queued_seconds` is the time steps waited for a free thread, which grows
+    when the pool is too small. `busy_seconds` is the time threads spent
+    running steps. `active_steps` are the steps running at the moment, and
+    `max_active_steps` the most that ran at once.
+    """
+
+    offloaded_steps: int = 0
+    active_steps: int = 0
+    max_active_steps: int = 0
+    queued_seconds: float = 0.0
+    busy_seconds: float = 0.0
+
+
+class SyncStepOffload:
+    """
+    Runs the synchronous step functions of `async_serve` in a thread pool
+    instead of on the event loop.
+
+    Blocking I/O in a step function, such as a database driver or `requests`,
+    otherwise stalls every other request handled by the event loop. Step
+    functions run with a copy of the context variables of the request. If a
+    function returns an awaitable, like `lambda: fetch(url)`, the awaitable is
+    awaited on the event loop. Async step functions and steps run with an
+    `executor` are not offloaded.
+
+    :param max_workers: maximum number of threads, and of steps running at once. 32 by default.
+    """
+
+    def __init__(self, max_workers: int = 32):
+        self.max_workers = max_workers
+        self.stats = SyncStepOffloadStats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._created = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def utilization(self) -> float:
+        """
+        Share of the capacity of the pool spent running steps since it was
+        created, between 0 and 1.
+        """
+        elapsed = time.monotonic() - self._created
+        return (
+            self.stats.busy_seconds / (self.max_workers * elapsed) if elapsed else 0.0
+        )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="upstash-workflow-step",
+                )
+            return self._executor
+
+    def _run_step_function(
+        self, step_function: Callable[[], Any], submitted: float
+    ) -> Any:
+        started = time.monotonic()
+        with self._lock:
+            self.stats.queued_seconds += started - submitted
+            self.stats.active_steps += 1
+            self.stats.max_active_steps = max(
+                self.stats.max_active_steps, self.stats.active_steps
+            )
+
+        try:
+            return step_function()
+        finally:
+            with self._lock:
+                self.stats.active_steps -= 1
+                self.stats.busy_seconds += time.monotonic() - started
+
+    def _offload(
+        self, step_function: Callable[[], Any]
+    ) -> Callable[[], Awaitable[Any]]:
+        """
+        Wraps a synchronous step function to be run in the thread pool.
+        """
+
+        async def run_step_function() -> Any:
+            with self._lock:
+                self.stats.offloaded_steps += 1
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(),
+                contextvars.copy_context().run,
+                self._run_step_function,
+                step_function,
+                time.monotonic(),
+            )
+            if isawaitable(result):
+                result = await result
+            return result
+
+        return run_step_function
@@ -0,0 +1,205 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, List, Optional
+from upstash_workflow.error import WorkflowAbort
+from upstash_workflow.history import _StepHistory
+from upstash_workflow.types import DefaultStep
+
+if TYPE_CHECKING:
+    from upstash_workflow import AsyncWorkflowContext
+
+
+@dataclass
+class WarmResumeStats:
+    """
+    Counters of the requests handled by a `WarmResumeCache`.
+
+    `hits` are the requests which resumed a suspended route function and
+    `misses` the requests which replayed the route function from the start.
+    `evictions` are the suspended route functions cancelled because the cache
+    was full or they were not resumed for `ttl` seconds.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class _SuspendedRun:
+    """
+    Route function of a run running in a task, which is suspended after it
+    publishes a step until the request with the result of the step arrives.
+    """
+
+    def __init__(self, workflow_context: AsyncWorkflowContext[Any]):
+        self.workflow_context = workflow_context
+        self.task: Optional[asyncio.Task[None]] = None
+        # length of the history of the request which resumes the run
+        self.history_length = 0
+        self.expires_at = 0.0
+        self._suspended: Optional[asyncio.Future[DefaultStep]] = None
+        self._resumed: Optional[asyncio.Future[_StepHistory]] = None
+
+    async def _suspend(self, abort_step: DefaultStep, history_length: int) -> None:
+        """
+        Called by the executor after it publishes steps. Ends the request
+        which runs the route function and waits for the request of the
+        published steps to resume it, with the history of that request.
+
+        :param abort_step: step which ends the request
+        :param history_length: length of the history once the steps are delivered
+        """
+        assert self._suspended is not None
+        self.history_length = history_length
+        self._resumed = asyncio.get_running_loop().create_future()
+        if not self._suspended.done():
+            self._suspended.set_result(abort_step)
+        executor = self.workflow_context._executor
+        executor.steps = await self._resumed
+        executor._started = time.monotonic()
+
+    async def _wait(self) -> None:
+        """
+        Waits until the route function finishes, or raises `WorkflowAbort`
+        when it suspends. The route function is cancelled if the request is.
+        """
+        assert self.task is not None
+        self._suspended = asyncio.get_running_loop().create_future()
+        waiters: List[asyncio.Future[Any]] = [self.task, self._suspended]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self.task.cancel()
+            raise
+
+        if not self._suspended.done():
+            self._suspended.cancel()
+            # raises if the route function failed or the request was aborted
+            self.task.result()
+            return
+
+        abort_step = self._suspended.result()
+        raise WorkflowAbort(abort_step.step_name, abort_step)
+
+
+class WarmResumeCache:
+    """
+    Keeps the route functions of runs suspended in memory between the
+    requests of the run in `async_serve`.
+
+    Without it, every request replays the route function from the start
+    against the whole history. With the cache, the route function runs in a
+    task which isn't ended when a step is published, but waits for the
+    result of the step. When the request with the result arrives at the same
+    process and event loop, the task continues from the step with the
+    history of the request, and the steps before it are not replayed.
+
+    Requests resume a run only if their history has exactly the steps
+    published by the suspended run. Other requests, such as the requests of
+    parallel steps or requests arriving at another process, replay the route
+    function as usual, so the cache only saves work.
+
+    A resumed route function keeps the `context` of the request which started
+    it. `context.headers` are updated with each request. Context variables
+    set by the web framework for a request are not.
+
+    Suspended runs are cancelled when the cache is full, in least recently
+    used order, and when they are not resumed for `ttl` seconds.
+
+    :param max_size: maximum number of suspended runs to keep
+    :param ttl: seconds after which a suspended run is cancelled
+    """
+
+    def __init__(self, max_size: int = 100, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = WarmResumeStats()
+        self._runs: "OrderedDict[str, _SuspendedRun]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def _evict(self, workflow_run_id: str) -> None:
+        suspended_run = self._runs.pop(workflow_run_id)
+        assert suspended_run.task is not None
+        suspended_run.task.cancel()
+        self.stats.evictions += 1
+
+    def _take(
+        self, workflow_run_id: str, steps: _StepHistory
+    ) -> Optional[_SuspendedRun]:
+        """
+        Removes the suspended run of the request from the cache if the
+        request can resume it.
+        """
+        now = time.monotonic()
+        for expired_run_id in [
+            run_id
+            for run_id, suspended_run in self._runs.items()
+            if suspended_run.expires_at <= now
+        ]:
+            self._evict(expired_run_id)
+
+        suspended_run = self._runs.get(workflow_run_id)
+        if suspended_run is not None and suspended_run.history_length < len(steps):
+            # the run continued in another process
+            self._evict(workflow_run_id)
+            return None
+        if (
+            suspended_run is None
+            or suspended_run.history_length != len(steps)
+            or suspended_run.task is None
+            or suspended_run.task.get_loop() is not asyncio.get_running_loop()
+        ):
+            return None
+        return self._runs.pop(workflow_run_id)
+
+    def _put(self, workflow_run_id: str, suspended_run: _SuspendedRun) -> None:
+        suspended_run.expires_at = time.monotonic() + self.ttl
+        if workflow_run_id in self._runs:
+            self._evict(workflow_run_id)
+        self._runs[workflow_run_id] = suspended_run
+        while len(self._runs) > self.max_size:
+            self._evict(next(iter(self._runs)))
+
+    async def _run(
+        self,
+        workflow_context: AsyncWorkflowContext[Any],
+        route_function: Callable[[AsyncWorkflowContext[Any]], Awaitable[None]],
+    ) -> None:
+        """
+        Resumes the suspended route function of the run if the request has
+        the results of its steps, or starts the route function in a new task.
+        Returns or raises like the route function, when it finishes or a step
+        is published.
+        """
+        workflow_run_id = workflow_context.workflow_run_id
+        steps = workflow_context._executor.steps
+        suspended_run = self._take(workflow_run_id, steps)
+
+        if suspended_run is not None:
+            self.stats.hits += 1
+            suspended_run.workflow_context.headers = workflow_context.headers
+            assert suspended_run._resumed is not None
+            suspended_run._resumed.set_result(steps)
+        else:
+            self.stats.misses += 1
+            suspended_run = _SuspendedRun(workflow_context)
+            workflow_context._executor._suspended_run = suspended_run
+
+            async def run_route_function() -> None:
+                await route_function(workflow_context)
+                await workflow_context._executor.submit_run_ahead_steps()
+
+            suspended_run.task = asyncio.create_task(run_route_function())
+
+        try:
+            await suspended_run._wait()
+        except WorkflowAbort:
+            assert suspended_run.task is not None
+            if not suspended_run.task.done():
+                self._put(workflow_run_id, suspended_run)
+            raise
@@ -1,4 +1,4 @@
-from typing import Callable, Awaitable, Literal, TypeVar, Generic
+from typing import Callable, Awaitable, Literal, TypeVar, Generic, Any, NoReturn
 from qstash import AsyncQStash
 from upstash_workflow import AsyncWorkflowContext
 from upstash_workflow.asyncio.context.steps import _BaseLazyStep
@@ -16,6 +16,9 @@ class _DisabledWorkflowContext(
     async def _add_step(self, _step: _BaseLazyStep[TResult]) -> TResult:
         raise WorkflowAbort(self.__disabled_message)
 
+    async def continue_as_new(self, _payload: Any) -> NoReturn:
+        raise WorkflowAbort(self.__disabled_message)
+
     async def cancel(self) -> None:
         return
 
@@ -3,6 +3,17 @@ import json
 import logging
 from typing import Callable, Dict, Optional, cast, TypeVar, Any, Generic, Awaitable
 from qstash import AsyncQStash, Receiver
+from upstash_workflow.codec import JsonCodec, StdlibJsonCodec
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.types import ContinueAsNewPolicy, HeaderFilter, RunAheadPolicy
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
+from upstash_workflow.asyncio.offload import ParseOffload
+from upstash_workflow.asyncio.resume import WarmResumeCache
+from upstash_workflow.asyncio.pools import SyncStepOffload
 from upstash_workflow.workflow_types import _Response
 from upstash_workflow.constants import (
     DEFAULT_RETRIES,
@@ -34,6 +45,19 @@ class ServeOptions(Generic[TInitialPayload, TResponse]):
         Callable[[AsyncWorkflowContext, int, str, Dict[str, str]], Awaitable[Any]]
     ]
     failure_url: Optional[str]
+    json_codec: JsonCodec
+    history_cache: Optional[HistoryCache]
+    continue_as_new_policy: Optional[ContinueAsNewPolicy]
+    serializers: Optional[SerializerRegistry]
+    output_compression: Optional[OutputCompression]
+    blob_offload: Optional[BlobOffload]
+    run_ahead: Optional[RunAheadPolicy]
+    step_memoization: Optional[StepMemoization]
+    invocation_deadline: Optional[InvocationDeadline]
+    header_filter: Optional[HeaderFilter]
+    parse_offload: Optional[ParseOffload]
+    warm_resume: Optional[WarmResumeCache]
+    sync_step_offload: Optional[SyncStepOffload]
 
 
 @dataclass
@@ -57,8 +81,22 @@ def _process_options(
         Callable[[AsyncWorkflowContext, int, str, Dict[str, str]], Awaitable[Any]]
     ] = None,
     failure_url: Optional[str] = None,
+    json_codec: Optional[JsonCodec] = None,
+    history_cache: Optional[HistoryCache] = None,
+    continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+    serializers: Optional[SerializerRegistry] = None,
+    output_compression: Optional[OutputCompression] = None,
+    blob_offload: Optional[BlobOffload] = None,
+    run_ahead: Optional[RunAheadPolicy] = None,
+    step_memoization: Optional[StepMemoization] = None,
+    invocation_deadline: Optional[InvocationDeadline] = None,
+    header_filter: Optional[HeaderFilter] = None,
+    parse_offload: Optional[ParseOffload] = None,
+    warm_resume: Optional[WarmResumeCache] = None,
+    sync_step_offload: Optional[SyncStepOffload] = None,
 ) -> ServeBaseOptions[TInitialPayload, TResponse]:
     environment = env if env is not None else dict(os.environ)
+    json_codec = json_codec or StdlibJsonCodec()
 
     receiver_environment_variables_set = bool(
         environment.get("QSTASH_CURRENT_SIGNING_KEY")
@@ -81,6 +119,7 @@ def _process_options(
                     headers={
                         WORKFLOW_PROTOCOL_VERSION_HEADER: WORKFLOW_PROTOCOL_VERSION
                     },
+                    json_codec=json_codec,
                 ),
             )
 
@@ -90,6 +129,7 @@ def _process_options(
                 body={"workflowRunId": workflow_run_id},
                 status=200,
                 headers={WORKFLOW_PROTOCOL_VERSION_HEADER: WORKFLOW_PROTOCOL_VERSION},
+                json_codec=json_codec,
             ),
         )
 
@@ -100,7 +140,7 @@ def _process_options(
 
         # Try to parse the payload
         try:
-            return cast(TInitialPayload, json.loads(initial_request))
+            return cast(TInitialPayload, json_codec.loads(initial_request))
         except json.JSONDecodeError:
             # If parsing fails, return the raw string
             return cast(TInitialPayload, initial_request)
@@ -135,6 +175,19 @@ def _process_options(
         url=url,
         failure_url=failure_url,
         failure_function=failure_function,
+        json_codec=json_codec,
+        history_cache=history_cache,
+        continue_as_new_policy=continue_as_new_policy,
+        serializers=serializers,
+        output_compression=output_compression,
+        blob_offload=blob_offload,
+        run_ahead=run_ahead,
+        step_memoization=step_memoization,
+        invocation_deadline=invocation_deadline,
+        header_filter=header_filter,
+        parse_offload=parse_offload,
+        warm_resume=warm_resume,
+        sync_step_offload=sync_step_offload,
     )
 
 
@@ -1,10 +1,23 @@
-import json
 import logging
 from typing import Optional, Callable, Awaitable, Dict, cast, TypeVar, Any
 from qstash import AsyncQStash, Receiver
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.types import ContinueAsNewPolicy, HeaderFilter, RunAheadPolicy
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
+from upstash_workflow.asyncio.offload import ParseOffload
+from upstash_workflow.asyncio.resume import WarmResumeCache
+from upstash_workflow.asyncio.pools import SyncStepOffload
 from upstash_workflow.workflow_types import _Response, _AsyncRequest
 from upstash_workflow.asyncio.workflow_parser import (
     _get_payload,
+    _parse_request_stream,
+    _fetch_request_steps,
+    _is_failure_callback,
     _handle_failure,
 )
 from upstash_workflow.workflow_parser import _validate_request, _parse_request
@@ -44,6 +57,19 @@ def _serve_base(
         Callable[[AsyncWorkflowContext, int, str, Dict[str, str]], Awaitable[Any]]
     ] = None,
     failure_url: Optional[str] = None,
+    json_codec: Optional[JsonCodec] = None,
+    history_cache: Optional[HistoryCache] = None,
+    continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+    serializers: Optional[SerializerRegistry] = None,
+    output_compression: Optional[OutputCompression] = None,
+    blob_offload: Optional[BlobOffload] = None,
+    run_ahead: Optional[RunAheadPolicy] = None,
+    step_memoization: Optional[StepMemoization] = None,
+    invocation_deadline: Optional[InvocationDeadline] = None,
+    header_filter: Optional[HeaderFilter] = None,
+    parse_offload: Optional[ParseOffload] = None,
+    warm_resume: Optional[WarmResumeCache] = None,
+    sync_step_offload: Optional[SyncStepOffload] = None,
 ) -> Dict[str, Callable[[TRequest], Awaitable[TResponse]]]:
     processed_options = _process_options(
         qstash_client=qstash_client,
@@ -56,6 +82,19 @@ def _serve_base(
         url=url,
         failure_function=failure_function,
         failure_url=failure_url,
+        json_codec=json_codec,
+        parse_offload=parse_offload,
+        warm_resume=warm_resume,
+        sync_step_offload=sync_step_offload,
+        history_cache=history_cache,
+        continue_as_new_policy=continue_as_new_policy,
+        serializers=serializers,
+        output_compression=output_compression,
+        blob_offload=blob_offload,
+        run_ahead=run_ahead,
+        step_memoization=step_memoization,
+        invocation_deadline=invocation_deadline,
+        header_filter=header_filter,
     )
     qstash_client = processed_options.qstash_client
     on_step_finish = processed_options.on_step_finish
@@ -67,6 +106,19 @@ def _serve_base(
     url = processed_options.url
     failure_url = processed_options.failure_url
     failure_function = processed_options.failure_function
+    json_codec = processed_options.json_codec
+    history_cache = processed_options.history_cache
+    continue_as_new_policy = processed_options.continue_as_new_policy
+    serializers = processed_options.serializers
+    output_compression = processed_options.output_compression
+    blob_offload = processed_options.blob_offload
+    run_ahead = processed_options.run_ahead
+    step_memoization = processed_options.step_memoization
+    invocation_deadline = processed_options.invocation_deadline
+    header_filter = processed_options.header_filter
+    parse_offload = processed_options.parse_offload
+    warm_resume = processed_options.warm_resume
+    sync_step_offload = processed_options.sync_step_offload
 
     async def _handler(request: TRequest) -> TResponse:
         workflow_url, workflow_failure_url = _determine_urls(
@@ -77,18 +129,60 @@ def _serve_base(
             failure_url,
         )
 
-        request_payload = await _get_payload(request) or ""
-        _verify_request(
-            request_payload,
-            None if not request.headers else request.headers.get("upstash-signature"),
-            receiver,
-        )
-
         validate_request_response = _validate_request(request)
         is_first_invocation = validate_request_response.is_first_invocation
         workflow_run_id = validate_request_response.workflow_run_id
 
-        parse_request_response = _parse_request(request_payload, is_first_invocation)
+        cached_run = (
+            history_cache._get(workflow_run_id)
+            if history_cache is not None and not is_first_invocation
+            else None
+        )
+        known_steps = (
+            None
+            if history_cache is None
+            else ({} if cached_run is None else cached_run.steps)
+        )
+
+        signature = (
+            None if not request.headers else request.headers.get("upstash-signature")
+        )
+
+        if is_first_invocation or _is_failure_callback(request):
+            request_payload = await _get_payload(request) or b""
+            _verify_request(request_payload, signature, receiver)
+            parse_request_response = _parse_request(
+                request_payload, is_first_invocation, json_codec
+            )
+        elif parse_offload is not None and parse_offload._should_offload(request):
+            request_payload = await _get_payload(request) or b""
+            parse_request_response = await parse_offload._parse_request(
+                request_payload, signature, receiver, json_codec, known_steps
+            )
+        else:
+            # steps are indexed while the body is received and decoded after
+            # the request is verified. the body is only kept if it's needed
+            # to verify the request.
+            request_payload, streamed_response = await _parse_request_stream(
+                request, json_codec, receiver is not None, known_steps
+            )
+            _verify_request(request_payload, signature, receiver)
+            parse_request_response = (
+                streamed_response
+                if streamed_response is not None
+                else await _fetch_request_steps(
+                    qstash_client,
+                    workflow_run_id,
+                    None
+                    if not request.headers
+                    else request.headers.get("upstash-message-id"),
+                    json_codec,
+                    known_steps,
+                )
+            )
+
+        if parse_request_response.workflow_run_ended:
+            return on_step_finish(workflow_run_id, "workflow-already-ended")
 
         raw_initial_payload = parse_request_response.raw_initial_payload
         steps = parse_request_response.steps
@@ -102,23 +196,42 @@ def _serve_base(
             failure_function,
             env,
             retries,
+            json_codec,
+            header_filter,
         )
 
         if failure_check == "is-failure-callback":
             return on_step_finish(workflow_run_id, "failure-callback")
 
+        initial_payload = (
+            initial_payload_parser(raw_initial_payload)
+            if history_cache is None
+            else history_cache._get_initial_payload(
+                cached_run, raw_initial_payload, initial_payload_parser
+            )
+        )
+
         workflow_context = AsyncWorkflowContext(
             qstash_client=qstash_client,
             workflow_run_id=workflow_run_id,
-            initial_payload=initial_payload_parser(raw_initial_payload),
+            initial_payload=initial_payload,
             headers=_recreate_user_headers(
-                {} if not request.headers else request.headers
+                {} if not request.headers else request.headers, header_filter
             ),
             steps=steps,
             url=workflow_url,
             env=env,
             retries=retries,
             failure_url=workflow_failure_url,
+            json_codec=json_codec,
+            continue_as_new_policy=continue_as_new_policy,
+            serializers=serializers,
+            output_compression=output_compression,
+            blob_offload=blob_offload,
+            run_ahead=run_ahead,
+            step_memoization=step_memoization,
+            invocation_deadline=invocation_deadline,
+            sync_step_offload=sync_step_offload,
         )
 
         auth_check = await _DisabledWorkflowContext[Any].try_authentication(
@@ -142,6 +255,8 @@ def _serve_base(
             workflow_url,
             workflow_failure_url,
             retries,
+            json_codec,
+            header_filter,
         )
 
         if call_return_check == "continue-workflow":
@@ -150,10 +265,25 @@ def _serve_base(
             else:
 
                 async def on_step() -> None:
-                    await route_function(workflow_context)
+                    try:
+                        if warm_resume is None:
+                            await route_function(workflow_context)
+                            await workflow_context._executor.submit_run_ahead_steps()
+                        else:
+                            await warm_resume._run(workflow_context, route_function)
+                    finally:
+                        if history_cache is not None:
+                            history_cache._put(
+                                workflow_run_id,
+                                raw_initial_payload,
+                                initial_payload,
+                                steps,
+                            )
 
                 async def on_cleanup() -> None:
                     await _trigger_workflow_delete(workflow_context)
+                    if history_cache is not None:
+                        history_cache._remove(workflow_run_id)
 
                 await _trigger_route_function(on_step=on_step, on_cleanup=on_cleanup)
 
@@ -168,7 +298,9 @@ def _serve_base(
             _logger.exception(error)
             return cast(
                 TResponse,
-                _Response(json.dumps(_format_workflow_error(error)), status=500),
+                _Response(
+                    _format_workflow_error(error), status=500, json_codec=json_codec
+                ),
             )
 
     return {"handler": _safe_handler}
@@ -188,6 +320,19 @@ def serve(
         Callable[[AsyncWorkflowContext, int, str, Dict[str, str]], Awaitable[Any]]
     ] = None,
     failure_url: Optional[str] = None,
+    json_codec: Optional[JsonCodec] = None,
+    history_cache: Optional[HistoryCache] = None,
+    continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+    serializers: Optional[SerializerRegistry] = None,
+    output_compression: Optional[OutputCompression] = None,
+    blob_offload: Optional[BlobOffload] = None,
+    run_ahead: Optional[RunAheadPolicy] = None,
+    step_memoization: Optional[StepMemoization] = None,
+    invocation_deadline: Optional[InvocationDeadline] = None,
+    header_filter: Optional[HeaderFilter] = None,
+    parse_offload: Optional[ParseOffload] = None,
+    warm_resume: Optional[WarmResumeCache] = None,
+    sync_step_offload: Optional[SyncStepOffload] = None,
 ) -> Dict[str, Callable[[TRequest], Awaitable[TResponse]]]:
     """
     Creates a method that handles incoming requests and runs the provided
@@ -202,6 +347,19 @@ def serve(
     :param env: Optionally, one can pass an env object mapping environment variables to their keys. Useful in cases like cloudflare with hono.
     :param retries: Number of retries to use in workflow requests, 3 by default
     :param url: Url of the endpoint where the workflow is set up. If not set, url will be inferred from the request.
+    :param json_codec: Codec used to encode and decode JSON in workflow requests. `StdlibJsonCodec` by default. `OrjsonCodec` and `MsgspecCodec` can be used for faster processing of large step histories.
+    :param history_cache: Keeps the decoded steps and the parsed initial payload of runs between requests, so that a request only decodes the steps added since the previous request of its run. See `HistoryCache`.
+    :param continue_as_new_policy: Limits of the step history after which `context.should_continue_as_new` is True, so that the route function can continue the run as new and keep the cost of replaying the history bounded. See `ContinueAsNewPolicy`.
+    :param serializers: Serializers used to publish the outputs of steps, which rebuild the outputs in their original types when steps are replayed. Dataclasses and pydantic models passed to the registry in `types`, bytes and NumPy arrays are supported by default. See `SerializerRegistry`.
+    :param output_compression: Compresses step outputs larger than its threshold before they are published, so that large outputs are smaller in every later request of the run. See `OutputCompression`.
+    :param blob_offload: Writes step outputs which are still larger than its threshold after compression to a blob store and publishes only a reference to them, so QStash messages stay small. See `BlobOffload`.
+    :param run_ahead: Executes consecutive `context.run` steps in the same request within its step and time budget, and publishes their results in a single batch instead of ending the request after every step. See `RunAheadPolicy`.
+    :param step_memoization: Shares the outputs of steps run with a `cache_key` between runs, so that a step whose output is stored is published without running its function. See `StepMemoization`.
+    :param invocation_deadline: Ends requests with `run_ahead` before a step which is estimated to exceed the time limit of the request, and executes the step in the next request instead. See `InvocationDeadline`.
+    :param header_filter: Selects the headers of the incoming request which are kept in `context.headers` and forwarded with every step, so that headers added by browsers and gateways are not published with every step. See `HeaderFilter`.
+    :param parse_offload: Moves the verification and parsing of requests larger than its threshold to an executor, so that large step histories don't block the event loop. See `ParseOffload`.
+    :param warm_resume: Keeps route functions suspended in memory after a step is published, and resumes them when the result of the step arrives at the same process instead of replaying the history. See `WarmResumeCache`.
+    :param sync_step_offload: Runs synchronous step functions in a thread pool instead of on the event loop, so that blocking I/O in steps doesn't stall other requests. See `SyncStepOffload`.
     :return: An method that consumes incoming requests and runs the workflow.
     """
     return _serve_base(
@@ -215,4 +373,17 @@ def serve(
         url=url,
         failure_function=failure_function,
         failure_url=failure_url,
+        json_codec=json_codec,
+        parse_offload=parse_offload,
+        warm_resume=warm_resume,
+        sync_step_offload=sync_step_offload,
+        history_cache=history_cache,
+        continue_as_new_policy=continue_as_new_policy,
+        serializers=serializers,
+        output_compression=output_compression,
+        blob_offload=blob_offload,
+        run_ahead=run_ahead,
+        step_memoization=step_memoization,
+        invocation_deadline=invocation_deadline,
+        header_filter=header_filter,
     )
@@ -1,38 +1,176 @@
-from typing import Optional, cast
+from typing import Optional, Union, Tuple, cast
 from upstash_workflow.workflow_types import _AsyncRequest
-import json
-from typing import Callable, Dict, Any, Literal, Awaitable, TypeVar
-from upstash_workflow.utils import _decode_base64
+from typing import Callable, Dict, Any, List, Literal, Awaitable, TypeVar
+from upstash_workflow.utils import _decode_base64, _decode_base64_bytes
 from upstash_workflow.constants import (
     WORKFLOW_FAILURE_HEADER,
 )
 from upstash_workflow.error import WorkflowError
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.history import _StepHistory, _StepFields, _MessageSplitter
+from upstash_workflow.types import HeaderFilter, _ParseRequestResponse
 from upstash_workflow.workflow_requests import _recreate_user_headers
 from upstash_workflow.asyncio.serve.authorization import _DisabledWorkflowContext
+from upstash_workflow.workflow_parser import (
+    _parse_messages,
+    _filter_messages,
+    _is_not_found_error,
+)
 from qstash import AsyncQStash
+from qstash.errors import QStashError
 from upstash_workflow import AsyncWorkflowContext
 
 
-async def _get_payload(request: _AsyncRequest) -> Optional[str]:
+async def _get_payload(request: _AsyncRequest) -> Optional[bytes]:
     """
     Gets the request body. If that fails, returns None
 
+    The body is not decoded, it is passed to the JSON codec as bytes.
+
     :param request: request received in the workflow api
     :return: request body
     """
     try:
-        return (await request.body()).decode()
+        return await request.body()
     except Exception:
         return None
 
 
+def _is_failure_callback(request: _AsyncRequest) -> bool:
+    return bool(
+        request.headers and request.headers.get(WORKFLOW_FAILURE_HEADER) == "true"
+    )
+
+
+async def _parse_request_stream(
+    request: _AsyncRequest,
+    json_codec: JsonCodec,
+    keep_body: bool,
+    known_steps: Optional[Dict[str, _StepFields]] = None,
+) -> Tuple[bytes, Optional[_ParseRequestResponse]]:
+    """
+    Parses the step history in the body of a request which is not the first
+    invocation, while the body is received from `request.stream()`.
+
+    Messages are split out of the body and added to the history as soon as
+    they are received completely, so the body doesn't have to be kept in
+    memory and parsed again after it is read. Steps are not decoded here.
+    The request is not verified yet, and decoding a step can read a blob
+    store or import the type of its output, so steps are decoded by the
+    history only when they are accessed, after the request is verified.
+
+    The whole body is still read since the workflow is replayed from the first
+    step and the signature of the request covers the whole body.
+
+    If the body is empty, None is returned instead of the parsed request. The
+    steps are fetched from QStash with `_fetch_request_steps` once the request
+    is verified.
+
+    :param request: request received in the workflow api
+    :param json_codec: codec to decode the messages and the steps with
+    :param keep_body: whether to keep and return the body, for instance to verify
+        the request. If False, only the message being received is kept in memory.
+    :param known_steps: steps decoded by earlier requests, keyed by message id
+    :return: request body (empty if `keep_body` is False) and the parsed request
+    """
+    splitter = _MessageSplitter(json_codec)
+    chunks: List[bytes] = []
+    raw_initial_payload = ""
+    steps: Optional[_StepHistory] = None
+    body_size = 0
+
+    async for chunk in request.stream():
+        body_size += len(chunk)
+        if keep_body:
+            chunks.append(chunk)
+
+        for message in splitter.feed(chunk):
+            if steps is None:
+                raw_initial_payload = _decode_base64(message["body"])
+                steps = _StepHistory(raw_initial_payload, [], json_codec, known_steps)
+            elif message["callType"] == "step":
+                steps._append_raw_step(message)
+
+    if not body_size:
+        return b"", None
+
+    if steps is None:
+        raise WorkflowError("Only first call can have an empty body")
+    splitter.close()
+
+    return b"".join(chunks), _ParseRequestResponse(
+        raw_initial_payload=raw_initial_payload, steps=steps
+    )
+
+
+async def _fetch_request_steps(
+    qstash_client: Optional[AsyncQStash],
+    workflow_run_id: str,
+    message_id: Optional[str],
+    json_codec: JsonCodec,
+    known_steps: Optional[Dict[str, _StepFields]] = None,
+) -> _ParseRequestResponse:
+    """
+    Fetches the steps of a request whose body is empty from QStash. Called
+    after the request is verified, since QStash is called with the token of
+    the client.
+
+    :param qstash_client: QStash client to fetch the steps with
+    :param workflow_run_id: id of the workflow run
+    :param message_id: id of the message which triggered the request
+    :param json_codec: codec to decode the messages and the steps with
+    :param known_steps: steps decoded by earlier requests, keyed by message id
+    :return: the parsed request
+    """
+    if qstash_client is None:
+        raise WorkflowError("Only first call can have an empty body")
+
+    messages = await _get_steps(qstash_client, workflow_run_id, message_id, json_codec)
+    if messages is None:
+        return _ParseRequestResponse(
+            raw_initial_payload="", steps=[], workflow_run_ended=True
+        )
+    raw_initial_payload, steps = _parse_messages(messages, json_codec, known_steps)
+    return _ParseRequestResponse(raw_initial_payload=raw_initial_payload, steps=steps)
+
+
+async def _get_steps(
+    qstash_client: AsyncQStash,
+    workflow_run_id: str,
+    message_id: Optional[str],
+    json_codec: JsonCodec,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Fetches the messages of a workflow run from QStash. See the sync version
+    for details.
+
+    :param qstash_client: QStash client
+    :param workflow_run_id: id of the workflow run
+    :param message_id: id of the message which triggered the request
+    :param json_codec: codec to decode the response with
+    :return: messages of the run or None if the run has already ended
+    """
+    try:
+        response = await qstash_client.http.request(
+            path=f"/v2/workflows/runs/{workflow_run_id}",
+            method="GET",
+            parse_response=False,
+        )
+    except QStashError as error:
+        if _is_not_found_error(error):
+            return None
+        raise error
+
+    return _filter_messages(json_codec.loads(response), message_id)
+
+
 TInitialPayload = TypeVar("TInitialPayload")
 TRequest = TypeVar("TRequest", bound=_AsyncRequest)
 
 
 async def _handle_failure(
     request: TRequest,
-    request_payload: str,
+    request_payload: Union[str, bytes],
     qstash_client: AsyncQStash,
     initial_payload_parser: Callable[[str], Any],
     route_function: Callable[[AsyncWorkflowContext[TInitialPayload]], Awaitable[None]],
@@ -44,6 +182,8 @@ async def _handle_failure(
     ],
     env: Dict[str, Any],
     retries: int,
+    json_codec: JsonCodec,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> Literal["not-failure-callback", "is-failure-callback"]:
     if request.headers and request.headers.get(WORKFLOW_FAILURE_HEADER) != "true":
         return "not-failure-callback"
@@ -56,7 +196,7 @@ async def _handle_failure(
         )
 
     try:
-        payload = json.loads(request_payload)
+        payload = json_codec.loads(request_payload)
         status = payload["status"]
         header = payload["header"]
         body = payload["body"]
@@ -64,8 +204,8 @@ async def _handle_failure(
         source_body = payload["sourceBody"]
         workflow_run_id = payload["workflowRunId"]
 
-        decoded_body = _decode_base64(body) if body else "{}"
-        error_payload = json.loads(decoded_body)
+        decoded_body = _decode_base64_bytes(body) if body else b"{}"
+        error_payload = json_codec.loads(decoded_body)
 
         # Create context
         workflow_context = AsyncWorkflowContext(
@@ -74,12 +214,13 @@ async def _handle_failure(
             initial_payload=initial_payload_parser(_decode_base64(source_body))
             if source_body
             else None,
-            headers=_recreate_user_headers(request.headers or {}),
+            headers=_recreate_user_headers(request.headers or {}, header_filter),
             steps=[],
             url=url,
             failure_url=url,
             env=env,
             retries=retries,
+            json_codec=json_codec,
         )
 
         # Attempt running route_function until the first step
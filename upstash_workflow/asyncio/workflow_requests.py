@@ -4,6 +4,7 @@ import base64
 import logging
 from typing import (
     TYPE_CHECKING,
+    Any,
     Callable,
     Awaitable,
     Literal,
@@ -13,10 +14,12 @@ from typing import (
 )
 from qstash import AsyncQStash
 from upstash_workflow.error import WorkflowError, WorkflowAbort
+from upstash_workflow.codec import JsonCodec
 from upstash_workflow.constants import (
+    OUTPUT_ENCODING_JSON,
     WORKFLOW_ID_HEADER,
 )
-from upstash_workflow.types import StepTypes
+from upstash_workflow.types import StepTypes, HeaderFilter
 from upstash_workflow.workflow_types import _AsyncRequest
 from upstash_workflow.workflow_requests import _get_headers, _recreate_user_headers
 
@@ -48,6 +51,40 @@ async def _trigger_first_invocation(
     )
 
 
+async def _trigger_continue_as_new(
+    workflow_context: AsyncWorkflowContext[TInitialPayload],
+    workflow_run_id: str,
+    payload: Any,
+) -> None:
+    """
+    Starts a new run of the workflow with the payload, the same way the first
+    invocation of a run is triggered.
+
+    The message is deduplicated by the id of the current run, so that a retry
+    of the request which continued the run doesn't start a second new run.
+
+    :param workflow_context: context of the run which continues as new
+    :param workflow_run_id: id of the new run
+    :param payload: initial payload of the new run
+    """
+    headers = _get_headers(
+        "true",
+        workflow_run_id,
+        workflow_context.url,
+        workflow_context.headers,
+        None,
+        workflow_context.retries,
+        workflow_failure_url=workflow_context.failure_url,
+    ).headers
+
+    await workflow_context.qstash_client.message.publish_json(
+        url=workflow_context.url,
+        body=payload,
+        headers=headers,
+        deduplication_id=f"{workflow_context.workflow_run_id}-continue-as-new",
+    )
+
+
 async def _trigger_route_function(
     on_step: Callable[[], Awaitable[None]], on_cleanup: Callable[[], Awaitable[None]]
 ) -> None:
@@ -59,6 +96,8 @@ async def _trigger_route_function(
         await on_cleanup()
     except Exception as error:
         if isinstance(error, WorkflowAbort):
+            if error.finish_workflow:
+                await on_cleanup()
             return
         raise error
 
@@ -81,6 +120,8 @@ async def _handle_third_party_call_result(
     workflow_url: str,
     workflow_failure_url: Optional[str],
     retries: int,
+    json_codec: JsonCodec,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> Literal["call-will-retry", "is-call-return", "continue-workflow"]:
     """
     Check if the request is from a third party call result. If so,
@@ -102,6 +143,8 @@ async def _handle_third_party_call_result(
     :param client: QStash client
     :param workflow_url: Workflow URL
     :param retries: Number of retries
+    :param json_codec: codec to decode the callback and encode the call result with
+    :param header_filter: filter selecting the user headers forwarded with the result
     :return: "call-will-retry", "is-call-return" or "continue-workflow"
     """
     try:
@@ -111,7 +154,7 @@ async def _handle_third_party_call_result(
             else:
                 raise NotImplementedError
 
-            callback_message = json.loads(callback_payload)
+            callback_message = json_codec.loads(callback_payload)
 
             if (
                 not (200 <= callback_message["status"] < 300)
@@ -166,7 +209,7 @@ async def _handle_third_party_call_result(
             concurrent_str = cast(str, concurrent_str)
             content_type = cast(str, content_type)
 
-            user_headers = _recreate_user_headers(headers)
+            user_headers = _recreate_user_headers(headers, header_filter)
             request_headers = _get_headers(
                 "false",
                 workflow_run_id,
@@ -187,7 +230,8 @@ async def _handle_third_party_call_result(
                 "stepId": int(step_id_str),
                 "stepName": step_name,
                 "stepType": step_type,
-                "out": json.dumps(call_response),
+                "out": json_codec.dumps(call_response),
+                "outEncoding": OUTPUT_ENCODING_JSON,
                 "concurrent": int(concurrent_str),
             }
 
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Sequence
+from upstash_workflow.history import _StepHistory, _StepFields
+from upstash_workflow.types import DefaultStep
+
+
+@dataclass
+class _CachedRun:
+    raw_initial_payload: str
+    initial_payload: Any
+    steps: Dict[str, _StepFields]
+    expires_at: float
+
+
+class HistoryCache:
+    """
+    In-process cache of the decoded history of workflow runs.
+
+    Every request of a run carries the whole history of the run. With the
+    cache, the steps decoded while handling a request and the initial payload
+    parsed by `initial_payload_parser` are kept per workflow run id. The next
+    request of the run only decodes the steps it hasn't seen before, and
+    reuses the initial payload if the raw initial payload didn't change.
+
+    Cached values are shared between the requests of a run. The route function
+    must not modify step results or the initial payload in place.
+
+    Runs are evicted when the cache is full, in least recently used order, and
+    when they are not used for `ttl` seconds. The entry of a run is removed when
+    the run finishes. The cache can be shared between threads.
+
+    :param max_size: maximum number of runs to keep
+    :param ttl: seconds after which an unused run is evicted
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._runs: "OrderedDict[str, _CachedRun]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def _get(self, workflow_run_id: str) -> Optional[_CachedRun]:
+        with self._lock:
+            cached_run = self._runs.get(workflow_run_id)
+            if cached_run is not None and cached_run.expires_at <= time.monotonic():
+                del self._runs[workflow_run_id]
+                self.evictions += 1
+                cached_run = None
+
+            if cached_run is None:
+                self.misses += 1
+                return None
+
+            self._runs.move_to_end(workflow_run_id)
+            self.hits += 1
+            return cached_run
+
+    def _put(
+        self,
+        workflow_run_id: str,
+        raw_initial_payload: str,
+        initial_payload: Any,
+        steps: Sequence[DefaultStep],
+    ) -> None:
+        """
+        Stores the initial payload and the decoded steps of a request.
+        Steps are merged with the steps already cached for the run.
+        """
+        decoded_steps = (
+            steps._decoded_steps() if isinstance(steps, _StepHistory) else {}
+        )
+
+        with self._lock:
+            cached_run = self._runs.pop(workflow_run_id, None)
+            if (
+                cached_run is None
+                or cached_run.raw_initial_payload != raw_initial_payload
+            ):
+                cached_run = _CachedRun(
+                    raw_initial_payload=raw_initial_payload,
+                    initial_payload=initial_payload,
+                    steps={},
+                    expires_at=0,
+                )
+
+            cached_run.steps.update(decoded_steps)
+            cached_run.expires_at = time.monotonic() + self.ttl
+            self._runs[workflow_run_id] = cached_run
+
+            while len(self._runs) > self.max_size:
+                self._runs.popitem(last=False)
+                self.evictions += 1
+
+    def _remove(self, workflow_run_id: str) -> None:
+        with self._lock:
+            self._runs.pop(workflow_run_id, None)
+
+    def _get_initial_payload(
+        self,
+        cached_run: Optional[_CachedRun],
+        raw_initial_payload: str,
+        initial_payload_parser: Callable[[str], Any],
+    ) -> Any:
+        """
+        Returns the cached initial payload if the raw initial payload didn't
+        change, otherwise parses it.
+        """
+        if cached_run is not None and (
+            cached_run.raw_initial_payload == raw_initial_payload
+        ):
+            return cached_run.initial_payload
+        return initial_payload_parser(raw_initial_payload)
@@ -0,0 +1,92 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Tuple, Type, Union
+
+
+class JsonCodec(ABC):
+    """
+    Encodes and decodes the JSON documents exchanged with QStash: step
+    histories, step outputs, failure and call payloads and responses.
+
+    `loads` must raise `json.JSONDecodeError` when the data is not valid JSON.
+    """
+
+    @abstractmethod
+    def dumps(self, value: Any) -> str:
+        pass
+
+    @abstractmethod
+    def loads(self, data: Union[str, bytes]) -> Any:
+        pass
+
+
+class StdlibJsonCodec(JsonCodec):
+    """
+    JSON codec using the `json` module of the standard library. Used by default.
+    """
+
+    def dumps(self, value: Any) -> str:
+        return json.dumps(value)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    JSON codec using `orjson`. Requires the `orjson` package to be installed.
+    """
+
+    def __init__(self) -> None:
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError(
+                "orjson is not installed. Install it with `pip install orjson` to use OrjsonCodec."
+            )
+
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def __reduce__(self) -> Tuple[Type["OrjsonCodec"], Tuple[()]]:
+        # the module isn't picklable, the codec is recreated when unpickled
+        return (OrjsonCodec, ())
+
+    def dumps(self, value: Any) -> str:
+        return self._orjson.dumps(value, option=self._options).decode()
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return self._orjson.loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    """
+    JSON codec using `msgspec`. Requires the `msgspec` package to be installed.
+    """
+
+    def __init__(self) -> None:
+        try:
+            import msgspec
+        except ImportError:
+            raise ImportError(
+                "msgspec is not installed. Install it with `pip install msgspec` to use MsgspecCodec."
+            )
+
+        self._decode_error = msgspec.DecodeError
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def __reduce__(self) -> Tuple[Type["MsgspecCodec"], Tuple[()]]:
+        return (MsgspecCodec, ())
+
+    def dumps(self, value: Any) -> str:
+        return self._encoder.encode(value).decode()
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except self._decode_error as error:
+            raise json.JSONDecodeError(
+                str(error), data if isinstance(data, str) else "", 0
+            )
@@ -0,0 +1,176 @@
+import base64
+import lzma
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional, Tuple
+from upstash_workflow.error import WorkflowError
+
+_Compressor = Tuple[Callable[[bytes, Optional[int]], bytes], Callable[[bytes], bytes]]
+
+
+def _zlib_compress(data: bytes, level: Optional[int]) -> bytes:
+    return zlib.compress(data, -1 if level is None else level)
+
+
+def _lzma_compress(data: bytes, level: Optional[int]) -> bytes:
+    return lzma.compress(data, preset=level)
+
+
+def _get_zstd() -> _Compressor:
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstandard is not installed. Install it with `pip install zstandard` to use zstd compression."
+        )
+
+    def compress(data: bytes, level: Optional[int]) -> bytes:
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(
+            data
+        )
+
+    def decompress(data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return compress, decompress
+
+
+_COMPRESSORS: Dict[str, Callable[[], _Compressor]] = {
+    "zlib": lambda: (_zlib_compress, zlib.decompress),
+    "lzma": lambda: (_lzma_compress, lzma.decompress),
+    "zstd": _get_zstd,
+}
+
+_compressors: Dict[str, _Compressor] = {}
+
+
+def _get_compressor(algorithm: str) -> _Compressor:
+    compressor = _compressors.get(algorithm)
+    if compressor is None:
+        create_compressor = _COMPRESSORS.get(algorithm)
+        if create_compressor is None:
+            raise WorkflowError(f"Unsupported output compression '{algorithm}'")
+        compressor = _compressors.setdefault(algorithm, create_compressor())
+    return compressor
+
+
+@dataclass
+class StepCompressionStats:
+    """
+    Compression of the output of a single step.
+    """
+
+    step_name: str
+    original_bytes: int
+    compressed_bytes: int
+    seconds: float
+
+    @property
+    def ratio(self) -> float:
+        return self.original_bytes / self.compressed_bytes
+
+
+@dataclass
+class OutputCompressionStats:
+    """
+    Counters of the outputs compressed by an `OutputCompression`.
+
+    `original_bytes` and `compressed_bytes` are the sizes of the compressed
+    outputs before and after compression, as published in the step. Outputs
+    which didn't get smaller are published uncompressed and counted in
+    `skipped_outputs`. `recent` keeps the stats of the last compressed steps.
+    """
+
+    compressed_outputs: int = 0
+    skipped_outputs: int = 0
+    original_bytes: int = 0
+    compressed_bytes: int = 0
+    seconds: float = 0.0
+    recent: Deque[StepCompressionStats] = field(
+        default_factory=lambda: deque(maxlen=100)
+    )
+
+    @property
+    def ratio(self) -> float:
+        return (
+            self.original_bytes / self.compressed_bytes
+            if self.compressed_bytes
+            else 1.0
+        )
+
+
+class OutputCompression:
+    """
+    Compresses step outputs larger than a threshold before they are published.
+
+    Every output is sent to the workflow endpoint again with every later step
+    of the run, so a large output is transferred and decoded many times.
+    Outputs whose serialized size is at least `threshold` bytes are compressed
+    and published base64 encoded, with the algorithm as `outCompression`.
+    Outputs are decompressed when they are read on replay, whatever the
+    options of the endpoint reading them are.
+
+    :param threshold: serialized output size in bytes from which outputs are compressed. 64 KiB by default.
+    :param algorithm: "zlib" (default), "lzma" or "zstd". zstd requires the `zstandard` package.
+    :param level: compression level of the algorithm. Its default level is used if not passed.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 64 * 1024,
+        algorithm: str = "zlib",
+        level: Optional[int] = None,
+    ):
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self.level = level
+        self.stats = OutputCompressionStats()
+        self._compress = _get_compressor(algorithm)[0]
+        self._lock = threading.Lock()
+
+    def _compress_output(self, step_name: str, out: str) -> Tuple[str, Optional[str]]:
+        """
+        Compresses the serialized output if it's large enough.
+
+        :param step_name: name of the step, for the stats
+        :param out: serialized output
+        :return: output to publish and the compression algorithm, or None if
+            the output is not compressed
+        """
+        if len(out) < self.threshold:
+            return out, None
+
+        data = out.encode()
+        start = time.perf_counter()
+        compressed = base64.b64encode(self._compress(data, self.level)).decode()
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            if len(compressed) >= len(out):
+                self.stats.skipped_outputs += 1
+                return out, None
+
+            self.stats.compressed_outputs += 1
+            self.stats.original_bytes += len(out)
+            self.stats.compressed_bytes += len(compressed)
+            self.stats.seconds += elapsed
+            self.stats.recent.append(
+                StepCompressionStats(
+                    step_name=step_name,
+                    original_bytes=len(out),
+                    compressed_bytes=len(compressed),
+                    seconds=elapsed,
+                )
+            )
+
+        return compressed, self.algorithm
+
+
+def _decompress_output(out: str, algorithm: str) -> str:
+    """
+    Decompresses an output published with `outCompression`.
+    """
+    return _get_compressor(algorithm)[1](base64.b64decode(out)).decode()
@@ -9,6 +9,8 @@ WORKFLOW_PROTOCOL_VERSION_HEADER = "Upstash-Workflow-Sdk-Version"
 
 DEFAULT_CONTENT_TYPE = "application/json"
 
+OUTPUT_ENCODING_JSON = "json"
+
 NO_CONCURRENCY = 1
 NOT_SET = "not-set"
 DEFAULT_RETRIES = 3
@@ -1,11 +1,30 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, List, Union, Literal, cast, Any, TypeVar
-import json
-from qstash.message import BatchJsonRequest
-from upstash_workflow.constants import NO_CONCURRENCY
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Optional,
+    Sequence,
+    Union,
+    Literal,
+    cast,
+    Any,
+    TypeVar,
+)
+from qstash.message import BatchRequest
+from upstash_workflow.constants import NO_CONCURRENCY, DEFAULT_CONTENT_TYPE
 from upstash_workflow.error import WorkflowError, WorkflowAbort
 from upstash_workflow.workflow_requests import _get_headers
 from upstash_workflow.types import DefaultStep, HTTPMethods
+from upstash_workflow.history import (
+    _StepHistory,
+    _OutputFormat,
+    _encode_step_body,
+    _decode_output,
+)
+from upstash_workflow.serializers import _SerializedOutput
 from upstash_workflow.context.steps import _BaseLazyStep, _LazyCallStep
 
 if TYPE_CHECKING:
@@ -15,24 +34,38 @@ TResult = TypeVar("TResult")
 
 
 class _AutoExecutor:
-    def __init__(self, context: WorkflowContext[Any], steps: List[DefaultStep]):
+    def __init__(self, context: WorkflowContext[Any], steps: Sequence[DefaultStep]):
         self.context: WorkflowContext[Any] = context
-        self.steps: List[DefaultStep] = steps
-        self.non_plan_step_count: int = len(
-            [
-                step
-                for step in steps
-                if not (hasattr(step, "target_step") and step.target_step)
-            ]
+        self.steps: _StepHistory = (
+            steps
+            if isinstance(steps, _StepHistory)
+            else _StepHistory._from_steps(steps, context._json_codec)
         )
         self.step_count: int = 0
-        self.plan_step_count: int = 0
         self.executing_step: Union[str, Literal[False]] = False
+        # steps executed ahead, whose results are not published yet
+        self._run_ahead_steps: List[DefaultStep] = []
+        self._run_ahead_lazy_steps: List[_BaseLazyStep[Any]] = []
+        self._run_ahead_outputs: List[_SerializedOutput] = []
+        self._run_ahead_started: float = 0.0
+        # start of the request, for the invocation deadline
+        self._started: float = time.monotonic()
 
     def add_step(self, step_info: _BaseLazyStep[TResult]) -> TResult:
         self.step_count += 1
         return cast(TResult, self.run_single(step_info))
 
+    def add_parallel_steps(
+        self, lazy_steps: List[_BaseLazyStep[Any]], max_workers: int
+    ) -> List[Any]:
+        if not lazy_steps:
+            return []
+
+        self.step_count += len(lazy_steps)
+        if len(lazy_steps) == 1:
+            return [self.run_single(lazy_steps[0])]
+        return self.run_parallel(lazy_steps, max_workers)
+
     def run_single(self, lazy_step: _BaseLazyStep[TResult]) -> Any:
         """
         Executes a step:
@@ -43,28 +76,291 @@ class _AutoExecutor:
         :param lazy_step: lazy step to execute
         :return: step result
         """
-        if self.step_count < self.non_plan_step_count:
-            step = self.steps[self.step_count + self.plan_step_count]
-            _validate_step(lazy_step, step)
-            return step.out
+        index = self.steps._find(self.step_count)
+        if index is not None:
+            _validate_step(
+                lazy_step, self.steps.step_name(index), self.steps.step_type(index)
+            )
+            return self.steps.step_out(index)
 
+        self._check_run_ahead_trigger(self.step_count)
+        self._check_deadline([lazy_step])
+
+        if not self._run_ahead_steps:
+            self._run_ahead_started = time.monotonic()
+        step_started = time.monotonic()
         result_step = lazy_step.get_result_step(NO_CONCURRENCY, self.step_count)
+        if (
+            self.context._invocation_deadline is not None
+            and lazy_step.step_type == "Run"
+        ):
+            self.context._invocation_deadline._record(
+                lazy_step.step_name, time.monotonic() - step_started
+            )
+        if self._should_run_ahead(lazy_step):
+            return self._add_run_ahead_step(result_step, lazy_step)
+
         self.submit_steps_to_qstash([result_step], [lazy_step])
         return result_step.out
 
+    def _should_run_ahead(self, lazy_step: _BaseLazyStep[Any]) -> bool:
+        """
+        Whether the request continues with the next step after executing the
+        step, instead of publishing the results.
+        """
+        policy = self.context._run_ahead
+        return (
+            policy is not None
+            and lazy_step.step_type == "Run"
+            and len(self._run_ahead_steps) + 1 < policy.max_steps
+            and time.monotonic() - self._run_ahead_started < policy.max_seconds
+        )
+
+    def _add_run_ahead_step(
+        self, result_step: DefaultStep, lazy_step: _BaseLazyStep[Any]
+    ) -> Any:
+        """
+        Keeps the result of a step executed ahead to be published with the
+        next steps.
+
+        :return: output of the step, as it's returned when it's replayed
+        """
+        json_codec = self.context._json_codec
+        serialized_output = self.context._serializers._serialize(
+            result_step.out, json_codec
+        )
+        self._run_ahead_steps.append(result_step)
+        self._run_ahead_lazy_steps.append(lazy_step)
+        self._run_ahead_outputs.append(serialized_output)
+        return _decode_output(
+            serialized_output.out,
+            _OutputFormat(serialized_output.encoding, serialized_output.out_type),
+            result_step.step_name,
+            json_codec,
+        )
+
+    def _check_deadline(self, lazy_steps: List[_BaseLazyStep[Any]]) -> None:
+        """
+        Publishes the results of the steps executed ahead and ends the request
+        if the steps are estimated to exceed the invocation deadline. The steps
+        are executed in the next request.
+        """
+        deadline = self.context._invocation_deadline
+        if (
+            deadline is not None
+            and self._run_ahead_steps
+            and deadline._should_defer(
+                [lazy_step.step_name for lazy_step in lazy_steps], self._started
+            )
+        ):
+            self.submit_steps_to_qstash([], [])
+
+    def _check_run_ahead_trigger(self, step_id: int) -> None:
+        """
+        Ends the request before a new step is executed if the history doesn't
+        hold every step published with the previous step yet:
+        - the previous step was executed ahead, and the step published after
+          it is not received yet
+        - a later step is received before the step. QStash can deliver the
+          steps published in a batch in any order.
+
+        Like the "last" state of parallel steps, the request whose history
+        holds every step of the batch continues with the next step.
+
+        :param step_id: id of the step to execute, or of the first of the
+            parallel steps
+        """
+        previous_index = self.steps._find(step_id - 1)
+        if (
+            previous_index is not None and self.steps.run_ahead(previous_index)
+        ) or self.steps._has_steps_after(self.step_count):
+            raise WorkflowAbort("run-ahead")
+
+    def submit_run_ahead_steps(self) -> None:
+        """
+        Publishes the results of the steps executed ahead, if there are any.
+        Called after the route function returns.
+        """
+        if self._run_ahead_steps:
+            self.submit_steps_to_qstash([], [])
+
+    def run_parallel(
+        self, parallel_steps: List[_BaseLazyStep[Any]], max_workers: int
+    ) -> List[Any]:
+        """
+        Executes steps in parallel:
+        - "first": none of the steps are executed yet. All of them are run on
+          a thread pool of at most `max_workers` threads and their results are
+          published in a single batch.
+        - "partial": the request is called for a plan step, published by
+          the async executor. The targeted step is executed and its result
+          is published.
+        - "discard": the request is called for the result of one of the
+          steps while others are not in the history yet. Nothing is executed.
+        - "last": the results of all steps are available and returned.
+
+        :param parallel_steps: lazy steps to execute
+        :param max_workers: maximum number of threads to run the steps on
+        :return: step results, in the order of the steps
+        """
+        initial_step_count = self.step_count - (len(parallel_steps) - 1)
+        parallel_call_state = self._get_parallel_call_state(
+            len(parallel_steps), initial_step_count
+        )
+
+        if parallel_call_state != "first":
+            planned_step_count = self._get_planned_step_count(
+                len(parallel_steps), initial_step_count
+            )
+            if planned_step_count != len(parallel_steps):
+                raise WorkflowError(
+                    f"Incompatible number of parallel steps when call state was '{parallel_call_state}'. "
+                    f"Expected {len(parallel_steps)}, got {planned_step_count} from the request."
+                )
+
+        if parallel_call_state == "first":
+            self._check_run_ahead_trigger(initial_step_count)
+            self._check_deadline(parallel_steps)
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(parallel_steps))
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        parallel_step.get_result_step,
+                        len(parallel_steps),
+                        initial_step_count + index,
+                    )
+                    for index, parallel_step in enumerate(parallel_steps)
+                ]
+                # waits for every step, and raises the error of the first
+                # failed step
+                result_steps = [future.result() for future in futures]
+            self.submit_steps_to_qstash(result_steps, parallel_steps)
+        elif parallel_call_state == "partial":
+            plan_index = len(self.steps) - 1
+            target_step = self.steps.target_step(plan_index)
+            parallel_step = parallel_steps[target_step - initial_step_count]
+            _validate_step(
+                parallel_step,
+                self.steps.step_name(plan_index),
+                self.steps.step_type(plan_index),
+            )
+            result_step = parallel_step.get_result_step(
+                len(parallel_steps), target_step
+            )
+            self.submit_steps_to_qstash([result_step], [parallel_step])
+        elif parallel_call_state == "discard":
+            raise WorkflowAbort("discarded parallel")
+
+        results = []
+        for index, parallel_step in enumerate(parallel_steps):
+            result_index = cast(int, self.steps._find(initial_step_count + index))
+            _validate_step(
+                parallel_step,
+                self.steps.step_name(result_index),
+                self.steps.step_type(result_index),
+            )
+            results.append(self.steps.step_out(result_index))
+        return results
+
+    def _get_parallel_call_state(
+        self, parallel_step_count: int, initial_step_count: int
+    ) -> Literal["first", "partial", "discard", "last"]:
+        """
+        Decides what the request does for the parallel steps, based on which of
+        their plan and result steps are in the history. See `run_parallel`.
+
+        :param parallel_step_count: number of parallel steps
+        :param initial_step_count: step id of the first parallel step
+        """
+        step_ids = range(initial_step_count, initial_step_count + parallel_step_count)
+        results = [self.steps._find(step_id) for step_id in step_ids]
+        if all(index is not None for index in results):
+            return "last"
+
+        if all(index is None for index in results) and all(
+            self.steps._find(0, step_id) is None for step_id in step_ids
+        ):
+            return "first"
+
+        last_index = len(self.steps) - 1
+        target_step = self.steps.target_step(last_index)
+        if (
+            self.steps.step_id(last_index) == 0
+            and target_step in step_ids
+            and results[target_step - initial_step_count] is None
+        ):
+            return "partial"
+
+        return "discard"
+
+    def _get_planned_step_count(
+        self, parallel_step_count: int, initial_step_count: int
+    ) -> Optional[int]:
+        """
+        Returns the number of parallel steps the steps in the history were
+        published for: the concurrency of their plan steps, or of their result
+        steps if they were executed without plan steps.
+        """
+        for step_id in range(
+            initial_step_count, initial_step_count + parallel_step_count
+        ):
+            index = self.steps._find(0, step_id)
+            if index is None:
+                index = self.steps._find(step_id)
+            if index is not None:
+                return self.steps.concurrent(index)
+        return None
+
+    def _should_continue_as_new(self) -> bool:
+        """
+        Whether the continue-as-new policy is exceeded at the current position
+        of the route function.
+
+        It's only True when the next step is a new step. While the history is
+        replayed, it's False at every point where the run was not continued
+        earlier, so the route function takes the same path on every request.
+        """
+        policy = self.context._continue_as_new_policy
+        if policy is None:
+            return False
+
+        next_step = self.step_count + 1
+        if (
+            self.steps._find(next_step) is not None
+            or self.steps._find(0, next_step) is not None
+        ):
+            return False
+
+        return policy._is_exceeded(self.step_count, self.steps.history_size)
+
     def submit_steps_to_qstash(
         self, steps: List[DefaultStep], lazy_steps: List[_BaseLazyStep[Any]]
     ) -> None:
         """
-        sends the steps to QStash as batch
+        sends the steps to QStash as batch, after the results of the steps
+        executed ahead
 
         :param steps: steps to send
         """
+        run_ahead_count = len(self._run_ahead_steps)
+        run_ahead_outputs = self._run_ahead_outputs
+        if run_ahead_count:
+            steps = self._run_ahead_steps + steps
+            lazy_steps = self._run_ahead_lazy_steps + lazy_steps
+            self._run_ahead_steps = []
+            self._run_ahead_lazy_steps = []
+            self._run_ahead_outputs = []
+
         if not steps:
             raise WorkflowError(
                 f"Unable to submit steps to QStash. Provided list is empty. Current step: {self.step_count}"
             )
 
+        # the first new step, or the last step executed ahead if there are none
+        abort_step = steps[min(run_ahead_count, len(steps) - 1)]
+
         batch_requests = []
         for index, single_step in enumerate(steps):
             lazy_step = lazy_steps[index]
@@ -84,67 +380,103 @@ class _AutoExecutor:
                 single_step.concurrent == NO_CONCURRENCY or single_step.step_id == 0
             )
 
-            single_step.out = json.dumps(single_step.out)
+            serialized_output = (
+                run_ahead_outputs[index]
+                if index < run_ahead_count
+                else self.context._serializers._serialize(
+                    single_step.out, self.context._json_codec
+                )
+            )
+            out, output_compression = (
+                (serialized_output.out, None)
+                if self.context._output_compression is None
+                else self.context._output_compression._compress_output(
+                    single_step.step_name, serialized_output.out
+                )
+            )
+            out, output_blob = (
+                (out, None)
+                if self.context._blob_offload is None
+                else self.context._blob_offload._offload_output(
+                    self.context.workflow_run_id, out
+                )
+            )
+            single_step.out = out
 
             batch_requests.append(
-                BatchJsonRequest(
+                BatchRequest(
                     headers=headers,
                     method=cast(HTTPMethods, single_step.call_method),
-                    body=single_step.call_body,
+                    body=self.context._json_codec.dumps(single_step.call_body),
+                    content_type=DEFAULT_CONTENT_TYPE,
                     url=single_step.call_url,
                 )
                 if single_step.call_url
                 else (
-                    BatchJsonRequest(
+                    BatchRequest(
                         headers=headers,
-                        body={
-                            "method": "POST",
-                            "stepId": single_step.step_id,
-                            "stepName": single_step.step_name,
-                            "stepType": single_step.step_type,
-                            "out": single_step.out,
-                            "sleepFor": single_step.sleep_for,
-                            "sleepUntil": single_step.sleep_until,
-                            "concurrent": single_step.concurrent,
-                            "targetStep": single_step.target_step,
-                            "callUrl": single_step.call_url,
-                            "callMethod": single_step.call_method,
-                            "callBody": single_step.call_body,
-                            "callHeaders": single_step.call_headers,
-                        },
+                        body=_encode_step_body(
+                            {
+                                "method": "POST",
+                                "stepId": single_step.step_id,
+                                "stepName": single_step.step_name,
+                                "stepType": single_step.step_type,
+                                "out": single_step.out,
+                                "outEncoding": serialized_output.encoding,
+                                "outType": serialized_output.out_type,
+                                "outCompression": output_compression,
+                                "outBlob": output_blob,
+                                "sleepFor": single_step.sleep_for,
+                                "sleepUntil": single_step.sleep_until,
+                                "concurrent": single_step.concurrent,
+                                "targetStep": single_step.target_step,
+                                "callUrl": single_step.call_url,
+                                "callMethod": single_step.call_method,
+                                "callBody": single_step.call_body,
+                                "callHeaders": single_step.call_headers,
+                                # requests triggered by the step end without
+                                # executing the next step, published with it
+                                "runAhead": True
+                                if index < min(run_ahead_count, len(steps) - 1)
+                                else None,
+                            },
+                            self.context._json_codec,
+                        ),
+                        content_type=DEFAULT_CONTENT_TYPE,
                         url=self.context.url,
-                        not_before=cast(  # TODO: Change not_before type in BatchJsonRequest
+                        not_before=cast(  # TODO: Change not_before type in BatchRequest
                             Any, single_step.sleep_until if will_wait else None
                         ),
                         delay=cast(Any, single_step.sleep_for if will_wait else None),
                     )
                 )
             )
-        self.context.qstash_client.message.batch_json(batch_requests)
-        raise WorkflowAbort(steps[0].step_name, steps[0])
+        self.context.qstash_client.message.batch(batch_requests)
+        raise WorkflowAbort(abort_step.step_name, abort_step)
 
 
 def _validate_step(
-    lazy_step: _BaseLazyStep[Any], step_from_request: DefaultStep
+    lazy_step: _BaseLazyStep[Any], step_name: str, step_type: str
 ) -> None:
     """
-    Given a BaseLazyStep which is created during execution and a Step parsed
-    from the incoming request; compare the step names and types to make sure
-    that they are the same.
+    Given a BaseLazyStep which is created during execution and the name and
+    the type of the step parsed from the incoming request; compare the step
+    names and types to make sure that they are the same.
 
     Raises `WorkflowError` if there is a difference.
 
     :param lazy_step: lazy step created during execution
-    :param step_from_request: step parsed from incoming request
+    :param step_name: name of the step parsed from incoming request
+    :param step_type: type of the step parsed from incoming request
     """
-    if lazy_step.step_name != step_from_request.step_name:
+    if lazy_step.step_name != step_name:
         raise WorkflowError(
             f"Incompatible step name. Expected '{lazy_step.step_name}', "
-            f"got '{step_from_request.step_name}' from the request"
+            f"got '{step_name}' from the request"
         )
 
-    if lazy_step.step_type != step_from_request.step_type:
+    if lazy_step.step_type != step_type:
         raise WorkflowError(
             f"Incompatible step type. Expected '{lazy_step.step_type}', "
-            f"got '{step_from_request.step_type}' from the request"
+            f"got '{step_type}' from the request"
         )
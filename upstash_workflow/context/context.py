@@ -1,7 +1,6 @@
-import json
 import datetime
 from typing import (
-    List,
+    Sequence,
     Dict,
     Union,
     Optional,
@@ -10,9 +9,20 @@ from typing import (
     Any,
     cast,
     Generic,
+    NoReturn,
+    List,
+    Tuple,
 )
 from qstash import QStash
 from upstash_workflow.constants import DEFAULT_RETRIES
+from upstash_workflow.error import WorkflowAbort
+from upstash_workflow.utils import _nanoid
+from upstash_workflow.codec import JsonCodec, StdlibJsonCodec
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
 from upstash_workflow.context.auto_executor import _AutoExecutor
 from upstash_workflow.context.steps import (
     _LazyFunctionStep,
@@ -26,7 +36,10 @@ from upstash_workflow.types import (
     HTTPMethods,
     CallResponse,
     CallResponseDict,
+    ContinueAsNewPolicy,
+    RunAheadPolicy,
 )
+from upstash_workflow.workflow_requests import _trigger_continue_as_new
 
 TInitialPayload = TypeVar("TInitialPayload")
 TResult = TypeVar("TResult")
@@ -44,28 +57,48 @@ class WorkflowContext(Generic[TInitialPayload]):
         qstash_client: QStash,
         workflow_run_id: str,
         headers: Dict[str, str],
-        steps: List[DefaultStep],
+        steps: Sequence[DefaultStep],
         url: str,
         failure_url: Optional[str],
         initial_payload: TInitialPayload,
         env: Optional[Dict[str, Optional[str]]] = None,
         retries: Optional[int] = None,
+        json_codec: Optional[JsonCodec] = None,
+        continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+        serializers: Optional[SerializerRegistry] = None,
+        output_compression: Optional[OutputCompression] = None,
+        blob_offload: Optional[BlobOffload] = None,
+        run_ahead: Optional[RunAheadPolicy] = None,
+        step_memoization: Optional[StepMemoization] = None,
+        invocation_deadline: Optional[InvocationDeadline] = None,
     ):
         self.qstash_client: QStash = qstash_client
         self.workflow_run_id: str = workflow_run_id
-        self._steps: List[DefaultStep] = steps
+        self._steps: Sequence[DefaultStep] = steps
         self.url: str = url
         self.failure_url = failure_url
         self.headers: Dict[str, str] = headers
         self.request_payload: TInitialPayload = initial_payload
         self.env: Dict[str, Optional[str]] = env or {}
         self.retries: int = DEFAULT_RETRIES if retries is None else retries
+        self._json_codec: JsonCodec = json_codec or StdlibJsonCodec()
+        self._serializers: SerializerRegistry = serializers or SerializerRegistry()
+        self._output_compression: Optional[OutputCompression] = output_compression
+        self._blob_offload: Optional[BlobOffload] = blob_offload
+        self._run_ahead: Optional[RunAheadPolicy] = run_ahead
+        self._step_memoization: Optional[StepMemoization] = step_memoization
+        self._invocation_deadline: Optional[InvocationDeadline] = invocation_deadline
+        self._continue_as_new_policy: Optional[ContinueAsNewPolicy] = (
+            continue_as_new_policy
+        )
         self._executor: _AutoExecutor = _AutoExecutor(self, self._steps)
 
     def run(
         self,
         step_name: str,
         step_function: Union[Callable[[], Any], Callable[[], Any]],
+        cache_key: Optional[str] = None,
+        cache_ttl: Optional[float] = None,
     ) -> Any:
         """
         Executes a workflow step
@@ -77,10 +110,56 @@ class WorkflowContext(Generic[TInitialPayload]):
 
         :param step_name: name of the step
         :param step_function: step function to be executed
+        :param cache_key: memoizes the output of the step with the key, which
+            identifies the inputs of the step function. Shared between runs.
+            Ignored if the `step_memoization` option isn't set.
+        :param cache_ttl: seconds after which the memoized output expires.
+            The ttl of `step_memoization` by default.
         :return: result of the step function
         """
+        if cache_key is not None and self._step_memoization is not None:
+            step_function = self._step_memoization._memoize(
+                step_name,
+                step_function,
+                cache_key,
+                cache_ttl,
+                self._serializers,
+                self._json_codec,
+            )
         return self._add_step(_LazyFunctionStep(step_name, step_function))
 
+    def run_parallel(
+        self,
+        steps: Sequence[Tuple[str, Callable[[], Any]]],
+        max_workers: int = 8,
+    ) -> List[Any]:
+        """
+        Executes workflow steps in parallel
+        ```python
+        user, orders = context.run_parallel(
+            [
+                ("fetch-user", lambda: fetch_user(user_id)),
+                ("fetch-orders", lambda: fetch_orders(user_id)),
+            ]
+        )
+        ```
+
+        The step functions are run together on a thread pool, and their
+        results are published to QStash in a single batch. The workflow
+        continues once the results of all steps are available.
+
+        :param steps: names and functions of the steps
+        :param max_workers: maximum number of threads to run the step functions on
+        :return: results of the step functions, in the order of the steps
+        """
+        return self._add_parallel_steps(
+            [
+                _LazyFunctionStep(step_name, step_function)
+                for step_name, step_function in steps
+            ],
+            max_workers,
+        )
+
     def sleep(self, step_name: str, duration: Union[int, str]) -> None:
         """
         Stops the execution for the duration provided.
@@ -164,15 +243,62 @@ class WorkflowContext(Generic[TInitialPayload]):
         try:
             return CallResponse(
                 status=result["status"],
-                body=json.loads(result["body"]),
+                body=self._json_codec.loads(result["body"]),
                 header=result["header"],
             )
         except Exception:
             return cast(CallResponse[Any], result)
 
+    @property
+    def should_continue_as_new(self) -> bool:
+        """
+        Whether the run has grown past the limits of the `continue_as_new_policy`
+        passed to serve. Always False if no policy is passed.
+
+        It's only True at the point where the next step would be a new step,
+        so checking it doesn't change the path of the route function while the
+        history is replayed.
+
+        ```python
+        if context.should_continue_as_new:
+            context.continue_as_new({"cursor": cursor})
+        ```
+        """
+        return self._executor._should_continue_as_new()
+
+    def continue_as_new(self, payload: Any) -> NoReturn:
+        """
+        Ends the current run and starts a new run of the workflow with the
+        payload as its initial payload. Steps after this call are not executed.
+
+        Since every request of a run replays the whole step history, workflows
+        which loop for a long time can continue as new to start over with an
+        empty history, carrying their state forward in the payload.
+
+        ```python
+        context.continue_as_new({"cursor": next_cursor})
+        ```
+
+        The new run has a new workflow run id and the same url, headers,
+        retries and failure url as the current run.
+
+        :param payload: initial payload of the new run
+        """
+        _trigger_continue_as_new(self, f"wfr_{_nanoid()}", payload)
+        raise WorkflowAbort("continue-as-new", finish_workflow=True)
+
     def _add_step(self, step: _BaseLazyStep[TResult]) -> TResult:
         """
         Adds steps to the executor. Needed so that it can be overwritten in
         DisabledWorkflowContext.
         """
         return self._executor.add_step(step)
+
+    def _add_parallel_steps(
+        self, steps: List[_BaseLazyStep[Any]], max_workers: int
+    ) -> List[Any]:
+        """
+        Adds steps to the executor to be executed in parallel. Needed so that it
+        can be overwritten in DisabledWorkflowContext.
+        """
+        return self._executor.add_parallel_steps(steps, max_workers)
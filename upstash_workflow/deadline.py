@@ -0,0 +1,89 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+
+@dataclass
+class InvocationDeadlineStats:
+    """
+    Counters of the requests ended early by an `InvocationDeadline`.
+
+    `deferred_steps` are the steps which were not started because they were
+    estimated to exceed the remaining time of the request.
+    """
+
+    deferred_steps: int = 0
+
+
+class InvocationDeadline:
+    """
+    Ends requests before the time limit of the platform running the workflow
+    endpoint, instead of starting a step which would be killed in the middle.
+
+    The duration of every `context.run` step is tracked with an exponentially
+    weighted moving average per step name. Steps which weren't executed in the
+    process yet are estimated by the average of all steps.
+
+    With `run_ahead`, a request executes steps until its budget is used. Before
+    each further step, the estimated duration of the step is compared with the
+    time left until `seconds` minus `margin` since the request started. If
+    the step wouldn't finish in time, the results of the steps executed so far
+    are published and the step is executed in the next request, with a whole
+    budget of its own. The first new step of a request is always executed,
+    since the next request would have the same time for it.
+
+    :param seconds: time limit of a request in seconds
+    :param margin: seconds reserved for receiving and parsing the request and
+        publishing the results. 1 second by default.
+    :param smoothing: weight of the latest duration in the moving averages,
+        between 0 and 1. 0.3 by default.
+    """
+
+    def __init__(self, seconds: float, margin: float = 1.0, smoothing: float = 0.3):
+        self.seconds = seconds
+        self.margin = margin
+        self.smoothing = smoothing
+        self.stats = InvocationDeadlineStats()
+        self._durations: Dict[str, float] = {}
+        self._average_duration: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _record(self, step_name: str, duration: float) -> None:
+        """
+        Adds the duration of an executed step to the moving averages.
+        """
+        with self._lock:
+            average = self._durations.get(step_name)
+            self._durations[step_name] = (
+                duration
+                if average is None
+                else average + self.smoothing * (duration - average)
+            )
+            self._average_duration = (
+                duration
+                if self._average_duration is None
+                else self._average_duration
+                + self.smoothing * (duration - self._average_duration)
+            )
+
+    def _estimate(self, step_name: str) -> float:
+        with self._lock:
+            duration = self._durations.get(step_name, self._average_duration)
+        return 0.0 if duration is None else duration
+
+    def _should_defer(self, step_names: Sequence[str], started: float) -> bool:
+        """
+        Whether the steps, executed together, are estimated to exceed the time
+        left in the request.
+
+        :param step_names: names of the steps to execute
+        :param started: `time.monotonic()` when the request started
+        """
+        remaining = self.seconds - self.margin - (time.monotonic() - started)
+        if max(self._estimate(step_name) for step_name in step_names) < remaining:
+            return False
+
+        with self._lock:
+            self.stats.deferred_steps += len(step_names)
+        return True
@@ -23,10 +23,13 @@ class WorkflowAbort(Exception):
         step_name: str,
         step_info: Optional[DefaultStep] = None,
         cancel_workflow: bool = False,
+        finish_workflow: bool = False,
     ) -> None:
         self.step_name: str = step_name
         self.step_info: Optional[DefaultStep] = step_info
         self.cancel_workflow: bool = cancel_workflow
+        # the run should be cleaned up as if the route function had returned
+        self.finish_workflow: bool = finish_workflow
 
         message = (
             "This is an Upstash Workflow error thrown after a step executes. It is expected to be raised."
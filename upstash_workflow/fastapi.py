@@ -1,11 +1,20 @@
 from inspect import iscoroutinefunction
-import json
 import os
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, Response
 from typing import Callable, Awaitable, cast, TypeVar, Optional, Dict, Any
 from qstash import AsyncQStash, Receiver
 from upstash_workflow import async_serve, AsyncWorkflowContext
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.types import ContinueAsNewPolicy, HeaderFilter, RunAheadPolicy
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
+from upstash_workflow.asyncio.offload import ParseOffload
+from upstash_workflow.asyncio.resume import WarmResumeCache
+from upstash_workflow.asyncio.pools import SyncStepOffload
 from upstash_workflow.workflow_types import _Response as WorkflowResponse
 
 TInitialPayload = TypeVar("TInitialPayload")
@@ -33,6 +42,19 @@ class Serve:
             Callable[[AsyncWorkflowContext, int, str, Dict[str, str]], Awaitable[Any]]
         ] = None,
         failure_url: Optional[str] = None,
+        json_codec: Optional[JsonCodec] = None,
+        history_cache: Optional[HistoryCache] = None,
+        continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+        serializers: Optional[SerializerRegistry] = None,
+        output_compression: Optional[OutputCompression] = None,
+        blob_offload: Optional[BlobOffload] = None,
+        run_ahead: Optional[RunAheadPolicy] = None,
+        step_memoization: Optional[StepMemoization] = None,
+        invocation_deadline: Optional[InvocationDeadline] = None,
+        header_filter: Optional[HeaderFilter] = None,
+        parse_offload: Optional[ParseOffload] = None,
+        warm_resume: Optional[WarmResumeCache] = None,
+        sync_step_offload: Optional[SyncStepOffload] = None,
     ) -> Callable[
         [AsyncRouteFunction[TInitialPayload]], AsyncRouteFunction[TInitialPayload]
     ]:
@@ -47,6 +69,19 @@ class Serve:
         :param env: Optionally, one can pass an env object mapping environment variables to their keys. Useful in cases like cloudflare with hono.
         :param retries: Number of retries to use in workflow requests, 3 by default
         :param url: Url of the endpoint where the workflow is set up. If not set, url will be inferred from the request.
+        :param json_codec: Codec used to encode and decode JSON in workflow requests. `StdlibJsonCodec` by default. `OrjsonCodec` and `MsgspecCodec` can be used for faster processing of large step histories.
+        :param history_cache: Keeps the decoded steps and the parsed initial payload of runs between requests, so that a request only decodes the steps added since the previous request of its run. See `HistoryCache`.
+        :param continue_as_new_policy: Limits of the step history after which `context.should_continue_as_new` is True, so that the route function can continue the run as new and keep the cost of replaying the history bounded. See `ContinueAsNewPolicy`.
+        :param serializers: Serializers used to publish the outputs of steps, which rebuild the outputs in their original types when steps are replayed. Dataclasses, pydantic models, bytes and NumPy arrays are supported by default. See `SerializerRegistry`.
+        :param output_compression: Compresses step outputs larger than its threshold before they are published, so that large outputs are smaller in every later request of the run. See `OutputCompression`.
+        :param blob_offload: Writes step outputs which are still larger than its threshold after compression to a blob store and publishes only a reference to them, so QStash messages stay small. See `BlobOffload`.
+        :param run_ahead: Executes consecutive `context.run` steps in the same request within its step and time budget, and publishes their results in a single batch instead of ending the request after every step. See `RunAheadPolicy`.
+        :param step_memoization: Shares the outputs of steps run with a `cache_key` between runs, so that a step whose output is stored is published without running its function. See `StepMemoization`.
+        :param invocation_deadline: Ends requests with `run_ahead` before a step which is estimated to exceed the time limit of the request, and executes the step in the next request instead. See `InvocationDeadline`.
+        :param header_filter: Selects the headers of the incoming request which are kept in `context.headers` and forwarded with every step, so that headers added by browsers and gateways are not published with every step. See `HeaderFilter`.
+        :param parse_offload: Moves the verification and parsing of requests larger than its threshold to an executor, so that large step histories don't block the event loop. See `ParseOffload`.
+        :param warm_resume: Keeps async route functions suspended in memory after a step is published, and resumes them when the result of the step arrives at the same process instead of replaying the history. See `WarmResumeCache`.
+        :param sync_step_offload: Runs synchronous step functions in a thread pool instead of on the event loop, so that blocking I/O in steps doesn't stall other requests. See `SyncStepOffload`.
         :return:
         """
 
@@ -80,15 +115,30 @@ class Serve:
                         url=url,
                         failure_function=failure_function,
                         failure_url=failure_url,
+                        json_codec=json_codec,
+                        history_cache=history_cache,
+                        continue_as_new_policy=continue_as_new_policy,
+                        serializers=serializers,
+                        output_compression=output_compression,
+                        blob_offload=blob_offload,
+                        run_ahead=run_ahead,
+                        step_memoization=step_memoization,
+                        invocation_deadline=invocation_deadline,
+                        header_filter=header_filter,
+                        parse_offload=parse_offload,
+                        warm_resume=warm_resume,
+                        sync_step_offload=sync_step_offload,
                     ).get("handler"),
                 )
 
-                async def _async_handler_wrapper(request: Request) -> JSONResponse:
+                async def _async_handler_wrapper(request: Request) -> Response:
                     workflow_response: WorkflowResponse = await async_handler(request)
-                    return JSONResponse(
-                        content=json.loads(workflow_response.body),
+                    # body is already JSON encoded, pass it as it is
+                    return Response(
+                        content=workflow_response.body,
                         status_code=workflow_response.status,
                         headers=workflow_response.headers,
+                        media_type="application/json",
                     )
 
                 self.app.add_api_route(path, _async_handler_wrapper, methods=["POST"])
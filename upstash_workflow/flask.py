@@ -5,6 +5,14 @@ from werkzeug.wrappers import Response
 from typing import Callable, cast, TypeVar, Optional, Dict, Any
 from qstash import QStash, Receiver
 from upstash_workflow import serve, WorkflowContext
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.types import ContinueAsNewPolicy, HeaderFilter, RunAheadPolicy
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
 from upstash_workflow.workflow_types import (
     _SyncRequest as WorkflowRequest,
     _Response as WorkflowResponse,
@@ -36,6 +44,16 @@ class Serve:
             Callable[[WorkflowContext, int, str, Dict[str, str]], Any]
         ] = None,
         failure_url: Optional[str] = None,
+        json_codec: Optional[JsonCodec] = None,
+        history_cache: Optional[HistoryCache] = None,
+        continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+        serializers: Optional[SerializerRegistry] = None,
+        output_compression: Optional[OutputCompression] = None,
+        blob_offload: Optional[BlobOffload] = None,
+        run_ahead: Optional[RunAheadPolicy] = None,
+        step_memoization: Optional[StepMemoization] = None,
+        invocation_deadline: Optional[InvocationDeadline] = None,
+        header_filter: Optional[HeaderFilter] = None,
     ) -> Callable[
         [RouteFunction[TInitialPayload]],
         RouteFunction[TInitialPayload],
@@ -51,6 +69,16 @@ class Serve:
         :param env: Optionally, one can pass an env object mapping environment variables to their keys. Useful in cases like cloudflare with hono.
         :param retries: Number of retries to use in workflow requests, 3 by default
         :param url: Url of the endpoint where the workflow is set up. If not set, url will be inferred from the request.
+        :param json_codec: Codec used to encode and decode JSON in workflow requests. `StdlibJsonCodec` by default. `OrjsonCodec` and `MsgspecCodec` can be used for faster processing of large step histories.
+        :param history_cache: Keeps the decoded steps and the parsed initial payload of runs between requests, so that a request only decodes the steps added since the previous request of its run. See `HistoryCache`.
+        :param continue_as_new_policy: Limits of the step history after which `context.should_continue_as_new` is True, so that the route function can continue the run as new and keep the cost of replaying the history bounded. See `ContinueAsNewPolicy`.
+        :param serializers: Serializers used to publish the outputs of steps, which rebuild the outputs in their original types when steps are replayed. Dataclasses, pydantic models, bytes and NumPy arrays are supported by default. See `SerializerRegistry`.
+        :param output_compression: Compresses step outputs larger than its threshold before they are published, so that large outputs are smaller in every later request of the run. See `OutputCompression`.
+        :param blob_offload: Writes step outputs which are still larger than its threshold after compression to a blob store and publishes only a reference to them, so QStash messages stay small. See `BlobOffload`.
+        :param run_ahead: Executes consecutive `context.run` steps in the same request within its step and time budget, and publishes their results in a single batch instead of ending the request after every step. See `RunAheadPolicy`.
+        :param step_memoization: Shares the outputs of steps run with a `cache_key` between runs, so that a step whose output is stored is published without running its function. See `StepMemoization`.
+        :param invocation_deadline: Ends requests with `run_ahead` before a step which is estimated to exceed the time limit of the request, and executes the step in the next request instead. See `InvocationDeadline`.
+        :param header_filter: Selects the headers of the incoming request which are kept in `context.headers` and forwarded with every step, so that headers added by browsers and gateways are not published with every step. See `HeaderFilter`.
         :return:
         """
 
@@ -89,13 +117,23 @@ class Serve:
                         url=url,
                         failure_function=failure_function,
                         failure_url=failure_url,
+                        json_codec=json_codec,
+                        history_cache=history_cache,
+                        continue_as_new_policy=continue_as_new_policy,
+                        serializers=serializers,
+                        output_compression=output_compression,
+                        blob_offload=blob_offload,
+                        run_ahead=run_ahead,
+                        step_memoization=step_memoization,
+                        invocation_deadline=invocation_deadline,
+                        header_filter=header_filter,
                     ).get("handler"),
                 )
 
                 def _sync_handler_wrapper() -> Response:
                     workflow_response: WorkflowResponse = sync_handler(
                         WorkflowRequest(
-                            body=request.data.decode("utf-8"),
+                            body=request.get_data(),
                             headers=cast(Dict[str, str], request.headers),
                             method=request.method,
                             url=request.url,
@@ -0,0 +1,628 @@
+import json
+import re
+from array import array
+from typing import (
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+    overload,
+)
+from upstash_workflow.utils import _decode_base64, _decode_base64_bytes
+from upstash_workflow.constants import NO_CONCURRENCY
+from upstash_workflow.error import WorkflowError
+from upstash_workflow.types import Step, DefaultStep
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.serializers import _get_serializer
+from upstash_workflow.compression import _decompress_output
+from upstash_workflow.stores import _read_output
+
+_NOT_DECODED = -1
+_OUTPUT_DECODED = -1
+_NO_STRING = -1
+# output encoding of steps published without an `outEncoding`
+_UNTAGGED = ""
+
+
+class _StepFields(NamedTuple):
+    """
+    Fields of a step which are read from the messages received from QStash.
+    """
+
+    step_id: int
+    step_name: str
+    step_type: str
+    out: Any
+    concurrent: int
+    target_step: int = 0
+    run_ahead: bool = False
+
+
+class _OutputFormat(NamedTuple):
+    """
+    How the output of a step which is not decoded yet is encoded.
+    """
+
+    encoding: str
+    type: Optional[str] = None
+    compression: Optional[str] = None
+    blob: Optional[str] = None
+
+
+class _StepHistory(Sequence[DefaultStep]):
+    """
+    Steps of a workflow run, decoded on demand and stored in columns.
+
+    The ids and the base64 encoded bodies of the messages received from
+    QStash are indexed once when the history is created. A step is base64 &
+    JSON decoded only when it's accessed for the first time, and its output
+    is decoded only when the output is read. Outputs offloaded to a blob
+    store are kept as references until then too. This way, a request doesn't
+    pay for decoding or fetching the outputs which it never reads.
+
+    Decoded steps are not kept as `Step` objects. Step ids, target steps,
+    concurrency and run-ahead flags are stored in arrays, step names, types
+    and output encodings are interned in a table and stored as indices into
+    it, and outputs are kept in a list. The body of a message is released
+    once it's decoded. The executors find steps with `_find` and read their
+    fields with accessors like `step_name`, `step_type` and `step_out`.
+    Indexing the history creates a `Step`.
+
+    Index 0 is always the initial step, which holds the initial payload.
+
+    Steps decoded by an earlier request of the run can be passed as
+    `known_steps`, keyed by the id of the message they were received in.
+    These are reused instead of being decoded again. Message ids are only
+    kept when `known_steps` is passed.
+    """
+
+    def __init__(
+        self,
+        raw_initial_payload: str,
+        raw_steps: List[Dict[str, Any]],
+        json_codec: JsonCodec,
+        known_steps: Optional[Dict[str, _StepFields]] = None,
+    ):
+        self._json_codec: JsonCodec = json_codec
+        self._known_steps = known_steps
+
+        self._message_ids: List[Optional[str]] = [None]
+        self._bodies: List[Optional[str]] = [None]
+
+        self._strings: List[str] = []
+        self._string_indices: Dict[str, int] = {}
+
+        self._step_ids = array("i", [0])
+        self._target_steps = array("i", [0])
+        self._concurrent = array("i", [NO_CONCURRENCY])
+        self._run_ahead = array("b", [0])
+        self._step_names = array("I", [self._intern("init")])
+        self._step_types = array("I", [self._intern("Initial")])
+        self._out_encodings = array("i", [_OUTPUT_DECODED])
+        self._out_types = array("i", [_NO_STRING])
+        self._out_compressions = array("i", [_NO_STRING])
+        self._out_blobs = array("i", [_NO_STRING])
+        self._outs: List[Any] = [raw_initial_payload]
+        self._size = len(raw_initial_payload)
+
+        # (step id, target step) -> index of the steps before `_indexed`
+        self._index: Dict[Tuple[int, int], int] = {}
+        self._indexed = 0
+        # largest step id of the steps before `_indexed`
+        self._max_step_id = 0
+
+        for raw_step in raw_steps:
+            self._append_raw_step(raw_step)
+
+    @classmethod
+    def _from_steps(
+        cls, steps: Sequence[DefaultStep], json_codec: JsonCodec
+    ) -> "_StepHistory":
+        """
+        Creates a history from steps which are already decoded.
+        """
+        history = cls("", [], json_codec)
+        for index, step in enumerate(steps):
+            fields = _StepFields(
+                step_id=step.step_id,
+                step_name=step.step_name,
+                step_type=step.step_type,
+                out=step.out,
+                concurrent=step.concurrent,
+                target_step=step.target_step or 0,
+            )
+            if index == 0:
+                history._set_fields(0, fields)
+            else:
+                history._set_fields(history._append_raw_step({"body": None}), fields)
+        return history
+
+    def _intern(self, value: str) -> int:
+        index = self._string_indices.get(value)
+        if index is None:
+            index = len(self._strings)
+            self._strings.append(value)
+            self._string_indices[value] = index
+        return index
+
+    def _intern_optional(self, value: Optional[str]) -> int:
+        return _NO_STRING if value is None else self._intern(value)
+
+    def _get_optional(self, index: int) -> Optional[str]:
+        return None if index == _NO_STRING else self._strings[index]
+
+    def _append_raw_step(self, raw_step: Dict[str, Any]) -> int:
+        """
+        Adds a step message to the end of the history without decoding it.
+
+        :param raw_step: step message with a base64 encoded body
+        :return: index of the added step
+        """
+        self._message_ids.append(
+            None if self._known_steps is None else raw_step.get("messageId")
+        )
+        body = raw_step["body"]
+        self._bodies.append(body)
+        if body:
+            self._size += len(body)
+        self._step_ids.append(_NOT_DECODED)
+        self._target_steps.append(0)
+        self._concurrent.append(0)
+        self._run_ahead.append(0)
+        self._step_names.append(0)
+        self._step_types.append(0)
+        self._out_encodings.append(_OUTPUT_DECODED)
+        self._out_types.append(_NO_STRING)
+        self._out_compressions.append(_NO_STRING)
+        self._out_blobs.append(_NO_STRING)
+        self._outs.append(None)
+        return len(self._outs) - 1
+
+    def _set_fields(
+        self,
+        index: int,
+        fields: _StepFields,
+        output_format: Optional[_OutputFormat] = None,
+    ) -> None:
+        """
+        :param output_format: format of the output if it's not decoded yet
+        """
+        self._step_ids[index] = fields.step_id
+        self._target_steps[index] = fields.target_step
+        self._concurrent[index] = fields.concurrent
+        self._run_ahead[index] = fields.run_ahead
+        self._step_names[index] = self._intern(fields.step_name)
+        self._step_types[index] = self._intern(fields.step_type)
+        if output_format is None:
+            self._out_encodings[index] = _OUTPUT_DECODED
+        else:
+            self._out_encodings[index] = self._intern(output_format.encoding)
+            self._out_types[index] = self._intern_optional(output_format.type)
+            self._out_compressions[index] = self._intern_optional(
+                output_format.compression
+            )
+            self._out_blobs[index] = self._intern_optional(output_format.blob)
+        self._outs[index] = fields.out
+        self._bodies[index] = None
+
+    def _decode_fields(self, index: int) -> int:
+        """
+        Decodes the step at the index if it's not decoded yet. The output of
+        the step is kept encoded.
+
+        :return: non-negative index of the step
+        """
+        if index < 0:
+            index += len(self._outs)
+
+        if self._step_ids[index] == _NOT_DECODED:
+            message_id = self._message_ids[index]
+            fields = (
+                self._known_steps.get(message_id)
+                if self._known_steps and message_id
+                else None
+            )
+            if fields is None:
+                self._set_fields(
+                    index,
+                    *_decode_step_fields(
+                        cast(str, self._bodies[index]), self._json_codec
+                    ),
+                )
+            else:
+                self._set_fields(index, fields)
+
+        return index
+
+    def _decode(self, index: int) -> int:
+        """
+        Decodes the step at the index and its output if they are not decoded yet.
+
+        :return: non-negative index of the step
+        """
+        index = self._decode_fields(index)
+
+        output_encoding = self._out_encodings[index]
+        if output_encoding != _OUTPUT_DECODED:
+            output_format = _OutputFormat(
+                encoding=self._strings[output_encoding],
+                type=self._get_optional(self._out_types[index]),
+                compression=self._get_optional(self._out_compressions[index]),
+                blob=self._get_optional(self._out_blobs[index]),
+            )
+            self._outs[index] = _decode_output(
+                self._outs[index],
+                output_format,
+                self._strings[self._step_names[index]],
+                self._json_codec,
+            )
+            self._out_encodings[index] = _OUTPUT_DECODED
+            self._out_types[index] = _NO_STRING
+            self._out_compressions[index] = _NO_STRING
+            self._out_blobs[index] = _NO_STRING
+
+        return index
+
+    def _find(self, step_id: int, target_step: int = 0) -> Optional[int]:
+        """
+        Finds a step by its id and target step, regardless of the order in
+        which the steps were received.
+
+        Result steps have a target step of 0. Plan steps of parallel steps
+        have a step id of 0 and the id of the step they plan as target step.
+
+        Steps are indexed in the order they were received, as far as a lookup
+        needs: only the fields of the steps up to the step found are decoded,
+        and indexed steps are found in constant time. Since steps are mostly
+        received in order, replaying a run decodes every step once and a
+        request reading an early step doesn't decode the rest of the history.
+        A step which is not in the history is only known to be missing once
+        every step is indexed. Outputs stay encoded until they are read. If a
+        step is received more than once, the first one is found.
+
+        :param step_id: id of the step
+        :param target_step: target step of the step
+        :return: index of the step or None if it's not in the history
+        """
+        key = (step_id, target_step)
+        found = self._index.get(key)
+        while found is None and self._indexed < len(self._outs):
+            self._index_next()
+            found = self._index.get(key)
+
+        return found
+
+    def _has_steps_after(self, step_id: int) -> bool:
+        """
+        Whether the history holds a step with a greater id than the step id.
+        Every step is indexed.
+        """
+        while self._indexed < len(self._outs):
+            self._index_next()
+        return self._max_step_id > step_id
+
+    def _index_next(self) -> None:
+        index = self._decode_fields(self._indexed)
+        self._indexed += 1
+        step_id = self._step_ids[index]
+        self._index.setdefault((step_id, self._target_steps[index]), index)
+        if step_id > self._max_step_id:
+            self._max_step_id = step_id
+
+    def step_name(self, index: int) -> str:
+        return self._strings[self._step_names[self._decode_fields(index)]]
+
+    def step_type(self, index: int) -> str:
+        return self._strings[self._step_types[self._decode_fields(index)]]
+
+    def step_id(self, index: int) -> int:
+        return self._step_ids[self._decode_fields(index)]
+
+    def target_step(self, index: int) -> int:
+        return self._target_steps[self._decode_fields(index)]
+
+    def concurrent(self, index: int) -> int:
+        return self._concurrent[self._decode_fields(index)]
+
+    def run_ahead(self, index: int) -> bool:
+        return bool(self._run_ahead[self._decode_fields(index)])
+
+    def step_out(self, index: int) -> Any:
+        return self._outs[self._decode(index)]
+
+    def _has_blob(self, index: int) -> bool:
+        """
+        Whether the output of the step is in a blob store and not read yet.
+        """
+        return self._out_blobs[self._decode_fields(index)] != _NO_STRING
+
+    @property
+    def history_size(self) -> int:
+        """
+        Size of the history in bytes as received from QStash: the length of the
+        initial payload and of the base64 encoded bodies of the steps.
+        """
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._outs)
+
+    @overload
+    def __getitem__(self, index: int) -> DefaultStep: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[DefaultStep]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[DefaultStep, List[DefaultStep]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if not -len(self._outs) <= index < len(self._outs):
+            raise IndexError("step history index out of range")
+
+        index = self._decode(index)
+        return Step(
+            step_id=self._step_ids[index],
+            step_name=self._strings[self._step_names[index]],
+            step_type=self._strings[self._step_types[index]],  # type: ignore[arg-type]
+            out=self._outs[index],
+            concurrent=self._concurrent[index],
+            target_step=self._target_steps[index] or None,
+        )
+
+    def _is_decoded(self, index: int) -> bool:
+        return (
+            self._step_ids[index] != _NOT_DECODED
+            and self._out_encodings[index] == _OUTPUT_DECODED
+        )
+
+    def _decoded_steps(self) -> Dict[str, _StepFields]:
+        """
+        Returns the steps decoded so far, keyed by their message ids.
+        """
+        return {
+            message_id: _StepFields(
+                step_id=self._step_ids[index],
+                step_name=self._strings[self._step_names[index]],
+                step_type=self._strings[self._step_types[index]],
+                out=self._outs[index],
+                concurrent=self._concurrent[index],
+                target_step=self._target_steps[index],
+                run_ahead=bool(self._run_ahead[index]),
+            )
+            for index, message_id in enumerate(self._message_ids)
+            if message_id is not None and self._is_decoded(index)
+        }
+
+
+def _decode_step_fields(
+    body: str, json_codec: JsonCodec
+) -> Tuple[_StepFields, Optional[_OutputFormat]]:
+    """
+    Decodes the body of a single step message received from QStash. The body
+    is a base64 encoded step in Upstash Workflow Step format, whose output is
+    encoded once more.
+
+    The output is not decoded, it's returned with its format so that it can
+    be decoded with `_decode_output` when it's read.
+
+    :param body: base64 encoded body of the step message
+    :param json_codec: codec to decode the step with
+    :return: fields of the decoded step and the format of the output, or None
+        if the output is already decoded
+    """
+    step = json_codec.loads(_decode_base64_bytes(body))
+
+    # plan steps don't have an output
+    out = step.get("out")
+    output_format = (
+        None
+        if out is None
+        else _OutputFormat(
+            encoding=step.get("outEncoding") or _UNTAGGED,
+            type=step.get("outType"),
+            compression=step.get("outCompression"),
+            blob=step.get("outBlob"),
+        )
+    )
+
+    if step.get("waitEventId", None):
+        if output_format is not None:
+            out = _decode_output(out, output_format, step["stepName"], json_codec)
+        out = {
+            "event_data": _decode_base64(out) if out else None,
+            "timeout": step.get("waitTimeout") or False,
+        }
+        output_format = None
+
+    fields = _StepFields(
+        step_id=step["stepId"],
+        step_name=step["stepName"],
+        step_type=step["stepType"],
+        out=out,
+        concurrent=step["concurrent"],
+        target_step=step.get("targetStep") or 0,
+        run_ahead=step.get("runAhead") or False,
+    )
+    return fields, output_format
+
+
+_OPTIONAL_STEP_FIELDS = ("outType", "outCompression", "outBlob", "runAhead")
+
+
+def _encode_step_body(step: Dict[str, Any], json_codec: JsonCodec) -> str:
+    """
+    Encodes the body of a step message published to QStash.
+
+    The serialized output is embedded as a JSON string, which is how every
+    version of the SDK reads `out`. Optional fields which are not set are
+    left out, so that steps don't grow with them.
+
+    :param step: fields of the step. `out` is the serialized output.
+    :param json_codec: codec to encode the step with
+    :return: JSON body of the step message
+    """
+    for field in _OPTIONAL_STEP_FIELDS:
+        if step.get(field) is None:
+            step.pop(field, None)
+    return json_codec.dumps(step)
+
+
+def _decode_output(
+    out: Any,
+    output_format: _OutputFormat,
+    step_name: str,
+    json_codec: JsonCodec,
+) -> Any:
+    """
+    Reads the output of a step from its blob store if it was offloaded and
+    decompresses it if it's compressed, then decodes it with the serializer
+    of its encoding.
+
+    :param out: output as it's received in the step
+    :param output_format: `outEncoding`, `outType`, `outCompression` and
+        `outBlob` of the step. The encoding is empty if it's not set.
+    :param step_name: name of the step, used in errors
+    :param json_codec: codec to decode JSON outputs with
+    :return: decoded output
+    """
+    if output_format.blob is not None:
+        out = _read_output(out, output_format.blob, step_name)
+    if output_format.compression is not None:
+        out = _decompress_output(out, output_format.compression)
+
+    output_encoding = output_format.encoding
+    if output_encoding == _UNTAGGED:
+        # steps published without an output encoding
+        try:
+            return json_codec.loads(out)
+        except json.JSONDecodeError:
+            return out
+
+    serializer = _get_serializer(output_encoding)
+    if serializer is None:
+        raise WorkflowError(
+            f"Unsupported output encoding '{output_encoding}' in step '{step_name}'"
+        )
+    return serializer.deserialize(out, output_format.type, json_codec)
+
+
+_OPENING_BRACKETS = (ord("["), ord("{"))
+_QUOTE = ord('"')
+_BACKSLASH = ord("\\")
+_STRUCTURAL_CHARACTER = re.compile(rb'[\[\]{}"]')
+
+
+class _MessageSplitter:
+    """
+    Splits the JSON array of messages in a request body into its messages
+    while the body is received in chunks.
+
+    Strings and brackets are located with `re` and `bytes.find`, so scanning
+    runs in C. Only the bytes of the message which isn't complete yet are
+    kept in the buffer. Each complete message is decoded with the JSON codec
+    as soon as its closing bracket is received.
+    """
+
+    def __init__(self, json_codec: JsonCodec):
+        self._json_codec = json_codec
+        self._buffer = bytearray()
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._message_start = -1
+        self._finished = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """
+        Consumes the next chunk of the body.
+
+        :param chunk: next chunk of the request body
+        :return: messages completed by the chunk
+        """
+        buffer = self._buffer
+        buffer += chunk
+        position = self._position
+        messages = []
+
+        while True:
+            if self._in_string:
+                string_end = _find_string_end(buffer, position)
+                if string_end < 0:
+                    position = len(buffer)
+                    break
+                self._in_string = False
+                position = string_end
+
+            match = _STRUCTURAL_CHARACTER.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+
+            character = buffer[match.start()]
+            position = match.end()
+            if character == _QUOTE:
+                self._in_string = True
+            elif character in _OPENING_BRACKETS:
+                self._depth += 1
+                if self._depth == 2:
+                    self._message_start = match.start()
+            else:
+                self._depth -= 1
+                if self._depth == 1:
+                    messages.append(
+                        self._json_codec.loads(
+                            bytes(buffer[self._message_start : position])
+                        )
+                    )
+                    self._message_start = -1
+                elif self._depth == 0:
+                    self._finished = True
+
+        consumed = self._message_start if self._message_start >= 0 else position
+        del buffer[:consumed]
+        self._position = position - consumed
+        if self._message_start >= 0:
+            self._message_start = 0
+
+        return messages
+
+    def close(self) -> None:
+        """
+        Checks that the whole array was received.
+
+        Raises `json.JSONDecodeError` if the body ended in the middle of the array.
+        """
+        if self._depth or self._in_string or not self._finished:
+            raise json.JSONDecodeError(
+                "Request body ended before the end of the step history", "", 0
+            )
+
+
+def _find_string_end(buffer: bytearray, start: int) -> int:
+    """
+    Finds the closing quote of a JSON string.
+
+    :param buffer: buffer containing the string
+    :param start: position after the opening quote or after the part of the string already scanned
+    :return: position after the closing quote or -1 if the string doesn't end in the buffer
+    """
+    while True:
+        quote = buffer.find(b'"', start)
+        if quote < 0:
+            return -1
+
+        backslashes = 0
+        while buffer[quote - backslashes - 1] == _BACKSLASH:
+            backslashes += 1
+
+        if backslashes % 2 == 0:
+            return quote + 1
+        start = quote + 1
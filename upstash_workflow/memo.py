@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from inspect import isawaitable
+from typing import Any, Awaitable, Callable, Optional, Tuple, Union
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.history import _OutputFormat, _decode_output
+from upstash_workflow.serializers import SerializerRegistry
+
+_logger = logging.getLogger(__name__)
+
+
+class StepCacheStore(ABC):
+    """
+    Stores the outputs of memoized steps, shared by the runs using the store.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """
+        :return: stored value or None if there is no value with the key
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float]) -> None:
+        """
+        :param ttl: seconds after which the value expires. It doesn't expire if None.
+        """
+
+
+class MemoryStepCacheStore(StepCacheStore):
+    """
+    Stores outputs in the memory of the process. Outputs are evicted when the
+    store is full, in least recently used order, and when they expire. The
+    store can be shared between threads.
+
+    :param max_size: maximum number of outputs to keep
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._values: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            stored = self._values.get(key)
+            if stored is None:
+                return None
+
+            value, expires_at = stored
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float]) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = (
+                value,
+                None if ttl is None else time.monotonic() + ttl,
+            )
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+
+class RedisStepCacheStore(StepCacheStore):
+    """
+    Stores outputs in Redis, or in any store speaking its protocol, so that
+    they are shared by every process of the workflow endpoint.
+
+    The client isn't created by the store, so any client with redis-py style
+    `set(key, value, px=...)` and `get(key)` methods can be passed, such as
+    `redis.Redis` or `upstash_redis.Redis`.
+
+    :param client: Redis client
+    :param prefix: prefix of the keys. "upstash-workflow:step:" by default.
+    """
+
+    def __init__(self, client: Any, prefix: str = "upstash-workflow:step:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: Optional[float]) -> None:
+        self.client.set(
+            self.prefix + key, value, px=None if ttl is None else int(ttl * 1000)
+        )
+
+
+@dataclass
+class StepMemoizationStats:
+    """
+    Counters of the memoized steps executed with a `StepMemoization`.
+
+    `hits` are the steps whose output was read from the store without running
+    the step function. `errors` are the reads and writes which failed. A
+    failed read runs the step function, a failed write only skips storing.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    errors: int = 0
+
+
+class StepMemoization:
+    """
+    Shares the outputs of deterministic steps between runs.
+
+    Steps run with a `cache_key`, like `context.run("embed", embed, cache_key=text)`,
+    are memoized by their name and a hash of the key. If the store has an
+    output for them, it's published as the result of the step without running
+    the step function, otherwise the output of the function is stored.
+
+    The key must identify every input of the step function. Outputs are
+    stored serialized, and a stored output is returned as it's returned when
+    the step is replayed.
+
+    With `async_serve`, the store is read and written in the default executor
+    of the event loop.
+
+    :param store: store to keep the outputs in
+    :param ttl: seconds after which stored outputs expire. They don't expire if not passed.
+        Can be overridden with `cache_ttl` of the step.
+    """
+
+    def __init__(self, store: StepCacheStore, ttl: Optional[float] = None):
+        self.store = store
+        self.ttl = ttl
+        self.stats = StepMemoizationStats()
+        self._lock = threading.Lock()
+
+    def _get_key(self, step_name: str, cache_key: str) -> str:
+        return f"{step_name}:{hashlib.sha256(cache_key.encode()).hexdigest()}"
+
+    def _read(
+        self, key: str, step_name: str, json_codec: JsonCodec
+    ) -> Tuple[bool, Any]:
+        """
+        Outputs which can't be read or decoded, like outputs of a type which
+        doesn't exist anymore, are counted as errors and as misses.
+
+        :return: whether the output is stored, and the output
+        """
+        output = None
+        try:
+            stored = self.store.get(key)
+            if stored is not None:
+                out, encoding, out_type = json_codec.loads(stored)
+                output = _decode_output(
+                    out, _OutputFormat(encoding, out_type), step_name, json_codec
+                )
+        except Exception as error:
+            _logger.warning(f"Failed to read the output of step '{step_name}': {error}")
+            with self._lock:
+                self.stats.errors += 1
+            stored = None
+
+        with self._lock:
+            if stored is None:
+                self.stats.misses += 1
+                return False, None
+            self.stats.hits += 1
+        return True, output
+
+    def _write(
+        self,
+        key: str,
+        step_name: str,
+        output: Any,
+        ttl: Optional[float],
+        serializers: SerializerRegistry,
+        json_codec: JsonCodec,
+    ) -> None:
+        serialized_output = serializers._serialize(output, json_codec)
+        try:
+            self.store.set(
+                key,
+                json_codec.dumps(list(serialized_output)),
+                self.ttl if ttl is None else ttl,
+            )
+        except Exception as error:
+            _logger.warning(
+                f"Failed to store the output of step '{step_name}': {error}"
+            )
+            with self._lock:
+                self.stats.errors += 1
+
+    def _memoize(
+        self,
+        step_name: str,
+        step_function: Callable[[], Any],
+        cache_key: str,
+        ttl: Optional[float],
+        serializers: SerializerRegistry,
+        json_codec: JsonCodec,
+    ) -> Callable[[], Any]:
+        """
+        Wraps a step function to return the stored output if there is one.
+        """
+        key = self._get_key(step_name, cache_key)
+
+        def memoized_step_function() -> Any:
+            is_stored, output = self._read(key, step_name, json_codec)
+            if is_stored:
+                return output
+
+            output = step_function()
+            self._write(key, step_name, output, ttl, serializers, json_codec)
+            return output
+
+        return memoized_step_function
+
+    def _memoize_async(
+        self,
+        step_name: str,
+        step_function: Union[Callable[[], Any], Callable[[], Awaitable[Any]]],
+        cache_key: str,
+        ttl: Optional[float],
+        serializers: SerializerRegistry,
+        json_codec: JsonCodec,
+    ) -> Callable[[], Awaitable[Any]]:
+        """
+        Wraps a step function of `async_serve` to return the stored output if
+        there is one.
+        """
+        key = self._get_key(step_name, cache_key)
+
+        async def memoized_step_function() -> Any:
+            loop = asyncio.get_running_loop()
+            is_stored, output = await loop.run_in_executor(
+                None, self._read, key, step_name, json_codec
+            )
+            if is_stored:
+                return output
+
+            output = step_function()
+            if isawaitable(output):
+                output = await output
+            await loop.run_in_executor(
+                None, self._write, key, step_name, output, ttl, serializers, json_codec
+            )
+            return output
+
+        return memoized_step_function
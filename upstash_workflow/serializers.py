@@ -0,0 +1,414 @@
+import base64
+import dataclasses
+from abc import ABC, abstractmethod
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    cast,
+    get_type_hints,
+)
+from upstash_workflow.constants import OUTPUT_ENCODING_JSON
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.error import WorkflowError
+
+
+class StepSerializer(ABC):
+    """
+    Serializes the outputs of steps into the `out` field of the steps
+    published to QStash, and deserializes them when the steps are replayed.
+
+    Each serializer has a unique `encoding`, which is published with the step
+    as `outEncoding`. Steps are deserialized with the serializer of their
+    encoding. `serialize` can also return a type, which is published as
+    `outType` and passed to `deserialize` to rebuild the output.
+    """
+
+    encoding: str
+
+    @abstractmethod
+    def matches(self, value: Any) -> bool:
+        """
+        Whether the serializer should serialize the value.
+        """
+
+    @abstractmethod
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        """
+        :return: serialized output and its type, if it's needed to deserialize it
+        """
+
+    @abstractmethod
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        pass
+
+
+class JsonSerializer(StepSerializer):
+    """
+    Serializes outputs as JSON using the JSON codec. Outputs which no other
+    serializer matches are serialized with it.
+    """
+
+    encoding = OUTPUT_ENCODING_JSON
+
+    def matches(self, value: Any) -> bool:
+        return True
+
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        return json_codec.dumps(value), None
+
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        return json_codec.loads(out)
+
+
+class MsgpackSerializer(StepSerializer):
+    """
+    Serializes outputs as base64 encoded MessagePack. Unlike with JSON, bytes
+    are kept as bytes. Tuples are deserialized as lists, like with JSON.
+    Requires the `msgpack` package to be installed.
+
+    Matches every value, so it should be the last serializer in a registry.
+    """
+
+    encoding = "msgpack"
+
+    def __init__(self) -> None:
+        try:
+            import msgpack  # type: ignore[import-untyped]
+        except ImportError:
+            raise ImportError(
+                "msgpack is not installed. Install it with `pip install msgpack` to use MsgpackSerializer."
+            )
+
+        self._msgpack = msgpack
+
+    def matches(self, value: Any) -> bool:
+        return True
+
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        return base64.b64encode(self._msgpack.packb(value)).decode(), None
+
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        return self._msgpack.unpackb(base64.b64decode(out), strict_map_key=False)
+
+
+class DataclassSerializer(StepSerializer):
+    """
+    Serializes dataclass instances as JSON objects and rebuilds them as
+    instances of the same class. Fields which are dataclasses themselves are
+    rebuilt as well. Fields with `init=False` are not passed to the class,
+    they are set by the class when it's rebuilt.
+
+    The class must be registered with the `types` of a `SerializerRegistry`.
+    """
+
+    encoding = "dataclass"
+
+    def matches(self, value: Any) -> bool:
+        return dataclasses.is_dataclass(value) and not isinstance(value, type)
+
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        return json_codec.dumps(dataclasses.asdict(value)), _get_type_name(type(value))
+
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        cls = _get_type(out_type)
+        if not dataclasses.is_dataclass(cls):
+            raise WorkflowError(f"Output type '{out_type}' is not a dataclass")
+        return _build_dataclass(cast(Type[Any], cls), json_codec.loads(out))
+
+
+class PydanticSerializer(StepSerializer):
+    """
+    Serializes pydantic models with `model_dump_json` and rebuilds them with
+    `model_validate_json` of the same class. Supports pydantic 2. pydantic
+    isn't imported, models are recognized by these methods.
+
+    The class must be registered with the `types` of a `SerializerRegistry`.
+    """
+
+    encoding = "pydantic"
+
+    def matches(self, value: Any) -> bool:
+        return hasattr(value, "model_dump_json") and hasattr(
+            type(value), "model_validate_json"
+        )
+
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        return value.model_dump_json(), _get_type_name(type(value))
+
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        cls = _get_type(out_type)
+        if not hasattr(cls, "model_validate_json"):
+            raise WorkflowError(f"Output type '{out_type}' is not a pydantic model")
+        return cls.model_validate_json(out)
+
+
+class BytesSerializer(StepSerializer):
+    """
+    Serializes `bytes`, `bytearray` and `memoryview` outputs as base64, which
+    is about a third larger than the bytes, where JSON can't encode them.
+    They are deserialized as `bytes`.
+    """
+
+    encoding = "bytes"
+
+    def matches(self, value: Any) -> bool:
+        return isinstance(value, (bytes, bytearray, memoryview))
+
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        return base64.b64encode(value).decode(), None
+
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        return base64.b64decode(out)
+
+
+class NumpySerializer(StepSerializer):
+    """
+    Serializes NumPy arrays as their raw data in base64, with their dtype and
+    shape as the output type. On replay, the array is created over the
+    decoded buffer without parsing its items.
+
+    Arrays of Python objects can't be serialized. numpy isn't imported to
+    serialize arrays, only to deserialize them.
+    """
+
+    encoding = "ndarray"
+
+    def matches(self, value: Any) -> bool:
+        value_type = type(value)
+        return value_type.__name__ == "ndarray" and value_type.__module__ == "numpy"
+
+    def serialize(self, value: Any, json_codec: JsonCodec) -> Tuple[str, Optional[str]]:
+        if value.dtype.hasobject:
+            raise WorkflowError(
+                f"Arrays of dtype '{value.dtype}' can't be serialized, use a numeric dtype"
+            )
+        # tobytes returns the data in C order, whatever the layout of the array
+        shape = ",".join(str(size) for size in value.shape)
+        return (
+            base64.b64encode(value.tobytes()).decode(),
+            f"{value.dtype.str}:{shape}",
+        )
+
+    def deserialize(
+        self, out: str, out_type: Optional[str], json_codec: JsonCodec
+    ) -> Any:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError(
+                "numpy is not installed. Install it with `pip install numpy` to replay array outputs."
+            )
+
+        if not out_type or ":" not in out_type:
+            raise WorkflowError(f"Invalid array type '{out_type}'")
+        dtype, shape = out_type.split(":", 1)
+        # a bytearray keeps the array writable without copying it again
+        return numpy.frombuffer(bytearray(base64.b64decode(out)), dtype=dtype).reshape(
+            tuple(int(size) for size in shape.split(",") if size)
+        )
+
+
+class _SerializedOutput(NamedTuple):
+    out: str
+    encoding: str
+    out_type: Optional[str]
+
+
+class SerializerRegistry:
+    """
+    Serializers used to publish the outputs of steps.
+
+    The serializers are tried in order and the first one which matches an
+    output serializes it. Outputs which no serializer matches are serialized
+    as JSON. On replay, outputs are deserialized by their encoding, into
+    their original types.
+
+    Serializers of the registry are also registered to deserialize their
+    encoding in the process. The built-in serializers are always available
+    for deserializing, so histories published with any of them can be
+    replayed. An encoding can only be registered to one serializer class,
+    `WorkflowError` is raised if it's registered to another one.
+
+    Dataclasses and pydantic models are rebuilt by the `outType` published
+    with the step, which is read from the request. Only the classes passed as
+    `types` are rebuilt, in any registry of the process, and outputs of other
+    classes are rejected when they are serialized.
+
+    :param serializers: serializers to try in order. `DataclassSerializer`,
+        `PydanticSerializer`, `BytesSerializer` and `NumpySerializer` by default.
+    :param types: dataclasses and pydantic models which are published as outputs
+    """
+
+    def __init__(
+        self,
+        serializers: Optional[Sequence[StepSerializer]] = None,
+        types: Sequence[Type[Any]] = (),
+    ):
+        self.serializers = (
+            [
+                DataclassSerializer(),
+                PydanticSerializer(),
+                BytesSerializer(),
+                NumpySerializer(),
+            ]
+            if serializers is None
+            else list(serializers)
+        )
+        for serializer in self.serializers:
+            _register_serializer(serializer)
+        for cls in types:
+            _register_type(cls)
+        self._json_serializer = JsonSerializer()
+
+    def _serialize(self, value: Any, json_codec: JsonCodec) -> _SerializedOutput:
+        serializer = next(
+            (
+                serializer
+                for serializer in self.serializers
+                if serializer.matches(value)
+            ),
+            self._json_serializer,
+        )
+        out, out_type = serializer.serialize(value, json_codec)
+        return _SerializedOutput(out, serializer.encoding, out_type)
+
+
+_BUILTIN_SERIALIZERS: Dict[str, Callable[[], StepSerializer]] = {
+    JsonSerializer.encoding: JsonSerializer,
+    MsgpackSerializer.encoding: MsgpackSerializer,
+    DataclassSerializer.encoding: DataclassSerializer,
+    PydanticSerializer.encoding: PydanticSerializer,
+    BytesSerializer.encoding: BytesSerializer,
+    NumpySerializer.encoding: NumpySerializer,
+}
+
+_serializers: Dict[str, StepSerializer] = {}
+
+
+def _get_serializer(encoding: str) -> Optional[StepSerializer]:
+    """
+    Returns the serializer which deserializes the encoding, creating it the
+    first time if it's a built-in serializer.
+    """
+    serializer = _serializers.get(encoding)
+    if serializer is None and encoding in _BUILTIN_SERIALIZERS:
+        serializer = _serializers.setdefault(encoding, _BUILTIN_SERIALIZERS[encoding]())
+    return serializer
+
+
+def _register_serializer(serializer: StepSerializer) -> None:
+    """
+    Registers a serializer to deserialize its encoding in the process.
+
+    Raises `WorkflowError` if the encoding is registered to a serializer of
+    another class, since outputs would be deserialized by the wrong one.
+    """
+    registered = _get_serializer(serializer.encoding)
+    if registered is None:
+        registered = _serializers.setdefault(serializer.encoding, serializer)
+    if type(registered) is not type(serializer):
+        raise WorkflowError(
+            f"Output encoding '{serializer.encoding}' of {type(serializer).__name__} "
+            f"is already registered to {type(registered).__name__}"
+        )
+
+
+_types: Dict[str, Type[Any]] = {}
+
+
+def _get_type_name(cls: Type[Any]) -> str:
+    """
+    Returns the name of a registered output type, which is published as
+    `outType`.
+
+    Raises `WorkflowError` if the type is not registered, since the output
+    couldn't be rebuilt when the step is replayed.
+    """
+    type_name = f"{cls.__module__}:{cls.__qualname__}"
+    if _types.get(type_name) is not cls:
+        raise WorkflowError(
+            f"Output type '{type_name}' is not registered. "
+            "Pass it to SerializerRegistry in `types`."
+        )
+    return type_name
+
+
+def _register_type(cls: Type[Any]) -> None:
+    """
+    Registers a class to rebuild outputs published with its name.
+
+    Raises `WorkflowError` if another class is registered with the name.
+    """
+    type_name = f"{cls.__module__}:{cls.__qualname__}"
+    if _types.setdefault(type_name, cls) is not cls:
+        raise WorkflowError(
+            f"Output type '{type_name}' is already registered to another class"
+        )
+
+
+def _get_type(type_name: Optional[str]) -> Type[Any]:
+    """
+    Returns the registered class of an `outType`. Types are never imported
+    by their name, since the name is read from the request.
+    """
+    cls = _types.get(type_name) if type_name else None
+    if cls is None:
+        raise WorkflowError(f"Output type '{type_name}' is not registered")
+    return cls
+
+
+class _DataclassFields(NamedTuple):
+    # names of the fields passed to `__init__`
+    init: FrozenSet[str]
+    # types of the fields passed to `__init__` which are dataclasses
+    nested: Dict[str, Any]
+
+
+_dataclass_fields: Dict[Type[Any], _DataclassFields] = {}
+
+
+def _get_dataclass_fields(cls: Type[Any]) -> _DataclassFields:
+    fields = _dataclass_fields.get(cls)
+    if fields is not None:
+        return fields
+
+    type_hints = get_type_hints(cls)
+    init_fields = [field for field in dataclasses.fields(cls) if field.init]
+    fields = _dataclass_fields[cls] = _DataclassFields(
+        init=frozenset(field.name for field in init_fields),
+        nested={
+            field.name: type_hints[field.name]
+            for field in init_fields
+            if field.name in type_hints
+            and dataclasses.is_dataclass(type_hints[field.name])
+        },
+    )
+    return fields
+
+
+def _build_dataclass(cls: Type[Any], data: Dict[str, Any]) -> Any:
+    fields = _get_dataclass_fields(cls)
+    init_data = {name: value for name, value in data.items() if name in fields.init}
+    for name, field_type in fields.nested.items():
+        if isinstance(init_data.get(name), dict):
+            init_data[name] = _build_dataclass(field_type, init_data[name])
+    return cls(**init_data)
@@ -1,4 +1,4 @@
-from typing import Callable, Literal, TypeVar, Generic
+from typing import Callable, List, Literal, TypeVar, Generic, Any, NoReturn
 from qstash import QStash
 from upstash_workflow import WorkflowContext
 from upstash_workflow.context.steps import _BaseLazyStep
@@ -44,6 +44,27 @@ class _DisabledWorkflowContext(
         """
         raise WorkflowAbort(self.__disabled_message)
 
+    def _add_parallel_steps(
+        self, _steps: List[_BaseLazyStep[Any]], _max_workers: int
+    ) -> List[Any]:
+        """
+        Overwrite the `WorkflowContext._add_parallel_steps` method to raise
+        `WorkflowAbort` like `_add_step`.
+
+        :param _steps:
+        :param _max_workers:
+        """
+        raise WorkflowAbort(self.__disabled_message)
+
+    def continue_as_new(self, _payload: Any) -> NoReturn:
+        """
+        Overwrite the `WorkflowContext.continue_as_new` method to raise `WorkflowAbort`
+        like a step, without starting a new run.
+
+        :param _payload:
+        """
+        raise WorkflowAbort(self.__disabled_message)
+
     def cancel(self) -> None:
         """
         overwrite cancel method to do nothing
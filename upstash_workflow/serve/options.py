@@ -15,6 +15,14 @@ from typing import (
     Tuple,
 )
 from qstash import QStash, Receiver
+from upstash_workflow.codec import JsonCodec, StdlibJsonCodec
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.types import ContinueAsNewPolicy, HeaderFilter, RunAheadPolicy
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
 from upstash_workflow.workflow_types import _Response, _SyncRequest, _AsyncRequest
 from upstash_workflow.constants import (
     DEFAULT_RETRIES,
@@ -46,6 +54,16 @@ class ServeOptions(Generic[TInitialPayload, TResponse]):
         Callable[[WorkflowContext[TInitialPayload], int, str, Dict[str, str]], Any]
     ]
     failure_url: Optional[str]
+    json_codec: JsonCodec
+    history_cache: Optional[HistoryCache]
+    continue_as_new_policy: Optional[ContinueAsNewPolicy]
+    serializers: Optional[SerializerRegistry]
+    output_compression: Optional[OutputCompression]
+    blob_offload: Optional[BlobOffload]
+    run_ahead: Optional[RunAheadPolicy]
+    step_memoization: Optional[StepMemoization]
+    invocation_deadline: Optional[InvocationDeadline]
+    header_filter: Optional[HeaderFilter]
 
 
 @dataclass
@@ -69,6 +87,16 @@ def _process_options(
         Callable[[WorkflowContext, int, str, Dict[str, str]], Any]
     ] = None,
     failure_url: Optional[str] = None,
+    json_codec: Optional[JsonCodec] = None,
+    history_cache: Optional[HistoryCache] = None,
+    continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+    serializers: Optional[SerializerRegistry] = None,
+    output_compression: Optional[OutputCompression] = None,
+    blob_offload: Optional[BlobOffload] = None,
+    run_ahead: Optional[RunAheadPolicy] = None,
+    step_memoization: Optional[StepMemoization] = None,
+    invocation_deadline: Optional[InvocationDeadline] = None,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> ServeBaseOptions[TInitialPayload, TResponse]:
     """
     Fills the options with default values if they are not provided.
@@ -76,14 +104,16 @@ def _process_options(
     Default values for:
     - qstash_client: QStash client created with QSTASH_TOKEN env var
     - on_step_finish: returns a Response with workflowRunId in the body (status: 200)
-    - initial_payload_parser: calls json.loads if initial request body exists.
+    - initial_payload_parser: decodes the initial request body as JSON if it exists.
     - receiver: a Receiver if the required env vars are set
     - base_url: env variable UPSTASH_WORKFLOW_URL
     - env: os.environ
     - retries: DEFAULT_RETRIES
     - url: None
+    - json_codec: StdlibJsonCodec
     """
     environment = env if env is not None else dict(os.environ)
+    json_codec = json_codec or StdlibJsonCodec()
 
     receiver_environment_variables_set = bool(
         environment.get("QSTASH_CURRENT_SIGNING_KEY")
@@ -106,6 +136,7 @@ def _process_options(
                     headers={
                         WORKFLOW_PROTOCOL_VERSION_HEADER: WORKFLOW_PROTOCOL_VERSION
                     },
+                    json_codec=json_codec,
                 ),
             )
 
@@ -115,6 +146,7 @@ def _process_options(
                 body={"workflowRunId": workflow_run_id},
                 status=200,
                 headers={WORKFLOW_PROTOCOL_VERSION_HEADER: WORKFLOW_PROTOCOL_VERSION},
+                json_codec=json_codec,
             ),
         )
 
@@ -125,7 +157,7 @@ def _process_options(
 
         # Try to parse the payload
         try:
-            return cast(TInitialPayload, json.loads(initial_request))
+            return cast(TInitialPayload, json_codec.loads(initial_request))
         except json.JSONDecodeError:
             # If parsing fails, return the raw string
             return cast(TInitialPayload, initial_request)
@@ -160,6 +192,16 @@ def _process_options(
         url=url,
         failure_url=failure_url,
         failure_function=failure_function,
+        json_codec=json_codec,
+        history_cache=history_cache,
+        continue_as_new_policy=continue_as_new_policy,
+        serializers=serializers,
+        output_compression=output_compression,
+        blob_offload=blob_offload,
+        run_ahead=run_ahead,
+        step_memoization=step_memoization,
+        invocation_deadline=invocation_deadline,
+        header_filter=header_filter,
     )
 
 
@@ -1,7 +1,14 @@
-import json
 import logging
 from typing import Optional, Callable, Dict, cast, TypeVar, Any
 from qstash import QStash, Receiver
+from upstash_workflow.codec import JsonCodec
+from upstash_workflow.cache import HistoryCache
+from upstash_workflow.types import ContinueAsNewPolicy, HeaderFilter, RunAheadPolicy
+from upstash_workflow.serializers import SerializerRegistry
+from upstash_workflow.compression import OutputCompression
+from upstash_workflow.stores import BlobOffload
+from upstash_workflow.memo import StepMemoization
+from upstash_workflow.deadline import InvocationDeadline
 from upstash_workflow.workflow_types import _Response, _SyncRequest
 from upstash_workflow.workflow_parser import (
     _get_payload,
@@ -45,6 +52,16 @@ def _serve_base(
         Callable[[WorkflowContext, int, str, Dict[str, str]], Any]
     ] = None,
     failure_url: Optional[str] = None,
+    json_codec: Optional[JsonCodec] = None,
+    history_cache: Optional[HistoryCache] = None,
+    continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+    serializers: Optional[SerializerRegistry] = None,
+    output_compression: Optional[OutputCompression] = None,
+    blob_offload: Optional[BlobOffload] = None,
+    run_ahead: Optional[RunAheadPolicy] = None,
+    step_memoization: Optional[StepMemoization] = None,
+    invocation_deadline: Optional[InvocationDeadline] = None,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> Dict[str, Callable[[TRequest], TResponse]]:
     processed_options = _process_options(
         qstash_client=qstash_client,
@@ -57,6 +74,16 @@ def _serve_base(
         url=url,
         failure_function=failure_function,
         failure_url=failure_url,
+        json_codec=json_codec,
+        history_cache=history_cache,
+        continue_as_new_policy=continue_as_new_policy,
+        serializers=serializers,
+        output_compression=output_compression,
+        blob_offload=blob_offload,
+        run_ahead=run_ahead,
+        step_memoization=step_memoization,
+        invocation_deadline=invocation_deadline,
+        header_filter=header_filter,
     )
     qstash_client = processed_options.qstash_client
     on_step_finish = processed_options.on_step_finish
@@ -68,6 +95,16 @@ def _serve_base(
     url = processed_options.url
     failure_url = processed_options.failure_url
     failure_function = processed_options.failure_function
+    json_codec = processed_options.json_codec
+    history_cache = processed_options.history_cache
+    continue_as_new_policy = processed_options.continue_as_new_policy
+    serializers = processed_options.serializers
+    output_compression = processed_options.output_compression
+    blob_offload = processed_options.blob_offload
+    run_ahead = processed_options.run_ahead
+    step_memoization = processed_options.step_memoization
+    invocation_deadline = processed_options.invocation_deadline
+    header_filter = processed_options.header_filter
 
     def _handler(request: TRequest) -> TResponse:
         """
@@ -87,7 +124,7 @@ def _serve_base(
             failure_url,
         )
 
-        request_payload = _get_payload(request) or ""
+        request_payload = _get_payload(request) or b""
         _verify_request(
             request_payload,
             None if not request.headers else request.headers.get("upstash-signature"),
@@ -98,7 +135,29 @@ def _serve_base(
         is_first_invocation = validate_request_response.is_first_invocation
         workflow_run_id = validate_request_response.workflow_run_id
 
-        parse_request_response = _parse_request(request_payload, is_first_invocation)
+        cached_run = (
+            history_cache._get(workflow_run_id)
+            if history_cache is not None and not is_first_invocation
+            else None
+        )
+        known_steps = (
+            None
+            if history_cache is None
+            else ({} if cached_run is None else cached_run.steps)
+        )
+
+        parse_request_response = _parse_request(
+            request_payload,
+            is_first_invocation,
+            json_codec,
+            known_steps,
+            qstash_client,
+            workflow_run_id,
+            None if not request.headers else request.headers.get("upstash-message-id"),
+        )
+
+        if parse_request_response.workflow_run_ended:
+            return on_step_finish(workflow_run_id, "workflow-already-ended")
 
         raw_initial_payload = parse_request_response.raw_initial_payload
         steps = parse_request_response.steps
@@ -112,23 +171,41 @@ def _serve_base(
             failure_function,
             env,
             retries,
+            json_codec,
+            header_filter,
         )
 
         if failure_check == "is-failure-callback":
             return on_step_finish(workflow_run_id, "failure-callback")
 
+        initial_payload = (
+            initial_payload_parser(raw_initial_payload)
+            if history_cache is None
+            else history_cache._get_initial_payload(
+                cached_run, raw_initial_payload, initial_payload_parser
+            )
+        )
+
         workflow_context = WorkflowContext(
             qstash_client=qstash_client,
             workflow_run_id=workflow_run_id,
-            initial_payload=initial_payload_parser(raw_initial_payload),
+            initial_payload=initial_payload,
             headers=_recreate_user_headers(
-                {} if not request.headers else request.headers
+                {} if not request.headers else request.headers, header_filter
             ),
             steps=steps,
             url=workflow_url,
             env=env,
             retries=retries,
             failure_url=workflow_failure_url,
+            json_codec=json_codec,
+            continue_as_new_policy=continue_as_new_policy,
+            serializers=serializers,
+            output_compression=output_compression,
+            blob_offload=blob_offload,
+            run_ahead=run_ahead,
+            step_memoization=step_memoization,
+            invocation_deadline=invocation_deadline,
         )
 
         auth_check = _DisabledWorkflowContext[Any].try_authentication(
@@ -152,6 +229,8 @@ def _serve_base(
             workflow_url,
             workflow_failure_url,
             retries,
+            json_codec,
+            header_filter,
         )
 
         if call_return_check == "continue-workflow":
@@ -160,10 +239,22 @@ def _serve_base(
             else:
 
                 def on_step() -> None:
-                    route_function(workflow_context)
+                    try:
+                        route_function(workflow_context)
+                        workflow_context._executor.submit_run_ahead_steps()
+                    finally:
+                        if history_cache is not None:
+                            history_cache._put(
+                                workflow_run_id,
+                                raw_initial_payload,
+                                initial_payload,
+                                steps,
+                            )
 
                 def on_cleanup() -> None:
                     _trigger_workflow_delete(workflow_context)
+                    if history_cache is not None:
+                        history_cache._remove(workflow_run_id)
 
                 _trigger_route_function(on_step=on_step, on_cleanup=on_cleanup)
 
@@ -178,7 +269,9 @@ def _serve_base(
             _logger.exception(error)
             return cast(
                 TResponse,
-                _Response(json.dumps(_format_workflow_error(error)), status=500),
+                _Response(
+                    _format_workflow_error(error), status=500, json_codec=json_codec
+                ),
             )
 
     return {"handler": _safe_handler}
@@ -198,6 +291,16 @@ def serve(
         Callable[[WorkflowContext, int, str, Dict[str, str]], Any]
     ] = None,
     failure_url: Optional[str] = None,
+    json_codec: Optional[JsonCodec] = None,
+    history_cache: Optional[HistoryCache] = None,
+    continue_as_new_policy: Optional[ContinueAsNewPolicy] = None,
+    serializers: Optional[SerializerRegistry] = None,
+    output_compression: Optional[OutputCompression] = None,
+    blob_offload: Optional[BlobOffload] = None,
+    run_ahead: Optional[RunAheadPolicy] = None,
+    step_memoization: Optional[StepMemoization] = None,
+    invocation_deadline: Optional[InvocationDeadline] = None,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> Dict[str, Callable[[TRequest], TResponse]]:
     """
     Creates a method that handles incoming requests and runs the provided
@@ -212,6 +315,16 @@ def serve(
     :param env: Optionally, one can pass an env object mapping environment variables to their keys. Useful in cases like cloudflare with hono.
     :param retries: Number of retries to use in workflow requests, 3 by default
     :param url: Url of the endpoint where the workflow is set up. If not set, url will be inferred from the request.
+    :param json_codec: Codec used to encode and decode JSON in workflow requests. `StdlibJsonCodec` by default. `OrjsonCodec` and `MsgspecCodec` can be used for faster processing of large step histories.
+    :param history_cache: Keeps the decoded steps and the parsed initial payload of runs between requests, so that a request only decodes the steps added since the previous request of its run. See `HistoryCache`.
+    :param continue_as_new_policy: Limits of the step history after which `context.should_continue_as_new` is True, so that the route function can continue the run as new and keep the cost of replaying the history bounded. See `ContinueAsNewPolicy`.
+    :param serializers: Serializers used to publish the outputs of steps, which rebuild the outputs in their original types when steps are replayed. Dataclasses and pydantic models passed to the registry in `types`, bytes and NumPy arrays are supported by default. See `SerializerRegistry`.
+    :param output_compression: Compresses step outputs larger than its threshold before they are published, so that large outputs are smaller in every later request of the run. See `OutputCompression`.
+    :param blob_offload: Writes step outputs which are still larger than its threshold after compression to a blob store and publishes only a reference to them, so QStash messages stay small. See `BlobOffload`.
+    :param run_ahead: Executes consecutive `context.run` steps in the same request within its step and time budget, and publishes their results in a single batch instead of ending the request after every step. See `RunAheadPolicy`.
+    :param step_memoization: Shares the outputs of steps run with a `cache_key` between runs, so that a step whose output is stored is published without running its function. See `StepMemoization`.
+    :param invocation_deadline: Ends requests with `run_ahead` before a step which is estimated to exceed the time limit of the request, and executes the step in the next request instead. See `InvocationDeadline`.
+    :param header_filter: Selects the headers of the incoming request which are kept in `context.headers` and forwarded with every step, so that headers added by browsers and gateways are not published with every step. See `HeaderFilter`.
     :return: An method that consumes incoming requests and runs the workflow.
     """
     return _serve_base(
@@ -225,4 +338,14 @@ def serve(
         url=url,
         failure_function=failure_function,
         failure_url=failure_url,
+        json_codec=json_codec,
+        history_cache=history_cache,
+        continue_as_new_policy=continue_as_new_policy,
+        serializers=serializers,
+        output_compression=output_compression,
+        blob_offload=blob_offload,
+        run_ahead=run_ahead,
+        step_memoization=step_memoization,
+        invocation_deadline=invocation_deadline,
+        header_filter=header_filter,
     )
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from upstash_workflow.error import WorkflowError
+
+
+class BlobStore(ABC):
+    """
+    Stores step outputs which are too large to be published in the step.
+
+    The output is written to the store under a key and only the key is
+    published, with the name of the store as `outBlob`. Outputs are read
+    from the store of that name when they are read on replay, so every
+    endpoint replaying the run must create a store with the same name
+    reading the same data.
+
+    Store names are registered in the process when a `BlobOffload` is
+    created, so a name can only be used by a single store object.
+
+    Outputs are not deleted when the run finishes. Stores should expire or
+    clean them up on their own.
+    """
+
+    name: str
+
+    @abstractmethod
+    def put(self, key: str, value: str) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """
+        :return: stored value or None if there is no value with the key
+        """
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Stores outputs as files in a directory. Files are written to a temporary
+    file first and renamed, so a partially written output is never read.
+
+    :param directory: directory to store the outputs in. Created if it doesn't exist.
+    :param name: name of the store, published with the outputs. "fs" by default.
+    """
+
+    def __init__(self, directory: str, name: str = "fs"):
+        self.directory = os.path.abspath(directory)
+        self.name = name
+
+    def _get_path(self, key: str) -> str:
+        parts = key.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            raise WorkflowError(f"Invalid blob key '{key}'")
+        return os.path.join(self.directory, *parts)
+
+    def put(self, key: str, value: str) -> None:
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(value)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._get_path(key), encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+
+class RedisBlobStore(BlobStore):
+    """
+    Stores outputs in Redis, or in any store speaking its protocol.
+
+    The client isn't created by the store, so any client with redis-py style
+    `set(key, value, ex=...)` and `get(key)` methods can be passed, such as
+    `redis.Redis` or `upstash_redis.Redis`.
+
+    :param client: Redis client
+    :param ttl: seconds after which stored outputs expire. They don't expire if not passed.
+        Should be longer than the longest run.
+    :param prefix: prefix of the keys. "upstash-workflow:" by default.
+    :param name: name of the store, published with the outputs. "redis" by default.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        ttl: Optional[int] = None,
+        prefix: str = "upstash-workflow:",
+        name: str = "redis",
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.name = name
+
+    def put(self, key: str, value: str) -> None:
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+
+@dataclass
+class BlobOffloadStats:
+    """
+    Counters of the outputs written to the store by a `BlobOffload`.
+    """
+
+    offloaded_outputs: int = 0
+    offloaded_bytes: int = 0
+
+
+class BlobOffload:
+    """
+    Writes step outputs larger than a threshold to a blob store and publishes
+    only a reference to them.
+
+    Outputs are offloaded after they are compressed, if `output_compression`
+    is set, so only the outputs which are still too large are written to the
+    store. Their key is the workflow run id and a hash of the output. Steps
+    keep the reference when they are parsed, and the output is read from the
+    store only when the route function reads the output of the step.
+
+    In `async_serve`, outputs are written and read in the default executor of
+    the event loop.
+
+    :param store: store to write the outputs to
+    :param threshold: serialized output size in bytes from which outputs are offloaded. 256 KiB by default.
+    """
+
+    def __init__(self, store: BlobStore, threshold: int = 256 * 1024):
+        self.store = store
+        self.threshold = threshold
+        self.stats = BlobOffloadStats()
+        self._lock = threading.Lock()
+        _register_store(store)
+
+    def _offload_output(
+        self, workflow_run_id: str, out: str
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Writes the serialized output to the store if it's large enough.
+
+        :param workflow_run_id: id of the workflow run, used in the key
+        :param out: serialized output
+        :return: output or its key to publish, and the name of the store or
+            None if the output is not offloaded
+        """
+        if len(out) < self.threshold:
+            return out, None
+
+        key = f"{workflow_run_id}/{hashlib.sha256(out.encode()).hexdigest()}"
+        self.store.put(key, out)
+
+        with self._lock:
+            self.stats.offloaded_outputs += 1
+            self.stats.offloaded_bytes += len(out)
+
+        return key, self.store.name
+
+
+_stores: Dict[str, BlobStore] = {}
+
+
+def _register_store(store: BlobStore) -> None:
+    """
+    Registers a store to read the outputs published with its name.
+
+    Raises `WorkflowError` if another store is registered with the name,
+    since outputs would be read from the wrong one.
+    """
+    registered = _stores.setdefault(store.name, store)
+    if registered is not store:
+        raise WorkflowError(
+            f"Blob store name '{store.name}' is already used by another store. "
+            "Create the store once and pass it to every BlobOffload, or give "
+            "stores different names."
+        )
+
+
+def _read_output(key: str, store_name: str, step_name: str) -> str:
+    """
+    Reads an output published with `outBlob` from its store.
+    """
+    store = _stores.get(store_name)
+    if store is None:
+        raise WorkflowError(
+            f"Output of step '{step_name}' is in blob store '{store_name}', which is not configured"
+        )
+
+    out = store.get(key)
+    if out is None:
+        raise WorkflowError(
+            f"Output of step '{step_name}' was not found in blob store '{store_name}': {key}"
+        )
+    return out
@@ -4,6 +4,7 @@ from typing import (
     Dict,
     Union,
     List,
+    Sequence,
     TypeVar,
     Generic,
     Any,
@@ -17,6 +18,7 @@ _FinishCondition = Literal[
     "fromCallback",
     "auth-fail",
     "failure-callback",
+    "workflow-already-ended",
 ]
 
 TInitialPayload = TypeVar("TInitialPayload")
@@ -80,7 +82,8 @@ class _ValidateRequestResponse:
 @dataclass
 class _ParseRequestResponse:
     raw_initial_payload: str
-    steps: List[DefaultStep]
+    steps: Sequence[DefaultStep]
+    workflow_run_ended: bool = False
 
 
 @dataclass
@@ -100,3 +103,117 @@ class CallResponseDict(TypedDict):
     status: int
     body: Any
     header: Dict[str, List[str]]
+
+
+@dataclass
+class ContinueAsNewPolicy:
+    """
+    Limits after which a run should continue as a new run.
+
+    Every request of a run replays the whole history, so long running loops
+    get slower with every step. Once the run has executed `max_steps` steps
+    or its history reaches `max_history_bytes`, `context.should_continue_as_new`
+    is True. The route function checks it where it can carry its state forward,
+    typically at the start of a loop, and calls `context.continue_as_new`:
+
+    ```python
+    while cursor is not None:
+        if context.should_continue_as_new:
+            context.continue_as_new({"cursor": cursor, "total": total})
+        cursor, total = context.run("fetch", lambda: fetch(cursor, total))
+    ```
+
+    Runs are not continued automatically, since only the route function knows
+    the state which the new run has to start from.
+
+    :param max_steps: number of steps executed in the run
+    :param max_history_bytes: size of the history in bytes as received from QStash
+    """
+
+    max_steps: Optional[int] = None
+    max_history_bytes: Optional[int] = None
+
+    def _is_exceeded(self, step_count: int, history_size: int) -> bool:
+        return (self.max_steps is not None and step_count >= self.max_steps) or (
+            self.max_history_bytes is not None
+            and history_size >= self.max_history_bytes
+        )
+
+
+@dataclass
+class RunAheadPolicy:
+    """
+    Executes consecutive `context.run` steps in the same request and
+    publishes their results together.
+
+    Without it, every step ends the request: its result is published and the
+    next step runs in the next request, after the whole history is replayed.
+    With it, `Run` steps keep being executed until `max_steps` steps are
+    executed or `max_seconds` pass since the first of them, or a step of
+    another type is reached. Then the results are published in a single
+    batch, along with the step which ended the run-ahead.
+
+    A step is only considered executed once its result is published, like
+    without run-ahead: if the request fails, the steps executed in it are
+    executed again. Requests whose history doesn't hold every result
+    published in a batch yet end without executing any step, so steps are
+    not executed twice.
+
+    Outputs are serialized and deserialized before they are returned to
+    the workflow, so they are the same as when the steps are replayed.
+
+    :param max_steps: maximum number of steps executed in a request. 10 by default.
+    :param max_seconds: time in seconds after which no more steps are executed in
+        the request. 1 second by default.
+    """
+
+    max_steps: int = 10
+    max_seconds: float = 1.0
+
+
+@dataclass
+class HeaderFilter:
+    """
+    Selects the headers of the incoming request which are kept in
+    `context.headers` and forwarded with every step.
+
+    Every header in `context.headers` is published with every step message,
+    once to be forwarded to the workflow endpoint and once more to be
+    forwarded to the failure callback, so headers added by browsers, proxies
+    and API gateways are sent with every step of the run.
+
+    Header names are matched case-insensitively. A name ending with `*`
+    matches every header starting with it, like "sec-ch-*".
+
+    :param allow: headers to keep. If set, every other header is dropped.
+    :param deny: headers to drop, even if they are allowed.
+    """
+
+    allow: Optional[Sequence[str]] = None
+    deny: Optional[Sequence[str]] = None
+
+    def __post_init__(self) -> None:
+        self._allow = None if self.allow is None else _HeaderPatterns(self.allow)
+        self._deny = None if self.deny is None else _HeaderPatterns(self.deny)
+
+    def _filter(self, headers: Dict[str, str]) -> Dict[str, str]:
+        return {
+            header: value
+            for header, value in headers.items()
+            if (self._allow is None or self._allow._matches(header))
+            and (self._deny is None or not self._deny._matches(header))
+        }
+
+
+class _HeaderPatterns:
+    def __init__(self, patterns: Sequence[str]):
+        self._names = {
+            pattern.lower() for pattern in patterns if not pattern.endswith("*")
+        }
+        self._prefixes = tuple(
+            pattern[:-1].lower() for pattern in patterns if pattern.endswith("*")
+        )
+
+    def _matches(self, header: str) -> bool:
+        header = header.lower()
+        return header in self._names or header.startswith(self._prefixes)
@@ -12,6 +12,10 @@ def _nanoid() -> str:
     return "".join([secrets.choice(NANOID_CHARS) for _ in range(NANOID_LENGTH)])
 
 
+def _decode_base64_bytes(base64_str: str) -> bytes:
+    return base64.b64decode(base64_str)
+
+
 def _decode_base64(base64_str: str) -> str:
     try:
         decoded_bytes = base64.b64decode(base64_str)
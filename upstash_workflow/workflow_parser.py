@@ -1,7 +1,6 @@
-import json
 from typing import (
-    Optional,
     List,
+    Optional,
     Tuple,
     Union,
     Callable,
@@ -11,32 +10,36 @@ from typing import (
     TypeVar,
     cast,
 )
-from upstash_workflow.utils import _nanoid, _decode_base64
+from upstash_workflow.utils import _nanoid, _decode_base64, _decode_base64_bytes
 from upstash_workflow.constants import (
     WORKFLOW_PROTOCOL_VERSION,
     WORKFLOW_PROTOCOL_VERSION_HEADER,
     WORKFLOW_FAILURE_HEADER,
     WORKFLOW_ID_HEADER,
-    NO_CONCURRENCY,
 )
 from qstash import QStash
+from qstash.errors import QStashError
 from upstash_workflow.error import WorkflowError
 from upstash_workflow.types import (
-    Step,
-    DefaultStep,
+    HeaderFilter,
     _ValidateRequestResponse,
     _ParseRequestResponse,
 )
+from upstash_workflow.history import _StepHistory, _StepFields
+from upstash_workflow.codec import JsonCodec
 from upstash_workflow.workflow_types import _SyncRequest, _AsyncRequest
 from upstash_workflow import WorkflowContext
 from upstash_workflow.workflow_requests import _recreate_user_headers
 from upstash_workflow.serve.authorization import _DisabledWorkflowContext
 
 
-def _get_payload(request: _SyncRequest) -> Optional[str]:
+def _get_payload(request: _SyncRequest) -> Optional[Union[str, bytes]]:
     """
     Gets the request body. If that fails, returns None
 
+    The body is returned as it is received. Bytes are not decoded, they are
+    passed to the JSON codec directly.
+
     :param request: request received in the workflow api
     :return: request body
     """
@@ -46,69 +49,113 @@ def _get_payload(request: _SyncRequest) -> Optional[str]:
         return None
 
 
-def _parse_payload(raw_payload: str) -> Tuple[str, List[DefaultStep]]:
+def _parse_payload(
+    raw_payload: Union[str, bytes],
+    json_codec: JsonCodec,
+    known_steps: Optional[Dict[str, _StepFields]] = None,
+) -> Tuple[str, _StepHistory]:
     """
-    Parses a request coming from QStash. First parses the string as JSON, which will result
+    Parses a request coming from QStash. First parses the body as JSON, which will result
     in a list of objects with messageId & body fields. Body will be base64 encoded.
 
     Body of the first item will be the body of the first request received in the workflow API.
     Rest are steps in Upstash Workflow Step format.
 
-    When returning steps, we add the initial payload as initial step. This is to make it simpler
-    in the rest of the code.
+    Only the initial payload is decoded here. Steps are decoded by the returned
+    history when they are accessed. The initial payload is added as the initial
+    step in the history to make it simpler in the rest of the code.
 
-    :param raw_payload: body of the request as a string as explained above
-    :return: initial payload and list of steps
+    :param raw_payload: body of the request as explained above
+    :param json_codec: codec to decode the payload and the steps with
+    :param known_steps: steps decoded by earlier requests, keyed by message id
+    :return: initial payload and the step history
     """
-    raw_steps = [step for step in json.loads(raw_payload)]
+    return _parse_messages(json_codec.loads(raw_payload), json_codec, known_steps)
 
-    encoded_initial_payload, *encoded_steps = raw_steps
 
-    raw_initial_payload = _decode_base64(encoded_initial_payload["body"])
+def _parse_messages(
+    messages: List[Dict[str, Any]],
+    json_codec: JsonCodec,
+    known_steps: Optional[Dict[str, _StepFields]] = None,
+) -> Tuple[str, _StepHistory]:
+    """
+    Creates the step history from the messages of a run, either parsed from
+    the request body or fetched from QStash.
+
+    :param messages: list of objects with messageId, body & callType fields
+    :param json_codec: codec to decode the steps with
+    :param known_steps: steps decoded by earlier requests, keyed by message id
+    :return: initial payload and the step history
+    """
+    encoded_initial_payload, *encoded_steps = messages
 
-    initial_step = {
-        "stepId": 0,
-        "stepName": "init",
-        "stepType": "Initial",
-        "out": raw_initial_payload,
-        "concurrent": NO_CONCURRENCY,
-    }
+    raw_initial_payload = _decode_base64(encoded_initial_payload["body"])
 
     steps_to_decode = [step for step in encoded_steps if step["callType"] == "step"]
 
-    other_steps = []
-    for raw_step in steps_to_decode:
-        step = json.loads(_decode_base64(raw_step["body"]))
-
-        try:
-            step["out"] = json.loads(step["out"])
-        except json.JSONDecodeError:
-            pass
-
-        if step.get("waitEventId", None):
-            new_out = {
-                "event_data": _decode_base64(step["out"]) if step["out"] else None,
-                "timeout": step.wait_timeout or False,
-            }
-            step["out"] = new_out
-
-        other_steps.append(step)
-
-    all_steps = [initial_step] + other_steps
-
-    parsed_steps: List[DefaultStep] = []
-    for step in all_steps:
-        parsed_steps.append(
-            Step(
-                step_id=step["stepId"],
-                step_name=step["stepName"],
-                step_type=step["stepType"],
-                out=step["out"],
-                concurrent=step["concurrent"],
-            )
+    return raw_initial_payload, _StepHistory(
+        raw_initial_payload, steps_to_decode, json_codec, known_steps
+    )
+
+
+def _get_steps(
+    qstash_client: QStash,
+    workflow_run_id: str,
+    message_id: Optional[str],
+    json_codec: JsonCodec,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Fetches the messages of a workflow run from QStash.
+
+    When the history of a run is too large, QStash calls the workflow endpoint
+    with an empty body instead of sending the history (LazyFetch feature).
+    The steps are fetched from the workflows API in this case. Since the run
+    may have progressed since the request was sent, messages after the
+    message of the request are dropped.
+
+    :param qstash_client: QStash client
+    :param workflow_run_id: id of the workflow run
+    :param message_id: id of the message which triggered the request
+    :param json_codec: codec to decode the response with
+    :return: messages of the run or None if the run has already ended
+    """
+    try:
+        response = qstash_client.http.request(
+            path=f"/v2/workflows/runs/{workflow_run_id}",
+            method="GET",
+            parse_response=False,
         )
+    except QStashError as error:
+        if _is_not_found_error(error):
+            return None
+        raise error
+
+    return _filter_messages(json_codec.loads(response), message_id)
+
+
+def _filter_messages(
+    messages: List[Dict[str, Any]], message_id: Optional[str]
+) -> List[Dict[str, Any]]:
+    """
+    Returns the messages up to and including the message with the given id.
+
+    Raises `WorkflowError` if there is no such message.
+    """
+    if not message_id:
+        return messages
 
-    return raw_initial_payload, parsed_steps
+    for index, message in enumerate(messages):
+        if message.get("messageId") == message_id:
+            return messages[: index + 1]
+
+    raise WorkflowError(
+        f"Couldn't find the message {message_id} in the steps of the workflow run"
+    )
+
+
+def _is_not_found_error(error: QStashError) -> bool:
+    # QStashError doesn't keep the status code, it's only in the message
+    return str(error).startswith("Request failed with status: 404")
 
 
 def _validate_request(
@@ -159,27 +206,56 @@ def _validate_request(
 
 
 def _parse_request(
-    request_payload: Optional[str], is_first_invocation: bool
+    request_payload: Optional[Union[str, bytes]],
+    is_first_invocation: bool,
+    json_codec: JsonCodec,
+    known_steps: Optional[Dict[str, _StepFields]] = None,
+    qstash_client: Optional[QStash] = None,
+    workflow_run_id: str = "",
+    message_id: Optional[str] = None,
 ) -> _ParseRequestResponse:
     """
     Checks request headers and body
     - Reads the request body as raw text
     - Returns the steps. If it's the first invocation, steps are empty.
-      Otherwise, steps are generated from the request body.
+      Otherwise, steps are generated from the request body. If the body is
+      empty, steps are fetched from QStash using the qstash_client.
 
     :param request: Request received
+    :param json_codec: codec to decode the request body with
+    :param known_steps: steps decoded by earlier requests, keyed by message id
+    :param qstash_client: QStash client to fetch the steps with
+    :param workflow_run_id: id of the workflow run
+    :param message_id: id of the message which triggered the request
     :return: raw initial payload and the steps
     """
     if is_first_invocation:
+        if isinstance(request_payload, bytes):
+            request_payload = request_payload.decode()
         return _ParseRequestResponse(
             raw_initial_payload=(request_payload or ""),
             steps=[],
         )
     else:
         if not request_payload:
-            raise WorkflowError("Only first call can have an empty body")
+            if qstash_client is None:
+                raise WorkflowError("Only first call can have an empty body")
 
-        raw_initial_payload, steps = _parse_payload(request_payload)
+            messages = _get_steps(
+                qstash_client, workflow_run_id, message_id, json_codec
+            )
+            if messages is None:
+                return _ParseRequestResponse(
+                    raw_initial_payload="", steps=[], workflow_run_ended=True
+                )
+
+            raw_initial_payload, steps = _parse_messages(
+                messages, json_codec, known_steps
+            )
+        else:
+            raw_initial_payload, steps = _parse_payload(
+                request_payload, json_codec, known_steps
+            )
 
         return _ParseRequestResponse(
             raw_initial_payload=raw_initial_payload, steps=steps
@@ -192,7 +268,7 @@ TRequest = TypeVar("TRequest", bound=_SyncRequest)
 
 def _handle_failure(
     request: TRequest,
-    request_payload: str,
+    request_payload: Union[str, bytes],
     qstash_client: QStash,
     initial_payload_parser: Callable[[str], Any],
     route_function: Callable[[WorkflowContext[TInitialPayload]], None],
@@ -201,6 +277,8 @@ def _handle_failure(
     ],
     env: Dict[str, Any],
     retries: int,
+    json_codec: JsonCodec,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> Literal["not-failure-callback", "is-failure-callback"]:
     if request.headers and request.headers.get(WORKFLOW_FAILURE_HEADER) != "true":
         return "not-failure-callback"
@@ -213,7 +291,7 @@ def _handle_failure(
         )
 
     try:
-        payload = json.loads(request_payload)
+        payload = json_codec.loads(request_payload)
         status = payload["status"]
         header = payload["header"]
         body = payload["body"]
@@ -221,8 +299,8 @@ def _handle_failure(
         source_body = payload["sourceBody"]
         workflow_run_id = payload["workflowRunId"]
 
-        decoded_body = _decode_base64(body) if body else "{}"
-        error_payload = json.loads(decoded_body)
+        decoded_body = _decode_base64_bytes(body) if body else b"{}"
+        error_payload = json_codec.loads(decoded_body)
 
         # Create context
         workflow_context = WorkflowContext(
@@ -231,12 +309,13 @@ def _handle_failure(
             initial_payload=initial_payload_parser(_decode_base64(source_body))
             if source_body
             else None,
-            headers=_recreate_user_headers(request.headers or {}),
+            headers=_recreate_user_headers(request.headers or {}, header_filter),
             steps=[],
             url=url,
             failure_url=url,
             env=env,
             retries=retries,
+            json_codec=json_codec,
         )
 
         # Attempt running route_function until the first step
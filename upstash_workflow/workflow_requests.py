@@ -4,6 +4,7 @@ import base64
 import logging
 from typing import (
     TYPE_CHECKING,
+    Any,
     Callable,
     Literal,
     Optional,
@@ -14,7 +15,9 @@ from typing import (
 )
 from qstash import QStash, Receiver
 from upstash_workflow.error import WorkflowError, WorkflowAbort
+from upstash_workflow.codec import JsonCodec
 from upstash_workflow.constants import (
+    OUTPUT_ENCODING_JSON,
     WORKFLOW_INIT_HEADER,
     WORKFLOW_ID_HEADER,
     WORKFLOW_URL_HEADER,
@@ -25,7 +28,12 @@ from upstash_workflow.constants import (
     DEFAULT_CONTENT_TYPE,
     DEFAULT_RETRIES,
 )
-from upstash_workflow.types import StepTypes, DefaultStep, _HeadersResponse
+from upstash_workflow.types import (
+    StepTypes,
+    DefaultStep,
+    HeaderFilter,
+    _HeadersResponse,
+)
 from upstash_workflow.workflow_types import _SyncRequest
 
 if TYPE_CHECKING:
@@ -56,6 +64,40 @@ def _trigger_first_invocation(
     )
 
 
+def _trigger_continue_as_new(
+    workflow_context: WorkflowContext[TInitialPayload],
+    workflow_run_id: str,
+    payload: Any,
+) -> None:
+    """
+    Starts a new run of the workflow with the payload, the same way the first
+    invocation of a run is triggered.
+
+    The message is deduplicated by the id of the current run, so that a retry
+    of the request which continued the run doesn't start a second new run.
+
+    :param workflow_context: context of the run which continues as new
+    :param workflow_run_id: id of the new run
+    :param payload: initial payload of the new run
+    """
+    headers = _get_headers(
+        "true",
+        workflow_run_id,
+        workflow_context.url,
+        workflow_context.headers,
+        None,
+        workflow_context.retries,
+        workflow_failure_url=workflow_context.failure_url,
+    ).headers
+
+    workflow_context.qstash_client.message.publish_json(
+        url=workflow_context.url,
+        body=payload,
+        headers=headers,
+        deduplication_id=f"{workflow_context.workflow_run_id}-continue-as-new",
+    )
+
+
 def _trigger_route_function(
     on_step: Callable[[], None], on_cleanup: Callable[[], None]
 ) -> None:
@@ -67,6 +109,8 @@ def _trigger_route_function(
         on_cleanup()
     except Exception as error:
         if isinstance(error, WorkflowAbort):
+            if error.finish_workflow:
+                on_cleanup()
             return
         raise error
 
@@ -82,11 +126,14 @@ def _trigger_workflow_delete(
     )
 
 
-def _recreate_user_headers(headers: Dict[str, str]) -> Dict[str, str]:
+def _recreate_user_headers(
+    headers: Dict[str, str], header_filter: Optional[HeaderFilter] = None
+) -> Dict[str, str]:
     """
     Removes headers starting with `Upstash-Workflow-` from the headers
 
     :param headers: incoming headers
+    :param header_filter: filter selecting the headers to keep
     :return: headers with `Upstash-Workflow-` headers removed
     """
     filtered_headers = {}
@@ -110,7 +157,11 @@ def _recreate_user_headers(headers: Dict[str, str]) -> Dict[str, str]:
         ):
             filtered_headers[header] = value
 
-    return filtered_headers
+    return (
+        filtered_headers
+        if header_filter is None
+        else header_filter._filter(filtered_headers)
+    )
 
 
 def _handle_third_party_call_result(
@@ -120,6 +171,8 @@ def _handle_third_party_call_result(
     workflow_url: str,
     workflow_failure_url: Optional[str],
     retries: int,
+    json_codec: JsonCodec,
+    header_filter: Optional[HeaderFilter] = None,
 ) -> Literal["call-will-retry", "is-call-return", "continue-workflow"]:
     """
     Check if the request is from a third party call result. If so,
@@ -141,6 +194,8 @@ def _handle_third_party_call_result(
     :param client: QStash client
     :param workflow_url: Workflow URL
     :param retries: Number of retries
+    :param json_codec: codec to decode the callback and encode the call result with
+    :param header_filter: filter selecting the user headers forwarded with the result
     :return: "call-will-retry", "is-call-return" or "continue-workflow"
     """
     try:
@@ -150,7 +205,7 @@ def _handle_third_party_call_result(
             else:
                 raise NotImplementedError
 
-            callback_message = json.loads(callback_payload)
+            callback_message = json_codec.loads(callback_payload)
 
             if (
                 not (200 <= callback_message["status"] < 300)
@@ -205,7 +260,7 @@ def _handle_third_party_call_result(
             concurrent_str = cast(str, concurrent_str)
             content_type = cast(str, content_type)
 
-            user_headers = _recreate_user_headers(headers)
+            user_headers = _recreate_user_headers(headers, header_filter)
             request_headers = _get_headers(
                 "false",
                 workflow_run_id,
@@ -226,7 +281,8 @@ def _handle_third_party_call_result(
                 "stepId": int(step_id_str),
                 "stepName": step_name,
                 "stepType": step_type,
-                "out": json.dumps(call_response),
+                "out": json_codec.dumps(call_response),
+                "outEncoding": OUTPUT_ENCODING_JSON,
                 "concurrent": int(concurrent_str),
             }
 
@@ -392,11 +448,16 @@ def _get_headers(
 
 
 def _verify_request(
-    body: str, signature: Union[str, None], verifier: Optional[Receiver]
+    body: Union[str, bytes], signature: Union[str, None], verifier: Optional[Receiver]
 ) -> None:
     if not verifier:
         return
 
+    # Receiver expects the body as a string. Decode it only when verifying
+    # so that the body isn't copied when verification is disabled.
+    if isinstance(body, bytes):
+        body = body.decode()
+
     try:
         if not signature:
             raise Exception("`Upstash-Signature` header is not passed.")
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
-from typing import Any, Dict, Optional
-import json
+from typing import Any, AsyncIterator, Dict, Optional, Union
+from upstash_workflow.codec import JsonCodec, StdlibJsonCodec
 
 
 @dataclass
@@ -10,16 +10,24 @@ class _Response:
     headers: Optional[Dict[str, str]] = None
 
     def __init__(
-        self, body: Any, status: int = 200, headers: Optional[Dict[str, str]] = None
+        self,
+        body: Any,
+        status: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        json_codec: Optional[JsonCodec] = None,
     ):
-        self.body = json.dumps(body) if not isinstance(body, str) else body
+        self.body = (
+            (json_codec or StdlibJsonCodec()).dumps(body)
+            if not isinstance(body, str)
+            else body
+        )
         self.status = status
         self.headers = headers or {"Content-Type": "application/json"}
 
 
 @dataclass
 class _SyncRequest:
-    body: str = ""
+    body: Union[str, bytes] = b""
     headers: Optional[Dict[str, str]] = field(default_factory=dict)
     query: Optional[Dict[str, str]] = field(default_factory=dict)
     method: str = "GET"
@@ -36,3 +44,6 @@ class _AsyncRequest:
 
     async def body(self) -> bytes:
         return self._body
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        yield self._body